@@ -1,12 +1,16 @@
 import streamlit as st
 import openai
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
-import os, datetime, pickle, time
+import os, datetime, pickle, time, threading, functools
 import google.generativeai as genai
 import anthropic
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from dotenv import load_dotenv
+from rag_components.usage_ledger import get_usage_ledger
+from rag_components.embeddings import DEFAULT_EMBEDDING_MODEL, get_embeddings, resolve_embedding_model
+from rag_components.text_splitter import get_encoding
+from rag_components.streaming_moderation import ModeratedStream
+from rag_components.session_store import StaleSessionError
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,6 +20,17 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 genai.configure(api_key=GOOGLE_API_KEY)
 
 
+def synchronized(method):
+    """Run an AIAgent method while holding the agent's turn lock, so turns from concurrent reruns or tabs are serialized."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.turn_lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class Document:
     """Document class for storing text and metadata together.  This is used for storing long-term memory."""
 
@@ -30,21 +45,52 @@ class AIAgent:
     Intialize with a character description, Defaults to: 'an attractive friend with a hidden crush'
     """
 
+    # scalar attributes written to the session store after every turn
+    session_state_attrs = [
+        "embedding_model",
+        "character",
+        "location",
+        "user_name",
+        "character_name",
+        "prefix",
+        "short_term_memory",
+        "mid_term_memory",
+        "long_term_memories",
+        "current_memory_id",
+        "message_style_sample",
+        "response",
+        "model",
+        "summary_model",
+        "model_prompt",
+        "total_cost",
+        "average_cost",
+        "total_tokens",
+        "average_tokens",
+        "current_memory_tokens",
+    ]
+
     def __init__(
         self,
         model="gpt-5-mini",
-        embedding_model="gpt",
+        embedding_model=None,
         summary_model="gpt-5-mini",
         model_prompt=None
     ):
+        # Reentrant lock serializing turns and memory updates for this agent
+        self.turn_lock = threading.RLock()
+        # Short-lived lock guarding chat history and statistics, so readers never wait for a whole turn
+        self.state_lock = threading.Lock()
+
         # Initialize the AI agent
         self.set_model(model, model_prompt)
 
         # initialize the summary model
         self.set_summary_model(summary_model)
 
-        # Initialize the embeddings model
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+        # Initialize the embeddings model (EMBEDDING_MODEL by default).  Saved and stored sessions keep
+        # the model their long-term memories were embedded with, see load_agent and attach_session_store.
+        self.embedding_model = resolve_embedding_model(embedding_model)
+        self.embeddings = get_embeddings(self.embedding_model)
 
         # Set the character for the AI to role-play as
         self.character = (
@@ -115,6 +161,16 @@ class AIAgent:
 
         # NSFW filter
         self.nsfw = False
+        self.response_flagged = False
+        self.flagged_message = "[System]: I'm sorry, this response has been flagged as NSFW and cannot be shown."
+
+        # external session store (see attach_session_store)
+        self.session_store = None
+        self.session_id = None
+        self.persisted_history_length = 0
+        self.unsaved_memories = []
+        # last session store failure, shown by the app (see take_session_error)
+        self.session_error = None
 
     def set_system_message(self) -> None:
         """Include dynamic elements in the system prompt.  Returns the system message."""
@@ -151,6 +207,7 @@ class AIAgent:
             + " ",
         }
 
+    @synchronized
     def set_model(self, model="gpt-3.5-turbo-0125", model_prompt=None) -> None:
         """Change the model the AI uses to generate responses.  Defaults to: 'open-mistral-7b'"""
         self.model = model
@@ -187,6 +244,7 @@ class AIAgent:
                 api_key=api_key, base_url="https://api.together.xyz/v1"
             )
 
+    @synchronized
     def set_summary_model(self, summary_model="gpt-3.5-turbo-0125") -> None:
         """Change the model the AI uses to summarize conversations.  Defaults to: 'open-mistral-7b'"""
         self.summary_model = summary_model
@@ -239,7 +297,8 @@ class AIAgent:
         """Adds a message to the AI's short term memory.
         The message is a string of text and the role is either 'user' or 'assistant'."""
 
-        self.chat_history.append({"role": role, "content": text})
+        with self.state_lock:
+            self.chat_history.append({"role": role, "content": text})
 
         # add a message to the AI's short term memory
         if role == "user":
@@ -259,6 +318,7 @@ class AIAgent:
 
         self.prefix = f""" Do not repeat phrases from your most recent response: """
 
+    @synchronized
     def summarize_memories(self, max_tokens=150, temperature=0, top_p=0.05) -> None:
         """Summarize the short-term memory and add it to the mid-term memory.
         Also add the mid-term memory to the long-term memory.  Returns nothing."""
@@ -298,6 +358,7 @@ class AIAgent:
         original_summary_model = self.summary_model
 
         # Choose the model to use for summarization and summarize the conversation
+        start_time = time.time()
         if "gemini" in self.summary_model:
             try:
 
@@ -369,9 +430,10 @@ class AIAgent:
             )
             summary = response.choices[0].message.content
 
+        latency = time.time() - start_time
         print(f"LATEST SUMMARY: {summary}")
         # add cost of message to total cost
-        self.count_cost(response, self.summary_model, summary=True)
+        self.count_cost(response, self.summary_model, summary=True, latency=latency)
         # add the current mid-term memory to the long-term memory
         if self.mid_term_memory != "nothing yet.":
             self.add_long_term_memory(self.mid_term_memory)
@@ -390,26 +452,29 @@ class AIAgent:
         if not self.summary_model == original_summary_model:
             self.set_summary_model(original_summary_model)
 
+    @synchronized
     def add_long_term_memory(self, memory) -> None:
         """add a memory to the long-term memory vector store.  Returns nothing."""
 
         metadata = {}
 
-        memory_document = Document(memory, metadata, self.current_memory_id)
-        self.current_memory_id += 1
-
         # Use the OpenAIEmbeddings object for generating the embedding
+        embedding = self.embeddings.embed_documents([memory])[0]
 
         if not hasattr(self, "long_term_memory_index"):
 
-            self.long_term_memory_index = FAISS.from_documents(
-                [memory_document], self.embeddings
+            self.long_term_memory_index = FAISS.from_embeddings(
+                [(memory, embedding)], self.embeddings, metadatas=[metadata]
             )
         else:
-            self.long_term_memory_index.add_documents(
-                [memory_document], encoder=self.embeddings
+            self.long_term_memory_index.add_embeddings(
+                [(memory, embedding)], metadatas=[metadata]
             )
 
+        # keep the embedding so the session store can persist it without re-embedding
+        self.unsaved_memories.append((self.current_memory_id, memory, embedding))
+        self.current_memory_id += 1
+
     def query_long_term_memory(self, query, k=3) -> list:
         """Query the long-term memory for similar documents.  Returns a list of Document objects."""
         try:
@@ -422,10 +487,10 @@ class AIAgent:
             print(e)
             return []
 
-    def count_cost(self, result, model, summary=False) -> float:
+    def count_cost(self, result, model, summary=False, latency=None) -> float:
         """Count the cost of the messages.
         The cost is calculated as the number of tokens in the input and output times the cost per token.
-        Returns the cost."""
+        The call is also recorded in the usage ledger.  Returns the cost."""
 
         # cost is calculated as the number of tokens in the input and output times the cost per token
         if model.startswith("gpt-3"):
@@ -463,30 +528,53 @@ class AIAgent:
             input_cost = 0
             output_cost = 0
 
+        cached_tokens = 0
         if "gemini" in model:
             messages = self.format_messages_for_gemini(self.messages)
             agent = genai.GenerativeModel(model_name=model)
             input_tokens = agent.count_tokens(messages[:-1]).total_tokens
             output_tokens = agent.count_tokens([messages[-1]]).total_tokens
 
+        elif result is None or getattr(result, "usage", None) is None:
+            # No usage reported (the provider ignored include_usage): estimate it with tiktoken
+            encoding = get_encoding(model)
+            input_tokens = sum(
+                len(encoding.encode(message["content"], disallowed_special=())) for message in self.messages[:-1]
+            )
+            output_tokens = len(encoding.encode(self.messages[-1]["content"], disallowed_special=()))
+
         elif "claude" in model:
             input_tokens = result.usage.input_tokens
             output_tokens = result.usage.output_tokens
+            cached_tokens = getattr(result.usage, "cache_read_input_tokens", 0) or 0
 
         else:
             input_tokens = result.usage.prompt_tokens
             output_tokens = result.usage.completion_tokens
+            prompt_details = getattr(result.usage, "prompt_tokens_details", None)
+            cached_tokens = getattr(prompt_details, "cached_tokens", 0) or 0
 
         total_tokens = input_tokens + output_tokens
         lastest_cost = input_cost * input_tokens + output_cost * output_tokens
 
-        self.total_cost += lastest_cost
-        # determine the length of inputs and outputs
-        self.average_cost = self.total_cost / (len(self.chat_history) / 2)
-        self.total_tokens += total_tokens
-        self.average_tokens = self.total_tokens / (len(self.chat_history) / 2)
-        if not summary:
-            self.current_memory_tokens = total_tokens
+        with self.state_lock:
+            self.total_cost += lastest_cost
+            # determine the length of inputs and outputs
+            self.average_cost = self.total_cost / (len(self.chat_history) / 2)
+            self.total_tokens += total_tokens
+            self.average_tokens = self.total_tokens / (len(self.chat_history) / 2)
+            if not summary:
+                self.current_memory_tokens = total_tokens
+
+        get_usage_ledger().record(
+            model=model,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cached_tokens=cached_tokens,
+            cost=lastest_cost,
+            latency=latency,
+            feature="chat_summary" if summary else "chat",
+        )
 
         # calculate the cost
         return lastest_cost
@@ -502,19 +590,9 @@ class AIAgent:
                 message["role"] = "model"
         return messages
 
-    def query(
-        self,
-        prompt,
-        temperature=0.3,
-        top_p=None,
-        frequency_penalty=0,
-        presence_penalty=0,
-        max_tokens=200,
-    ) -> str:
-        """Query the model for a response to a prompt.  The prompt is a string of text that the AI will respond to.
-        The temperature is the degree of randomness of the model's output.  The lower the temperature, the more deterministic the output.
-        The higher the temperature, the more random the output.  The default temperature is .3.  The response is a string of text.
-        """
+    def prepare_messages(self, prompt) -> str:
+        """Retrieve relevant long-term memories and build the full message list for a prompt.
+        Returns the formatted user prompt."""
 
         prompt = f"[{self.user_name}]: {prompt} "
         self.messages = []
@@ -543,7 +621,64 @@ class AIAgent:
                 "content": self.start_ins + self.prefix + prompt + self.end_ins,
             }
         )
+        return prompt
+
+    def gemini_safety_settings(self):
+        """Safety settings for Gemini models: unfiltered in NSFW mode, the model's defaults otherwise."""
+        if self.nsfw:
+            return {
+                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+            }
+        return None
+
+    def complete_turn(self, prompt, content, result, latency=None) -> str:
+        """Record a moderated response: update memories, history, costs and the session store.
+        Returns the response."""
+
+        self.response = content
+
+        if self.message_style_sample == None:
+            self.message_style_sample = f"An example of how your character speaks is here inside triple backticks ```{self.response}```"
+
+        # add response to current message history
+        self.messages.append({"role": "assistant", "content": self.response})
+
+        # Add user prompt to message history
+        self.add_message(prompt, role="user")
+
+        # Add reply to message history
+        self.add_message(self.response, role="assistant")
+
+        self.count_cost(result, self.model, latency=latency)
+
+        if len(self.short_term_memory) >= self.max_short_term_memory_length:
+            self.summarize_memories()
+
+        self.persist_session()
+
+        return self.response
+
+    @synchronized
+    def query(
+        self,
+        prompt,
+        temperature=0.3,
+        top_p=None,
+        frequency_penalty=0,
+        presence_penalty=0,
+        max_tokens=200,
+    ) -> str:
+        """Query the model for a response to a prompt.  The prompt is a string of text that the AI will respond to.
+        The temperature is the degree of randomness of the model's output.  The lower the temperature, the more deterministic the output.
+        The higher the temperature, the more random the output.  The default temperature is .3.  The response is a string of text.
+        """
+
+        prompt = self.prepare_messages(prompt)
         # Query the model through the API
+        start_time = time.time()
         if "gemini" in self.model:
             # attempt to query the Gemini model
             # configure the model with system instruction
@@ -558,15 +693,7 @@ class AIAgent:
                 max_output_tokens=max_tokens,
                 top_p=top_p,
             )
-            if self.nsfw:
-                safety_settings = {
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-                }
-            else:
-                safety_settings = None
+            safety_settings = self.gemini_safety_settings()
             # format the messages for the Gemini model
             gemini_messages = self.format_messages_for_gemini(self.messages[1:])
             ## attempt to query the model
@@ -612,43 +739,159 @@ class AIAgent:
                 top_p=top_p,
             )
             content = result.choices[0].message.content
+        latency = time.time() - start_time
 
         # Check For NSFW Content
+        self.response_flagged = False
         if not self.nsfw:
             moderation = openai.OpenAI().moderations.create(input=content)
             flagged = moderation.results[0].flagged
             if flagged:
+                self.response_flagged = True
+                return self.flagged_message
 
-                return "[System]: I'm sorry, this response has been flagged as NSFW and cannot be shown."
-            else:
-                self.response = content
-        else:
-            # Store the response
-            self.response = content
+        return self.complete_turn(prompt, content, result, latency)
 
-        if self.message_style_sample == None:
-            self.message_style_sample = f"An example of how your character speaks is here inside triple backticks ```{self.response}```"
+    def stream_model_response(
+        self, temperature, top_p, frequency_penalty, presence_penalty, max_tokens, usage
+    ):
+        """Yield the model's response text as it is generated.
+        The final result carrying token usage is stored in usage["result"] for count_cost."""
 
-        # add response to current message history
-        self.messages.append({"role": "assistant", "content": self.response})
+        if "gemini" in self.model:
+            self.agent = genai.GenerativeModel(
+                model_name=self.model,
+                system_instruction=self.messages[0]["content"],
+            )
+            config = genai.GenerationConfig(
+                temperature=temperature,
+                max_output_tokens=max_tokens,
+                top_p=top_p,
+            )
+            gemini_messages = self.format_messages_for_gemini(self.messages[1:])
+            safety_settings = self.gemini_safety_settings()
+            # retry like query does, but only until some text has been yielded
+            produced = False
+            finish_reason = None
+            tries = 0
+            while not produced and tries <= 5:
+                try:
+                    response = self.agent.generate_content(
+                        contents=gemini_messages,
+                        generation_config=config,
+                        safety_settings=safety_settings,
+                        stream=True,
+                    )
+                    for chunk in response:
+                        # blocked or empty chunks have no candidates or no parts, and .text raises on them
+                        if not chunk.candidates:
+                            continue
+                        finish_reason = chunk.candidates[0].finish_reason
+                        if not chunk.candidates[0].content.parts or not chunk.text:
+                            continue
+                        produced = True
+                        yield chunk.text
+                    if not produced:
+                        tries += 1
+                        print("Gemini model produced no text, trying again")
+
+                except Exception as e:
+                    if produced:
+                        # the partial answer has already been shown; it stands as the response
+                        print(f"Gemini stream interrupted: {e}")
+                        break
+                    tries += 1
+                    print(f"Gemini model query failed, trying again: {e}")
 
-        # Add user prompt to message history
-        self.add_message(prompt, role="user")
+            if not produced:
+                if finish_reason is not None:
+                    yield f"[Gemini]: I did not respond {finish_reason}.  Please adjust your prompt and try again"
+                else:
+                    yield "[Gemini]: I did not respond.  Please adjust your prompt or change models and try again"
+            # count_cost counts Gemini tokens from self.messages
+            usage["result"] = None
 
-        # Add reply to message history
-        self.add_message(self.response, role="assistant")
+        elif "claude" in self.model:
+            with self.agent.messages.stream(
+                model=self.model,
+                system=self.messages[0]["content"],
+                messages=self.messages[1:],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+            ) as stream:
+                for text in stream.text_stream:
+                    yield text
+                usage["result"] = stream.get_final_message()
+
+        else:
+            stream = self.agent.chat.completions.create(
+                model=self.model,
+                messages=self.messages,
+                temperature=temperature,
+                frequency_penalty=frequency_penalty,
+                presence_penalty=presence_penalty,
+                max_completion_tokens=max_tokens,
+                top_p=top_p,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            for chunk in stream:
+                # the last chunk carries the token usage and no choices
+                if chunk.usage is not None:
+                    usage["result"] = chunk
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    def query_stream(
+        self,
+        prompt,
+        temperature=0.3,
+        top_p=None,
+        frequency_penalty=0,
+        presence_penalty=0,
+        max_tokens=200,
+    ):
+        """Stream the model's response to a prompt.  Same parameters as query.
+        Text is yielded window by window as each sentence-sized window clears moderation, while the model is still generating.
+        If a window is flagged, generation stops and the NSFW notice is yielded instead.  The turn is recorded when the stream completes.
+        """
 
-        self.count_cost(result, self.model)
+        # the turn lock is held for the whole stream, not just while the generator is created
+        with self.turn_lock:
+            prompt = self.prepare_messages(prompt)
+            usage = {"result": None}
+            start_time = time.time()
+            chunks = self.stream_model_response(
+                temperature, top_p, frequency_penalty, presence_penalty, max_tokens, usage
+            )
+            if not self.nsfw:
+                chunks = ModeratedStream(chunks)
 
-        if len(self.short_term_memory) >= self.max_short_term_memory_length:
-            self.summarize_memories()
+            self.response_flagged = False
+            content = ""
+            for text in chunks:
+                content += text
+                yield text
+            latency = time.time() - start_time
 
-        return self.response
+            if not self.nsfw and chunks.flagged:
+                self.response_flagged = True
+                yield "\n\n" + self.flagged_message
+                return
+
+            self.complete_turn(prompt, content, usage.get("result"), latency)
 
+    @synchronized
     def clear_history(self):
         """Clear the AI's memory.  Returns nothing."""
+        with self.state_lock:
+            self.chat_history = []
+            self.total_cost = 0
+            self.total_tokens = 0
+            self.current_memory_tokens = 0
+            self.average_tokens = 0
         self.short_term_memory = []
-        self.chat_history = []
         self.mid_term_memory = "nothing yet."
         self.long_term_memories = "nothing yet."
         self.current_memory_id = 0
@@ -656,12 +899,12 @@ class AIAgent:
         self.prefix = ""
         self.response = "I'm thinking of my response"
         self.messages = []
-        self.total_cost = 0
-        self.total_tokens = 0
-        self.current_memory_tokens = 0
-        self.average_tokens = 0
         if hasattr(self, "long_term_memory_index"):
             del self.long_term_memory_index
+        self.persisted_history_length = 0
+        self.unsaved_memories = []
+        if self.session_store is not None:
+            self.session_store.delete_session(self.session_id)
         self.set_system_message()
 
     def get_memory(self):
@@ -672,6 +915,24 @@ class AIAgent:
         """Return the AI's full chat history.  Returns a list of messages."""
         return self.chat_history
 
+    def get_stats(self) -> dict:
+        """Return a consistent snapshot of the usage statistics.  Safe to call while a turn is running."""
+        with self.state_lock:
+            return {
+                "current_memory_tokens": self.current_memory_tokens,
+                "total_cost": self.total_cost,
+                "total_tokens": self.total_tokens,
+                "average_tokens": self.average_tokens,
+                "average_cost": self.average_cost,
+                "interactions": len(self.chat_history) / 2,
+            }
+
+    def get_chat_history_snapshot(self, limit=100) -> list:
+        """Return a copy of the most recent chat messages.  Safe to call while a turn is running."""
+        with self.state_lock:
+            return list(self.chat_history[-limit:])
+
+    @synchronized
     def save_agent(self):
         """Save agent to path"""
         saved_attrs = self.__dict__.copy()
@@ -679,12 +940,18 @@ class AIAgent:
         del saved_attrs["summary_agent"]
         del saved_attrs["agent"]
         del saved_attrs["embeddings"]
+        del saved_attrs["turn_lock"]
+        del saved_attrs["state_lock"]
+        del saved_attrs["session_store"]
+        del saved_attrs["unsaved_memories"]
+        del saved_attrs["session_error"]
         if "long_term_memory_index" in saved_attrs.keys():
             saved_attrs["long_term_memory_index"] = saved_attrs[
                 "long_term_memory_index"
             ].serialize_to_bytes()
         return pickle.dumps(saved_attrs)
 
+    @synchronized
     def load_agent(self, file):
         """Load saved agent from path"""
         loaded_attrs = pickle.loads(file)
@@ -708,9 +975,10 @@ class AIAgent:
             "current_memory_tokens",
             "average_tokens",
         ]
-        for attr in attrs_to_set:
-            if attr in self.__dict__.keys():
-                setattr(self, attr, loaded_attrs[attr])
+        with self.state_lock:
+            for attr in attrs_to_set:
+                if attr in self.__dict__.keys():
+                    setattr(self, attr, loaded_attrs[attr])
 
         # for key, value in loaded_attrs.items():
         #     if key in self.__dict__.keys():
@@ -718,7 +986,10 @@ class AIAgent:
 
         self.set_summary_model(self.summary_model)
         self.set_model(self.model)
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+        # Memories saved before the model was recorded were embedded with the old default
+        if "embedding_model" in loaded_attrs or "long_term_memory_index" in loaded_attrs:
+            self.embedding_model = loaded_attrs.get("embedding_model", DEFAULT_EMBEDDING_MODEL)
+        self.embeddings = get_embeddings(self.embedding_model)
 
         # De-serialize the vector db
         if "long_term_memory_index" in loaded_attrs:
@@ -727,3 +998,133 @@ class AIAgent:
                 self.embeddings,
                 allow_dangerous_deserialization=True,
             )
+        elif hasattr(self, "long_term_memory_index"):
+            del self.long_term_memory_index
+
+        # The uploaded conversation replaces whatever was stored for this session
+        if self.session_store is not None:
+            self.session_store.delete_session(self.session_id)
+            self.persisted_history_length = 0
+            self.unsaved_memories = self.get_indexed_memories()
+            self.persist_session()
+
+    def get_indexed_memories(self) -> list:
+        """Read (memory_id, content, embedding) tuples back out of the long-term memory index."""
+        if not hasattr(self, "long_term_memory_index"):
+            return []
+        index = self.long_term_memory_index
+        memories = []
+        for position, docstore_id in sorted(index.index_to_docstore_id.items()):
+            document = index.docstore.search(docstore_id)
+            embedding = index.index.reconstruct(position).tolist()
+            memories.append((position, document.page_content, embedding))
+        return memories
+
+    @synchronized
+    def attach_session_store(self, session_store, session_id):
+        """Bind the agent to an external session store and resume the session if it exists.
+        After this, every turn is written to the store incrementally.  Returns True if a session was resumed."""
+        self.session_store = session_store
+        self.session_id = session_id
+
+        stored = session_store.load_session(session_id)
+        if stored is None:
+            self.persisted_history_length = len(self.chat_history)
+            self.unsaved_memories = self.get_indexed_memories()
+            self.persist_session()
+            return False
+
+        self.restore_session(stored)
+        return True
+
+    def restore_session(self, stored):
+        """Replace the agent's state, history and long-term memories with a stored session."""
+        state, messages, memories = stored
+        with self.state_lock:
+            for attr in self.session_state_attrs:
+                if attr in state:
+                    setattr(self, attr, state[attr])
+            self.chat_history = messages
+        self.persisted_history_length = len(messages)
+        self.unsaved_memories = []
+
+        self.set_summary_model(self.summary_model)
+        self.set_model(self.model, self.model_prompt)
+        # Query the stored memories with the model they were embedded with
+        if "embedding_model" not in state and memories:
+            self.embedding_model = DEFAULT_EMBEDDING_MODEL
+        self.embeddings = get_embeddings(self.embedding_model)
+
+        # rebuild the long-term memory index from the stored embeddings, no embedding calls needed
+        if hasattr(self, "long_term_memory_index"):
+            del self.long_term_memory_index
+        if memories:
+            self.long_term_memory_index = FAISS.from_embeddings(
+                [(content, embedding) for _, content, embedding in memories],
+                self.embeddings,
+                metadatas=[{} for _ in memories],
+            )
+        self.set_system_message()
+
+    @synchronized
+    def persist_session(self) -> None:
+        """Write the state changed since the last call to the session store, if one is attached."""
+        if self.session_store is None:
+            return
+
+        with self.state_lock:
+            state = {attr: getattr(self, attr) for attr in self.session_state_attrs}
+            new_messages = self.chat_history[self.persisted_history_length :]
+
+        try:
+            try:
+                self.session_store.save_turn(
+                    self.session_id,
+                    state,
+                    new_messages,
+                    self.persisted_history_length,
+                    self.unsaved_memories,
+                )
+            except StaleSessionError:
+                self.resync_session(new_messages)
+                return
+            self.persisted_history_length += len(new_messages)
+            self.unsaved_memories = []
+            self.session_error = None
+        except Exception as e:
+            self.session_error = e
+
+    def resync_session(self, new_messages) -> None:
+        """Another replica or tab wrote this conversation since it was loaded: reload the stored session
+        and append this agent's unsaved messages after its last message.  The unsaved long-term memories
+        are dropped, since the stored session numbered its own memories with the same ids."""
+        stored = self.session_store.load_session(self.session_id)
+        if stored is None:
+            # deleted meanwhile: write everything this agent has
+            self.persisted_history_length = 0
+            self.unsaved_memories = self.get_indexed_memories()
+        else:
+            self.restore_session(stored)
+            with self.state_lock:
+                self.chat_history = self.chat_history + new_messages
+            self.unsaved_memories = []
+
+        with self.state_lock:
+            state = {attr: getattr(self, attr) for attr in self.session_state_attrs}
+            new_messages = self.chat_history[self.persisted_history_length :]
+        # a second conflict propagates to persist_session, which reports it
+        self.session_store.save_turn(
+            self.session_id,
+            state,
+            new_messages,
+            self.persisted_history_length,
+            self.unsaved_memories,
+        )
+        self.persisted_history_length += len(new_messages)
+        self.unsaved_memories = []
+        self.session_error = None
+
+    def take_session_error(self):
+        """Return the last session store failure, if any, and clear it."""
+        error, self.session_error = self.session_error, None
+        return error
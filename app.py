@@ -2,7 +2,9 @@ import streamlit as st
 from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit import runtime
 from aiagent import AIAgent
+from rag_components.session_store import get_session_store
 import os
+import uuid
 import requests
 from dotenv import load_dotenv
 
@@ -49,6 +51,17 @@ def get_remote_ip() -> str:
 session_id = get_remote_ip()
 
 
+def get_conversation_id() -> str:
+    """Get the conversation id from the URL, creating one if needed.
+    It identifies the session in the session store, so any app replica can resume it."""
+    if "session" not in st.query_params:
+        st.query_params["session"] = uuid.uuid4().hex
+    return st.query_params["session"]
+
+
+conversation_id = get_conversation_id()
+
+
 nsfw_password = os.getenv("CHAT_NSFW_PASSWORD")
 
 
@@ -69,28 +82,51 @@ def fetch_models():
 def get_agent(
     session_id,
     model="open-mistral-7b",
-    model_prompt=None
+    model_prompt=None,
+    conversation_id=None
 ):
-    """Create an AI agent.  Returns an AIAgent object."""
+    """Create an AI agent, resuming its conversation from the session store.  Returns an AIAgent object."""
     agent = AIAgent(model=model, model_prompt=model_prompt)
+    if conversation_id:
+        try:
+            agent.attach_session_store(get_session_store(), conversation_id)
+            agent.set_model(model, model_prompt)
+        except Exception as e:
+            # shown by report_session_error; the agent still works without the store
+            agent.session_error = e
     return agent
 
 
+def report_session_error():
+    """Show the last failure to save or resume the conversation, if any.  Returns nothing."""
+    error = st.session_state["agent"].take_session_error()
+    if error is not None:
+        st.error(f"The conversation could not be saved: {error}")
+
+
 def query_agent(
-    prompt, top_p=0.0, frequency_penalty=0, presence_penalty=0
+    prompt, temperature=0.3, top_p=0.0, frequency_penalty=0, presence_penalty=0
 ):
-    """Query the AI agent.  Returns a string."""
+    """Query the AI agent, streaming the moderated response as it is generated.  Returns nothing."""
     try:
         # Converter top_p para float se for None
         if top_p is None:
             top_p = 0.0
-            
-        st.session_state["agent"].query(
+
+        stream = st.session_state["agent"].query_stream(
             prompt,
+            temperature=float(temperature),
             top_p=float(top_p) if top_p is not None else None,
             frequency_penalty=int(frequency_penalty),
             presence_penalty=int(presence_penalty),
         )
+        # show the response live; once recorded it appears in the history below instead
+        placeholder = st.empty()
+        with placeholder.container():
+            with st.chat_message("assistant"):
+                st.write_stream(stream)
+        if not st.session_state["agent"].response_flagged:
+            placeholder.empty()
     except Exception as e:
         print("failed to query the agent")
         print(e)
@@ -105,24 +141,28 @@ def set_character():
     """Set the AI's character.  Returns nothing."""
     if "character" in st.session_state:
         st.session_state["agent"].set_character(st.session_state["character"])
+        st.session_state["agent"].persist_session()
 
 
 def set_location():
     """Set the AI's location.  Returns nothing."""
     if "location" in st.session_state:
         st.session_state["agent"].set_location(st.session_state["location"])
+        st.session_state["agent"].persist_session()
 
 
 def set_user_name():
     """Set the AI's user name.  Returns nothing."""
     if "user_name" in st.session_state:
         st.session_state["agent"].set_user_name(st.session_state["user_name"])
+        st.session_state["agent"].persist_session()
 
 
 def set_character_name():
     """Set the AI's character name.  Returns nothing."""
     if "character_name" in st.session_state:
         st.session_state["agent"].set_character_name(st.session_state["character_name"])
+        st.session_state["agent"].persist_session()
 
 
 def save_character():
@@ -143,10 +183,13 @@ def change_model():
     else:
         if "model_name" in st.session_state:
             st.session_state["agent"] = get_agent(
-                session_id, model=st.session_state["model_name"], model_prompt=st.session_state.get("model_prompt")
+                session_id,
+                model=st.session_state["model_name"],
+                model_prompt=st.session_state.get("model_prompt"),
+                conversation_id=conversation_id,
             )
         else:
-            st.session_state["agent"] = get_agent(session_id, model_prompt=st.session_state.get("model_prompt"))
+            st.session_state["agent"] = get_agent(session_id, model_prompt=st.session_state.get("model_prompt"), conversation_id=conversation_id)
 
 
 def change_summary_model():
@@ -160,10 +203,11 @@ def change_summary_model():
             st.session_state["agent"] = get_agent(
                 session_id,
                 model=st.session_state["model_name"],
-                model_prompt=st.session_state.get("model_prompt")
+                model_prompt=st.session_state.get("model_prompt"),
+                conversation_id=conversation_id,
             )
         else:
-            st.session_state["agent"] = get_agent(session_id, model_prompt=st.session_state.get("model_prompt"))
+            st.session_state["agent"] = get_agent(session_id, model_prompt=st.session_state.get("model_prompt"), conversation_id=conversation_id)
 
 
 def set_nsfw():
@@ -364,11 +408,15 @@ with st.sidebar:
 # get the agent
 if "agent" not in st.session_state:
     st.session_state["agent"] = get_agent(
-        session_id, model=st.session_state["model_name"], model_prompt=st.session_state.get("model_prompt")
+        session_id,
+        model=st.session_state["model_name"],
+        model_prompt=st.session_state.get("model_prompt"),
+        conversation_id=conversation_id,
     )
 else:
     # set the model
     change_model()
+report_session_error()
 
 # if there is no pickled agent in the session state, set it to None
 if "pickled_agent" not in st.session_state:
@@ -446,13 +494,14 @@ with st.container(border=True):
                 frequency_penalty=int(frequency_penalty),
                 presence_penalty=int(presence_penalty),
             )
+        report_session_error()
 
 # add a donate button
 col1, col2 = st.columns(2)
 
 with col1:
     st.markdown(
-        f':green[**Cost of this conversation so far is: ${st.session_state["agent"].total_cost:.5f}**]'
+        f':green[**Cost of this conversation so far is: ${st.session_state["agent"].get_stats()["total_cost"]:.5f}**]'
     )
 
 with col2:
@@ -465,7 +514,7 @@ with col2:
 
 # display the conversation history
 with st.container(height=200):
-    for message in reversed(st.session_state["agent"].chat_history[-100:]):
+    for message in reversed(st.session_state["agent"].get_chat_history_snapshot(100)):
         with st.chat_message(message["role"]):
             if message["role"] == "user":
                 st.markdown(
@@ -515,19 +564,12 @@ with st.container(border=True):
                     st.rerun()
 
 # write descriptive statistics on the sidebar
+stats = st.session_state["agent"].get_stats()
+st.sidebar.write(f'Total current memory tokens: {stats["current_memory_tokens"]}')
+st.sidebar.write(f'Total cost of this conversation is: {stats["total_cost"]}')
+st.sidebar.write(f'Total tokens sent is: {stats["total_tokens"]}')
 st.sidebar.write(
-    f'Total current memory tokens: {st.session_state["agent"].current_memory_tokens}'
-)
-st.sidebar.write(
-    f'Total cost of this conversation is: {st.session_state["agent"].total_cost}'
-)
-st.sidebar.write(f'Total tokens sent is: {st.session_state["agent"].total_tokens}')
-st.sidebar.write(
-    f'Average number of tokens per interaction is: {st.session_state["agent"].average_tokens}'
-)
-st.sidebar.write(
-    f'Average cost per interaction is: {st.session_state["agent"].average_cost}'
+    f'Average number of tokens per interaction is: {stats["average_tokens"]}'
 )
-st.sidebar.write(
-    f'Total number of interactions is: {len(st.session_state["agent"].chat_history) / 2}'
-)
\ No newline at end of file
+st.sidebar.write(f'Average cost per interaction is: {stats["average_cost"]}')
+st.sidebar.write(f'Total number of interactions is: {stats["interactions"]}')
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import auth, users, models, organizations, workspaces, documents, evaluations, search, memory, costs, rate_limits, document_processing
+from app.api.v1.endpoints import auth, users, models, organizations, workspaces, documents, evaluations, search, memory, costs, rate_limits, document_processing, character_agents
 
 api_router = APIRouter()
 
@@ -15,4 +15,5 @@ api_router.include_router(search.router, prefix="/search", tags=["search"])
 api_router.include_router(memory.router, prefix="/memory", tags=["memory"])
 api_router.include_router(costs.router, prefix="/costs", tags=["costs"])
 api_router.include_router(rate_limits.router, prefix="/rate-limits", tags=["rate_limits"])
-api_router.include_router(document_processing.router, prefix="/document-processing", tags=["document_processing"])
\ No newline at end of file
+api_router.include_router(document_processing.router, prefix="/document-processing", tags=["document_processing"])
+api_router.include_router(character_agents.router, prefix="/character-agents", tags=["character_agents"])
\ No newline at end of file
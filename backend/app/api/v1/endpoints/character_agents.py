@@ -0,0 +1,229 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List
+from prisma import Prisma, Json
+from prisma.errors import UniqueViolationError
+import json
+
+from app.schemas.character_agent import CharacterAgent, CharacterAgentTurn, CharacterAgentSummary, CharacterAgentMessage, CharacterAgentMemory
+from app.core.security import get_current_user
+from app.models.user import User as UserModel
+from app.database.session import get_db
+
+router = APIRouter()
+
+def check_agent_owner(db_agent, current_user: UserModel):
+    """Verificar se o agente pertence ao usuário atual (administradores acessam todos)"""
+    if db_agent and db_agent.userId != current_user.id and current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions to access this character agent"
+        )
+
+async def get_owned_agent(db: Prisma, agent_id: str, current_user: UserModel):
+    """Buscar um agente de personagem e verificar se pertence ao usuário atual"""
+    db_agent = await db.characteragent.find_unique(where={"id": agent_id})
+    check_agent_owner(db_agent, current_user)
+    return db_agent
+
+async def build_summary(db: Prisma, db_agent) -> CharacterAgentSummary:
+    """Montar o resumo de um agente com a contagem de mensagens e memórias"""
+    message_count = await db.characteragentmessage.count(where={"agentId": db_agent.id})
+    memory_count = await db.characteragentmemory.count(where={"agentId": db_agent.id})
+
+    return CharacterAgentSummary(
+        id=db_agent.id,
+        user_id=db_agent.userId,
+        name=db_agent.name,
+        message_count=message_count,
+        memory_count=memory_count,
+        updated_at=db_agent.updatedAt
+    )
+
+@router.get("/", response_model=List[CharacterAgentSummary])
+async def list_character_agents(
+    skip: int = 0,
+    limit: int = 100,
+    current_user: UserModel = Depends(get_current_user),
+    db: Prisma = Depends(get_db)
+):
+    """Listar agentes de personagem do usuário"""
+    try:
+        db_agents = await db.characteragent.find_many(
+            where={
+                "userId": current_user.id
+            },
+            skip=skip,
+            take=limit,
+            order={
+                "updatedAt": "desc"
+            }
+        )
+
+        return [await build_summary(db, db_agent) for db_agent in db_agents]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing character agents: {str(e)}")
+
+@router.get("/{agent_id}", response_model=CharacterAgent)
+async def get_character_agent(
+    agent_id: str,
+    current_user: UserModel = Depends(get_current_user),
+    db: Prisma = Depends(get_db)
+):
+    """Obter o estado completo de um agente: estado, histórico e memórias com embeddings"""
+    try:
+        db_agent = await get_owned_agent(db, agent_id, current_user)
+
+        if not db_agent:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Character agent not found"
+            )
+
+        db_messages = await db.characteragentmessage.find_many(
+            where={
+                "agentId": agent_id
+            },
+            order={
+                "seq": "asc"
+            }
+        )
+
+        # Embeddings são do tipo vector (pgvector), lidos como texto via SQL
+        db_memories = await db.query_raw(
+            'SELECT "memoryId", "content", "embedding"::text AS "embedding" '
+            'FROM "CharacterAgentMemory" WHERE "agentId" = $1 ORDER BY "memoryId"',
+            agent_id
+        )
+
+        return CharacterAgent(
+            id=db_agent.id,
+            user_id=db_agent.userId,
+            name=db_agent.name,
+            state=db_agent.state,
+            messages=[
+                CharacterAgentMessage(role=msg.role, content=msg.content)
+                for msg in db_messages
+            ],
+            memories=[
+                CharacterAgentMemory(
+                    memory_id=memory["memoryId"],
+                    content=memory["content"],
+                    embedding=json.loads(memory["embedding"]) if memory["embedding"] else []
+                )
+                for memory in db_memories
+            ],
+            created_at=db_agent.createdAt,
+            updated_at=db_agent.updatedAt
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching character agent: {str(e)}")
+
+@router.put("/{agent_id}/turns", response_model=CharacterAgentSummary)
+async def save_character_agent_turn(
+    agent_id: str,
+    turn: CharacterAgentTurn,
+    current_user: UserModel = Depends(get_current_user),
+    db: Prisma = Depends(get_db)
+):
+    """Salvar um turno: atualiza o estado e acrescenta apenas as novas mensagens e memórias"""
+    try:
+        name = turn.state.get("character_name") or "Character"
+
+        async with db.tx() as tx:
+            # Criar o agente no primeiro turno; se dois primeiros turnos chegam juntos, o segundo
+            # espera o primeiro terminar e não insere nada
+            await tx.execute_raw(
+                'INSERT INTO "CharacterAgent" ("id", "userId", "name", "state", "updatedAt") '
+                'VALUES ($1, $2, $3, $4::jsonb, CURRENT_TIMESTAMP) ON CONFLICT ("id") DO NOTHING',
+                agent_id,
+                current_user.id,
+                name,
+                json.dumps(turn.state)
+            )
+
+            # Reler o agente (talvez criado por outra requisição) e bloqueá-lo até o fim do turno
+            await tx.query_raw('SELECT "id" FROM "CharacterAgent" WHERE "id" = $1 FOR UPDATE', agent_id)
+            db_agent = await tx.characteragent.find_unique(where={"id": agent_id})
+            check_agent_owner(db_agent, current_user)
+
+            db_agent = await tx.characteragent.update(
+                where={"id": agent_id},
+                data={"name": name, "state": Json(turn.state)}
+            )
+
+            # O turno deve continuar exatamente onde o histórico salvo termina; caso contrário outro
+            # cliente gravou mensagens desde que este carregou a conversa
+            last_message = await tx.characteragentmessage.find_first(
+                where={"agentId": agent_id},
+                order={"seq": "desc"}
+            )
+            next_seq = last_message.seq + 1 if last_message else 0
+            if next_seq != turn.first_seq:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"Character agent was changed elsewhere; the next message is {next_seq}"
+                )
+
+            # Uma linha por mensagem nova
+            if turn.messages:
+                await tx.characteragentmessage.create_many(
+                    data=[
+                        {
+                            "agentId": agent_id,
+                            "seq": turn.first_seq + i,
+                            "role": message.role,
+                            "content": message.content
+                        }
+                        for i, message in enumerate(turn.messages)
+                    ]
+                )
+
+            # Uma linha por memória nova, com o embedding em pgvector
+            for memory in turn.memories:
+                await tx.execute_raw(
+                    'INSERT INTO "CharacterAgentMemory" ("agentId", "memoryId", "content", "embedding") '
+                    'VALUES ($1, $2, $3, $4::vector)',
+                    agent_id,
+                    memory.memory_id,
+                    memory.content,
+                    json.dumps(memory.embedding)
+                )
+
+        return await build_summary(db, db_agent)
+    except HTTPException:
+        raise
+    except UniqueViolationError:
+        # Outro turno gravou as mesmas mensagens ou memórias primeiro
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Character agent was changed elsewhere"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving character agent turn: {str(e)}")
+
+@router.delete("/{agent_id}")
+async def delete_character_agent(
+    agent_id: str,
+    current_user: UserModel = Depends(get_current_user),
+    db: Prisma = Depends(get_db)
+):
+    """Excluir um agente de personagem com seu histórico e memórias"""
+    try:
+        db_agent = await get_owned_agent(db, agent_id, current_user)
+
+        if not db_agent:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Character agent not found"
+            )
+
+        # Mensagens e memórias são removidas em cascata
+        await db.characteragent.delete(where={"id": agent_id})
+
+        return {"message": "Character agent deleted successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting character agent: {str(e)}")
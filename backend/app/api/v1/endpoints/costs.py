@@ -3,7 +3,7 @@ from typing import List
 from prisma import Prisma
 from datetime import datetime, timedelta
 
-from app.schemas.cost import UsageRecord, UsageRecordCreate, CostDashboard, CostHistory
+from app.schemas.cost import UsageRecord, UsageRecordCreate, UsageRecordBatch, UsageRecordBatchResult, CostDashboard, CostHistory
 from app.core.security import get_current_user
 from app.models.user import User as UserModel
 from app.database.session import get_db
@@ -32,7 +32,13 @@ async def record_usage(
                 "organizationId": usage_record.organizationId,
                 "feature": usage_record.feature,
                 "tokens_used": usage_record.tokens_used,
-                "cost": usage_record.cost
+                "model": usage_record.model,
+                "input_tokens": usage_record.input_tokens,
+                "output_tokens": usage_record.output_tokens,
+                "cached_tokens": usage_record.cached_tokens,
+                "latency": usage_record.latency,
+                "cost": usage_record.cost,
+                **({"timestamp": usage_record.timestamp} if usage_record.timestamp else {})
             }
         )
         
@@ -42,12 +48,63 @@ async def record_usage(
             organizationId=db_usage_record.organizationId,
             feature=db_usage_record.feature,
             tokens_used=db_usage_record.tokens_used,
+            model=db_usage_record.model,
+            input_tokens=db_usage_record.input_tokens,
+            output_tokens=db_usage_record.output_tokens,
+            cached_tokens=db_usage_record.cached_tokens,
+            latency=db_usage_record.latency,
             cost=db_usage_record.cost,
             timestamp=db_usage_record.timestamp
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error recording usage: {str(e)}")
 
+@router.post("/usage/batch/", response_model=UsageRecordBatchResult)
+async def record_usage_batch(
+    batch: UsageRecordBatch,
+    current_user: UserModel = Depends(get_current_user),
+    db: Prisma = Depends(get_db)
+):
+    """Registrar vários eventos de uso em uma única operação (usado pelo ledger dos agentes)"""
+    try:
+        # Verificar permissões - apenas administradores podem registrar uso para outros usuários
+        if current_user.role != "admin" and any(
+            record.userId != current_user.id for record in batch.records
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not enough permissions to record usage for this user"
+            )
+        
+        if not batch.records:
+            return UsageRecordBatchResult(created=0)
+        
+        # Registrar todos os eventos de uma vez
+        created = await db.usagerecord.create_many(
+            data=[
+                {
+                    "userId": record.userId,
+                    "organizationId": record.organizationId,
+                    "feature": record.feature,
+                    "tokens_used": record.tokens_used,
+                    "model": record.model,
+                    "input_tokens": record.input_tokens,
+                    "output_tokens": record.output_tokens,
+                    "cached_tokens": record.cached_tokens,
+                    "latency": record.latency,
+                    "cost": record.cost,
+                    **({"timestamp": record.timestamp} if record.timestamp else {})
+                }
+                for record in batch.records
+            ]
+        )
+        
+        return UsageRecordBatchResult(created=created)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error recording usage batch: {str(e)}")
+
 @router.get("/dashboard/", response_model=CostDashboard)
 async def get_cost_dashboard(
     organization_id: int = None,
@@ -273,6 +330,11 @@ async def get_cost_history(
                 organizationId=record.organizationId,
                 feature=record.feature,
                 tokens_used=record.tokens_used,
+                model=record.model,
+                input_tokens=record.input_tokens,
+                output_tokens=record.output_tokens,
+                cached_tokens=record.cached_tokens,
+                latency=record.latency,
                 cost=record.cost,
                 timestamp=record.timestamp
             )
@@ -0,0 +1,36 @@
+from pydantic import BaseModel
+from typing import List, Dict, Any
+from datetime import datetime
+
+class CharacterAgentMessage(BaseModel):
+    role: str  # "user" or "assistant"
+    content: str
+
+class CharacterAgentMemory(BaseModel):
+    memory_id: int
+    content: str
+    embedding: List[float]
+
+class CharacterAgentTurn(BaseModel):
+    state: Dict[str, Any]
+    first_seq: int
+    messages: List[CharacterAgentMessage] = []
+    memories: List[CharacterAgentMemory] = []
+
+class CharacterAgentSummary(BaseModel):
+    id: str
+    user_id: int
+    name: str
+    message_count: int
+    memory_count: int
+    updated_at: datetime
+
+class CharacterAgent(BaseModel):
+    id: str
+    user_id: int
+    name: str
+    state: Dict[str, Any]
+    messages: List[CharacterAgentMessage]
+    memories: List[CharacterAgentMemory]
+    created_at: datetime
+    updated_at: datetime
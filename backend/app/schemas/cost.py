@@ -7,10 +7,21 @@ class UsageRecordBase(BaseModel):
     organizationId: Optional[int] = None
     feature: str  # "document_processing", "search", "evaluation_creation", etc.
     tokens_used: Optional[int] = None
+    model: Optional[str] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    latency: Optional[float] = None  # segundos
     cost: float
 
 class UsageRecordCreate(UsageRecordBase):
-    pass
+    timestamp: Optional[datetime] = None  # quando o evento ocorreu (eventos reenviados do spool); padrão: agora
+
+class UsageRecordBatch(BaseModel):
+    records: list[UsageRecordCreate]
+
+class UsageRecordBatchResult(BaseModel):
+    created: int
 
 class UsageRecord(UsageRecordBase):
     id: int
@@ -0,0 +1,50 @@
+-- CreateTable
+CREATE TABLE "CharacterAgent" (
+    "id" TEXT NOT NULL,
+    "userId" INTEGER NOT NULL,
+    "name" TEXT NOT NULL,
+    "state" JSONB NOT NULL,
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "updatedAt" TIMESTAMP(3) NOT NULL,
+
+    CONSTRAINT "CharacterAgent_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateTable
+CREATE TABLE "CharacterAgentMessage" (
+    "id" SERIAL NOT NULL,
+    "agentId" TEXT NOT NULL,
+    "seq" INTEGER NOT NULL,
+    "role" TEXT NOT NULL,
+    "content" TEXT NOT NULL,
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "CharacterAgentMessage_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateTable
+CREATE TABLE "CharacterAgentMemory" (
+    "id" SERIAL NOT NULL,
+    "agentId" TEXT NOT NULL,
+    "memoryId" INTEGER NOT NULL,
+    "content" TEXT NOT NULL,
+    "embedding" vector,
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "CharacterAgentMemory_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "CharacterAgentMessage_agentId_seq_key" ON "CharacterAgentMessage"("agentId", "seq");
+
+-- CreateIndex
+CREATE UNIQUE INDEX "CharacterAgentMemory_agentId_memoryId_key" ON "CharacterAgentMemory"("agentId", "memoryId");
+
+-- AddForeignKey
+ALTER TABLE "CharacterAgent" ADD CONSTRAINT "CharacterAgent_userId_fkey" FOREIGN KEY ("userId") REFERENCES "User"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "CharacterAgentMessage" ADD CONSTRAINT "CharacterAgentMessage_agentId_fkey" FOREIGN KEY ("agentId") REFERENCES "CharacterAgent"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- AddForeignKey
+ALTER TABLE "CharacterAgentMemory" ADD CONSTRAINT "CharacterAgentMemory_agentId_fkey" FOREIGN KEY ("agentId") REFERENCES "CharacterAgent"("id") ON DELETE CASCADE ON UPDATE CASCADE;
@@ -0,0 +1,23 @@
+-- CreateTable
+CREATE TABLE "UsageRecord" (
+    "id" SERIAL NOT NULL,
+    "userId" INTEGER NOT NULL,
+    "organizationId" INTEGER,
+    "feature" TEXT NOT NULL,
+    "model" TEXT,
+    "tokens_used" INTEGER,
+    "input_tokens" INTEGER,
+    "output_tokens" INTEGER,
+    "cached_tokens" INTEGER,
+    "latency" DOUBLE PRECISION,
+    "cost" DOUBLE PRECISION NOT NULL,
+    "timestamp" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "UsageRecord_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE INDEX "UsageRecord_userId_timestamp_idx" ON "UsageRecord"("userId", "timestamp");
+
+-- AddForeignKey
+ALTER TABLE "UsageRecord" ADD CONSTRAINT "UsageRecord_userId_fkey" FOREIGN KEY ("userId") REFERENCES "User"("id") ON DELETE RESTRICT ON UPDATE CASCADE;
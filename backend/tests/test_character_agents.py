@@ -0,0 +1,99 @@
+import pytest
+from fastapi.testclient import TestClient
+import uuid
+
+def save_turn(test_client, headers, agent_id, first_seq, messages, memories=None):
+    """Salvar um turno de um agente de personagem"""
+    return test_client.put(
+        f"/api/v1/character-agents/{agent_id}/turns",
+        json={
+            "state": {"character_name": "Bill", "mid_term_memory": "nothing yet."},
+            "first_seq": first_seq,
+            "messages": messages,
+            "memories": memories or []
+        },
+        headers=headers
+    )
+
+def test_save_and_get_character_agent(test_client, create_test_user):
+    """Teste de salvamento incremental e recuperação de um agente"""
+    if not create_test_user:
+        pytest.fail("Falha ao criar usuário de teste")
+    
+    headers = {"Authorization": f"Bearer {create_test_user['token']}"}
+    agent_id = str(uuid.uuid4())
+    
+    # Primeiro turno cria o agente
+    response = save_turn(test_client, headers, agent_id, 0, [
+        {"role": "user", "content": "Olá"},
+        {"role": "assistant", "content": "[Bill]: Olá!"}
+    ])
+    assert response.status_code == 200
+    assert response.json()["message_count"] == 2
+    
+    # Segundo turno acrescenta apenas as novas mensagens e uma memória
+    response = save_turn(
+        test_client, headers, agent_id, 2,
+        [
+            {"role": "user", "content": "Como vai?"},
+            {"role": "assistant", "content": "[Bill]: Bem!"}
+        ],
+        [{"memory_id": 0, "content": "Conversamos sobre o outback", "embedding": [0.1, 0.2, 0.3]}]
+    )
+    assert response.status_code == 200
+    assert response.json()["message_count"] == 4
+    assert response.json()["memory_count"] == 1
+    
+    # Recuperar o agente completo
+    response = test_client.get(f"/api/v1/character-agents/{agent_id}", headers=headers)
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert data["name"] == "Bill"
+    assert [m["content"] for m in data["messages"]][2] == "Como vai?"
+    assert data["memories"][0]["embedding"] == pytest.approx([0.1, 0.2, 0.3])
+
+def test_get_missing_character_agent(test_client, create_test_user):
+    """Teste de agente inexistente"""
+    if not create_test_user:
+        pytest.fail("Falha ao criar usuário de teste")
+    
+    headers = {"Authorization": f"Bearer {create_test_user['token']}"}
+    
+    response = test_client.get(f"/api/v1/character-agents/{uuid.uuid4()}", headers=headers)
+    
+    assert response.status_code == 404
+
+def test_delete_character_agent(test_client, create_test_user):
+    """Teste de exclusão de agente"""
+    if not create_test_user:
+        pytest.fail("Falha ao criar usuário de teste")
+    
+    headers = {"Authorization": f"Bearer {create_test_user['token']}"}
+    agent_id = str(uuid.uuid4())
+    save_turn(test_client, headers, agent_id, 0, [{"role": "user", "content": "Olá"}])
+    
+    response = test_client.delete(f"/api/v1/character-agents/{agent_id}", headers=headers)
+    assert response.status_code == 200
+    
+    response = test_client.get(f"/api/v1/character-agents/{agent_id}", headers=headers)
+    assert response.status_code == 404
+
+def test_save_stale_character_agent_turn(test_client, create_test_user):
+    """Teste de turno que não continua o histórico salvo (outro cliente gravou antes)"""
+    if not create_test_user:
+        pytest.fail("Falha ao criar usuário de teste")
+    
+    headers = {"Authorization": f"Bearer {create_test_user['token']}"}
+    agent_id = str(uuid.uuid4())
+    save_turn(test_client, headers, agent_id, 0, [
+        {"role": "user", "content": "Olá"},
+        {"role": "assistant", "content": "[Bill]: Olá!"}
+    ])
+    
+    # Um segundo cliente que carregou a conversa vazia tenta gravar a partir da mensagem 0
+    response = save_turn(test_client, headers, agent_id, 0, [{"role": "user", "content": "Oi"}])
+    assert response.status_code == 409
+    
+    response = test_client.get(f"/api/v1/character-agents/{agent_id}", headers=headers)
+    assert len(response.json()["messages"]) == 2
@@ -58,4 +58,72 @@ def test_get_cost_history(test_client, create_test_user):
     data = response.json()
     assert "records" in data
     assert "total_records" in data
-    assert "total_cost" in data
\ No newline at end of file
+    assert "total_cost" in data
+
+def test_record_usage_batch(test_client, create_test_admin):
+    """Teste de registro de uso em lote"""
+    if not create_test_admin:
+        pytest.fail("Falha ao criar usuário de teste")
+    
+    headers = {"Authorization": f"Bearer {create_test_admin['token']}"}
+    
+    # Registrar vários eventos de uso
+    response = test_client.post(
+        "/api/v1/costs/usage/batch/",
+        json={
+            "records": [
+                {"userId": 2, "feature": "chat", "tokens_used": 500, "cost": 0.001},
+                {"userId": 2, "feature": "chat_summary", "tokens_used": 200, "cost": 0.0004}
+            ]
+        },
+        headers=headers
+    )
+    
+    assert response.status_code == 200
+    assert response.json()["created"] == 2
+
+def test_record_usage_batch_forbidden_for_other_user(test_client, create_test_user):
+    """Teste de permissão no registro de uso em lote"""
+    if not create_test_user:
+        pytest.fail("Falha ao criar usuário de teste")
+    
+    headers = {"Authorization": f"Bearer {create_test_user['token']}"}
+    
+    response = test_client.post(
+        "/api/v1/costs/usage/batch/",
+        json={"records": [{"userId": 999999, "feature": "chat", "tokens_used": 10, "cost": 0.0}]},
+        headers=headers
+    )
+    
+    assert response.status_code == 403
+
+def test_record_usage_batch_with_token_breakdown(test_client, create_test_admin):
+    """Teste de registro em lote com modelo, tokens detalhados e latência"""
+    if not create_test_admin:
+        pytest.fail("Falha ao criar usuário de teste")
+    
+    headers = {"Authorization": f"Bearer {create_test_admin['token']}"}
+    
+    response = test_client.post(
+        "/api/v1/costs/usage/batch/",
+        json={
+            "records": [
+                {
+                    "userId": 2,
+                    "feature": "chat",
+                    "model": "gpt-4o-mini",
+                    "tokens_used": 700,
+                    "input_tokens": 500,
+                    "output_tokens": 200,
+                    "cached_tokens": 100,
+                    "latency": 1.25,
+                    "cost": 0.001,
+                    "timestamp": "2025-10-01T12:00:00"
+                }
+            ]
+        },
+        headers=headers
+    )
+    
+    assert response.status_code == 200
+    assert response.json()["created"] == 1
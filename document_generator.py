@@ -6,7 +6,6 @@ import io
 import os
 import openai
 from dotenv import load_dotenv
-import tempfile
 
 # Load environment variables
 load_dotenv()
@@ -102,33 +101,14 @@ def extract_text_from_file(uploaded_file):
         return uploaded_file.getvalue().decode("utf-8")
     elif file_extension == "docx":
         from docx import Document
-        # Use a temporary file to handle the uploaded file
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_file_path = tmp_file.name
-        
-        try:
-            doc = Document(tmp_file_path)
-            text = "\n".join([para.text for para in doc.paragraphs])
-            return text
-        finally:
-            os.unlink(tmp_file_path)
+        # python-docx reads the uploaded file object directly, no temporary copy needed
+        doc = Document(uploaded_file)
+        text = "\n".join([para.text for para in doc.paragraphs])
+        return text
     elif file_extension == "pdf":
-        import PyPDF2
-        # Use a temporary file to handle the uploaded file
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_file_path = tmp_file.name
-        
-        try:
-            with open(tmp_file_path, 'rb') as pdf_file:
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text()
-                return text
-        finally:
-            os.unlink(tmp_file_path)
+        from rag_components.pdf_stream import iter_pdf_pages
+        # Pages are extracted from the upload stream one window at a time
+        return "".join(page.page_content for page in iter_pdf_pages(uploaded_file, uploaded_file.name))
     else:
         st.error("Formato de arquivo não suportado. Por favor, use TXT, DOCX ou PDF.")
         return None
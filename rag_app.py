@@ -44,9 +44,22 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+
+@st.cache_resource
+def get_auth_manager():
+    """One user store per process, shared by all sessions"""
+    return AuthManager()
+
+
+@st.cache_resource
+def get_rag_agent():
+    """One agent per process: every session shares the loaded index, docstore and API clients,
+    and sees documents added by any other session as soon as they are indexed"""
+    return RAGAgent()
+
+
 # Initialize session state
-if "auth_manager" not in st.session_state:
-    st.session_state.auth_manager = AuthManager()
+st.session_state.auth_manager = get_auth_manager()
 
 if "authenticated" not in st.session_state:
     st.session_state.authenticated = False
@@ -54,8 +67,12 @@ if "authenticated" not in st.session_state:
 if "user" not in st.session_state:
     st.session_state.user = None
 
-if "rag_agent" not in st.session_state:
-    st.session_state.rag_agent = RAGAgent()
+st.session_state.rag_agent = get_rag_agent()
+# Reload if another process (e.g. the bulk_ingest CLI) changed the index on disk
+st.session_state.rag_agent.faiss_manager.refresh()
+
+if "model_name" not in st.session_state:
+    st.session_state.model_name = None
 
 if "uploaded_files" not in st.session_state:
     st.session_state.uploaded_files = []
@@ -137,13 +154,14 @@ with st.sidebar:
     model_name = model_options[selected_model]
     
     if st.button("Atualizar Modelo"):
-        st.session_state.rag_agent.set_model(model_name)
+        # Per session: the agent is shared, so the model is passed with each question
+        st.session_state.model_name = model_name
         st.success(f"Modelo atualizado para {selected_model}")
     
     # Statistics
     st.subheader("Estatísticas")
     if st.session_state.rag_agent.vector_store:
-        doc_count = st.session_state.rag_agent.vector_store.index.ntotal
+        doc_count = st.session_state.rag_agent.faiss_manager.get_document_count()
         st.metric("Documentos Indexados", doc_count)
     else:
         st.metric("Documentos Indexados", 0)
@@ -205,6 +223,7 @@ with tab1:
             if st.button("Processar Documentos"):
                 with st.spinner("Processando documentos..."):
                     try:
+                        files = []
                         for uploaded_file in uploaded_files:
                             # Save file temporarily
                             file_path = save_uploaded_file(uploaded_file, "docs/company")
@@ -215,9 +234,7 @@ with tab1:
                                 "department": department,
                                 "uploaded_by": st.session_state.user.username
                             })
-                            
-                            # Add document to RAG system
-                            st.session_state.rag_agent.add_document(file_path, metadata)
+                            files.append((file_path, metadata))
                             
                             # Add to session state
                             st.session_state.uploaded_files.append({
@@ -227,7 +244,23 @@ with tab1:
                                 "department": department
                             })
                         
-                        st.success(f"{len(uploaded_files)} documentos processados com sucesso!")
+                        # Add all documents to the RAG system in one parallel, batched ingest
+                        progress_bar = st.progress(0.0)
+                        report = st.session_state.rag_agent.add_documents_bulk(
+                            files,
+                            progress=lambda done, total: progress_bar.progress(done / total)
+                        )
+                        
+                        processed = len(files) - len(report["failed"])
+                        st.success(f"{processed} documentos processados com sucesso!")
+                        st.caption(
+                            f"{report['pages']} páginas, {report['chunks']} trechos em {report['seconds']:.1f}s "
+                            f"({report['pages_per_sec']:.1f} páginas/s, {report['chunks_per_sec']:.1f} trechos/s) · "
+                            f"reaproveitados: {report['files_reused']} arquivos, {report['reuse_ratio']:.0%} dos trechos · "
+                            f"{report['embedding_tokens']} tokens de embedding"
+                        )
+                        for file_path, error in report["failed"].items():
+                            st.error(f"Erro ao processar {os.path.basename(file_path)}: {error}")
                         
                     except Exception as e:
                         st.error(f"Erro ao processar documentos: {str(e)}")
@@ -243,7 +276,7 @@ with tab2:
         if st.session_state.rag_agent.vector_store:
             # Show document statistics
             st.subheader("Estatísticas de Documentos")
-            doc_count = st.session_state.rag_agent.vector_store.index.ntotal
+            doc_count = st.session_state.rag_agent.faiss_manager.get_document_count()
             st.write(f"Total de documentos indexados: {doc_count}")
             
             # Show recent uploads
@@ -251,6 +284,16 @@ with tab2:
                 st.subheader("Uploads Recentes")
                 df = pd.DataFrame(st.session_state.uploaded_files)
                 st.dataframe(df)
+                
+                # Remove one document's chunks without rebuilding the index
+                paths = [f["path"] for f in st.session_state.uploaded_files]
+                path_to_remove = st.selectbox("Remover documento do índice", paths)
+                if st.button("Remover"):
+                    removed = st.session_state.rag_agent.delete_document(path_to_remove)
+                    st.session_state.uploaded_files = [
+                        f for f in st.session_state.uploaded_files if f["path"] != path_to_remove
+                    ]
+                    st.success(f"{removed} trechos removidos do índice.")
             else:
                 st.info("Nenhum documento foi carregado ainda.")
         else:
@@ -310,6 +353,10 @@ with tab3:
         # Display existing evaluations
         st.subheader("Avaliações Existentes")
         st.info("As avaliações são adicionadas ao sistema de busca semântica e podem ser consultadas na aba 'Busca Semântica'.")
+        
+        evaluation_stats = st.session_state.rag_agent.evaluation_manager.aggregate("employee_id")
+        if not evaluation_stats.empty:
+            st.dataframe(evaluation_stats.round(2), use_container_width=True)
     else:
         st.info("Apenas administradores e gerentes podem adicionar avaliações de funcionários.")
 
@@ -322,55 +369,42 @@ with tab4:
     if st.button("Buscar") and query:
         with st.spinner("Buscando respostas..."):
             try:
-                # Query the RAG system
-                result = st.session_state.rag_agent.query(query)
+                # Query the RAG system; retrieval only sees documents the user may access
+                result = st.session_state.rag_agent.query(
+                    query, user=st.session_state.user, model=st.session_state.model_name
+                )
                 
                 # Display answer
                 st.subheader("Resposta")
                 st.write(result["answer"])
                 
+                # Per-stage timings of the query pipeline
+                timings = result.get("timings")
+                if timings:
+                    st.caption(
+                        f"Embedding: {timings['embedding_ms']:.0f} ms · "
+                        f"Busca: {timings['search_ms']:.0f} ms · "
+                        f"LLM: {timings['llm_ms']:.0f} ms · "
+                        f"Total: {timings['total_ms']:.0f} ms"
+                        + (" · resposta em cache" if result.get("cached") else "")
+                    )
+                context_stats = result.get("context_stats")
+                if context_stats:
+                    st.caption(
+                        f"Contexto: {context_stats['chunks']} trechos → {context_stats['passages']} passagens, "
+                        f"{context_stats['tokens_before']} → {context_stats['tokens_after']} tokens"
+                    )
+                
                 # Display source documents
                 if result["source_documents"]:
                     st.subheader("Documentos Fonte")
-                    doc_count = 0
-                    for i, doc in enumerate(result["source_documents"]):
-                        # Check document access based on user role
-                        doc_type = doc.metadata.get("type", "")
-                        doc_department = doc.metadata.get("department", "")
-                        
-                        # Admins can see everything
-                        can_access = st.session_state.user.role == "admin"
-                        
-                        # Users can access documents in their department
-                        if not can_access and st.session_state.user.department == doc_department:
-                            can_access = True
-                        
-                        # Everyone can access general documents
-                        if not can_access and doc_department in ["all", ""]:
-                            can_access = True
-                        
-                        # Special handling for employee evaluations
-                        if not can_access and doc_type == "employee_evaluation":
-                            # Managers can see evaluations in their department
-                            if st.session_state.user.role == "manager" and st.session_state.user.department == doc_department:
-                                can_access = True
-                            
-                            # Users can see their own evaluations
-                            employee_id = doc.metadata.get("employee_id", "")
-                            if employee_id == st.session_state.user.username:
-                                can_access = True
-                        
-                        if can_access:
-                            doc_count += 1
-                            with st.expander(f"Documento {doc_count}: {doc.metadata.get('title', 'Sem título')}"):
-                                st.write(f"**Tipo:** {doc.metadata.get('type', 'Não especificado')}")
-                                st.write(f"**Departamento:** {doc.metadata.get('department', 'Não especificado')}")
-                                st.write(f"**Data de Modificação:** {doc.metadata.get('modified_date', 'Não especificada')}")
-                                st.write("**Conteúdo:**")
-                                st.write(doc.page_content)
-                    
-                    if doc_count == 0:
-                        st.info("Nenhum documento relevante encontrado para seu nível de acesso.")
+                    for i, doc in enumerate(result["source_documents"], 1):
+                        with st.expander(f"Documento {i}: {doc.metadata.get('title', 'Sem título')}"):
+                            st.write(f"**Tipo:** {doc.metadata.get('type', 'Não especificado')}")
+                            st.write(f"**Departamento:** {doc.metadata.get('department', 'Não especificado')}")
+                            st.write(f"**Data de Modificação:** {doc.metadata.get('modified_date', 'Não especificada')}")
+                            st.write("**Conteúdo:**")
+                            st.write(doc.page_content)
                 else:
                     st.info("Nenhum documento relevante encontrado.")
                     
@@ -0,0 +1,157 @@
+import time
+import math
+from datetime import datetime
+
+import faiss
+import numpy as np
+
+
+# Corpus sizes at which a more approximate index pays off
+FLAT_THRESHOLD = 20000
+IVFPQ_THRESHOLD = 500000
+
+DEFAULT_INDEX_PARAMS = {
+    "hnsw_m": 32,
+    "ef_construction": 80,
+    "ef_search": 64,
+    "nprobe": 16,
+    "pq_bits": 8,
+}
+
+
+def extract_vectors(index):
+    """Read every vector back out of a FAISS index as a float32 matrix"""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    if hasattr(index, "make_direct_map"):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def is_lossy(index):
+    """Whether the index only keeps quantized vectors, so reconstructions differ from what was added"""
+    return isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ))
+
+
+def measure_latency(index, queries, k):
+    """Search one query at a time.  Returns (mean_ms, p95_ms, results)."""
+    timings = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+    return float(np.mean(timings)), float(np.percentile(timings, 95)), np.array(results)
+
+
+def recall_at_k(exact_ids, approx_ids, k):
+    """Fraction of the exact top-k neighbours that the approximate index also returned"""
+    hits = 0
+    for exact, approx in zip(exact_ids, approx_ids):
+        hits += len(set(exact[:k]) & set(approx[:k]))
+    return hits / float(len(exact_ids) * k) if len(exact_ids) else 1.0
+
+
+def choose_index_type(n_vectors, flat_latency_ms=None, latency_target_ms=None,
+                      flat_threshold=FLAT_THRESHOLD, ivfpq_threshold=IVFPQ_THRESHOLD):
+    """Pick flat, hnsw or ivfpq from the corpus size and, if given, the measured flat latency"""
+    if n_vectors < flat_threshold:
+        return "flat"
+    # Exact search is still fast enough for the target, keep perfect recall
+    if latency_target_ms is not None and flat_latency_ms is not None and flat_latency_ms <= latency_target_ms:
+        return "flat"
+    if n_vectors < ivfpq_threshold:
+        return "hnsw"
+    return "ivfpq"
+
+
+def pq_subquantizers(dimension, maximum=64):
+    """Largest number of PQ sub-quantizers not above `maximum` that divides the dimension"""
+    for m in range(min(maximum, dimension), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def build_index(vectors, index_type, params=None, seed=1234):
+    """Build (and train, if needed) an index of the given type over the vectors"""
+    params = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    n_vectors, dimension = vectors.shape
+    
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)
+    
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+        index.hnsw.efSearch = params["ef_search"]
+    
+    elif index_type == "ivfpq":
+        nlist = params.get("nlist") or max(1, int(4 * math.sqrt(n_vectors)))
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_subquantizers(dimension), params["pq_bits"])
+        
+        # Train on a sample rather than the whole corpus
+        sample_size = min(n_vectors, max(39 * nlist, 2 ** params["pq_bits"] * 39, 100000))
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(n_vectors, sample_size, replace=False)]
+        index.train(sample)
+        index.nprobe = params["nprobe"]
+    
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+    
+    index.add(vectors)
+    if hasattr(index, "make_direct_map"):
+        # LangChain's max marginal relevance search reconstructs vectors by id
+        index.make_direct_map()
+    return index
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Tune the recall/latency trade-off of an already built index"""
+    if nprobe is not None and hasattr(index, "nprobe"):
+        index.nprobe = nprobe
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+
+def select_and_build_index(vectors, latency_target_ms=None, params=None, k=5, n_queries=100,
+                           flat_threshold=FLAT_THRESHOLD, ivfpq_threshold=IVFPQ_THRESHOLD, seed=1234):
+    """Choose an index type for the vectors, build it and measure it against exact search.
+    
+    Returns (index, report).  The report holds recall@k against a flat index and the
+    per-query latency of both, computed on a sample of the stored vectors used as queries.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors = vectors.shape[0]
+    
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(n_vectors, min(n_queries, n_vectors), replace=False)]
+    k = min(k, n_vectors)
+    flat_mean, flat_p95, exact_ids = measure_latency(flat, queries, k)
+    
+    index_type = choose_index_type(n_vectors, flat_p95, latency_target_ms, flat_threshold, ivfpq_threshold)
+    if index_type == "flat":
+        index, mean, p95, recall = flat, flat_mean, flat_p95, 1.0
+    else:
+        index = build_index(vectors, index_type, params, seed)
+        mean, p95, approx_ids = measure_latency(index, queries, k)
+        recall = recall_at_k(exact_ids, approx_ids, k)
+    
+    report = {
+        "index_type": index_type,
+        "n_vectors": n_vectors,
+        "params": {**DEFAULT_INDEX_PARAMS, **(params or {})} if index_type != "flat" else {},
+        "k": k,
+        "recall_at_k": recall,
+        "latency_ms": {"mean": mean, "p95": p95},
+        "flat_latency_ms": {"mean": flat_mean, "p95": flat_p95},
+        "latency_target_ms": latency_target_ms,
+        "built_at": datetime.now().isoformat(),
+    }
+    return index, report
@@ -0,0 +1,109 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_question(question):
+    """Case-, accent-, whitespace- and trailing-punctuation-insensitive form of a question"""
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!.;: ")
+
+
+class AnswerCache:
+    """Bounded cache of RAG answers keyed by normalized question, access scope and index epoch.
+    
+    The exact tier matches the normalized question.  With a `similarity_threshold`, a miss can
+    fall back to the semantic tier: the cached question of the same scope whose embedding has the
+    highest cosine similarity, if it reaches the threshold.  Entries expire after `ttl_seconds`
+    and the least recently used are evicted beyond `max_entries`.  An answer only holds for the
+    index it was computed on, so the whole cache is dropped when a different epoch is seen.
+    """
+    
+    def __init__(self, max_entries=1000, ttl_seconds=3600, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # (normalized question, scope) -> (stored at, unit embedding, result)
+        self.epoch = None
+        self.stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+    
+    def check_epoch(self, epoch):
+        """Drop every entry if the index changed since they were stored (call with the lock held)"""
+        if epoch != self.epoch:
+            if self.entries:
+                self.stats["invalidations"] += 1
+            self.entries.clear()
+            self.epoch = epoch
+    
+    def expired(self, stored_at):
+        return self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds
+    
+    def get(self, question, scope, epoch):
+        """Exact-tier lookup.  Returns the cached result or None."""
+        key = (normalize_question(question), scope)
+        with self.lock:
+            self.check_epoch(epoch)
+            entry = self.entries.get(key)
+            if entry is not None and self.expired(entry[0]):
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[2]
+    
+    def get_similar(self, embedding, scope, epoch):
+        """Semantic-tier lookup with the question's embedding.  Returns the cached result or None."""
+        if self.similarity_threshold is None:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self.lock:
+            self.check_epoch(epoch)
+            candidates = [
+                (key, entry) for key, entry in self.entries.items()
+                if key[1] == scope and entry[1] is not None and not self.expired(entry[0])
+            ]
+            if not candidates:
+                return None
+            similarities = np.stack([entry[1] for _, entry in candidates]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+            key, entry = candidates[best]
+            self.entries.move_to_end(key)
+            self.stats["semantic_hits"] += 1
+            return entry[2]
+    
+    def miss(self):
+        with self.lock:
+            self.stats["misses"] += 1
+    
+    def put(self, question, scope, epoch, result, embedding=None):
+        """Store a result computed on index `epoch`"""
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        key = (normalize_question(question), scope)
+        with self.lock:
+            self.check_epoch(epoch)
+            self.entries[key] = (time.monotonic(), embedding, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries))
@@ -2,7 +2,17 @@ import streamlit as st
 import hashlib
 import os
 import json
+import numpy as np
 from datetime import datetime, timedelta
+from rag_components.user_store import UserStore
+
+
+ROLE_HIERARCHY = ["employee", "manager", "admin"]
+
+
+def role_rank(role):
+    """Position of a role in the hierarchy; unknown roles rank as employees"""
+    return ROLE_HIERARCHY.index(role) if role in ROLE_HIERARCHY else 0
 
 
 class User:
@@ -19,56 +29,62 @@ class User:
 
 
 class AuthManager:
-    """Manage user authentication and access control"""
+    """Manage user authentication and access control
     
-    def __init__(self, users_file="users.json"):
+    Users live in a UserStore (sqlite), read by username on demand.  A legacy `users_file`
+    (users.json) is imported the first time the store is empty.
+    """
+    
+    def __init__(self, users_file="users.json", db_path="users.sqlite"):
         self.users_file = users_file
-        self.users = self.load_users()
+        self.store = UserStore(db_path)
+        if self.store.count() == 0:
+            for user in self.load_users().values():
+                self.store.insert(self.user_data(user))
         self.setup_admin_user()
     
     def load_users(self):
-        """Load users from file"""
+        """Load users from the legacy JSON file"""
         if os.path.exists(self.users_file):
             try:
                 with open(self.users_file, 'r') as f:
                     users_data = json.load(f)
                     users = {}
                     for username, data in users_data.items():
-                        user = User(
-                            username=data['username'],
-                            email=data['email'],
-                            role=data['role'],
-                            department=data['department'],
-                            password_hash=data['password_hash']
-                        )
-                        user.created_at = data.get('created_at', datetime.now().isoformat())
-                        user.last_login = data.get('last_login')
-                        users[username] = user
+                        users[username] = self.make_user(data)
                     return users
             except Exception as e:
                 print(f"Error loading users: {e}")
                 return {}
         return {}
     
-    def save_users(self):
-        """Save users to file"""
-        users_data = {}
-        for username, user in self.users.items():
-            users_data[username] = {
-                'username': user.username,
-                'email': user.email,
-                'role': user.role,
-                'department': user.department,
-                'password_hash': user.password_hash,
-                'created_at': user.created_at,
-                'last_login': user.last_login
-            }
-        
-        try:
-            with open(self.users_file, 'w') as f:
-                json.dump(users_data, f, indent=2)
-        except Exception as e:
-            print(f"Error saving users: {e}")
+    def make_user(self, data):
+        user = User(
+            username=data['username'],
+            email=data['email'],
+            role=data['role'],
+            department=data['department'],
+            password_hash=data['password_hash']
+        )
+        user.created_at = data.get('created_at') or datetime.now().isoformat()
+        user.last_login = data.get('last_login')
+        return user
+    
+    def user_data(self, user):
+        return {
+            'username': user.username,
+            'email': user.email,
+            'role': user.role,
+            'department': user.department,
+            'password_hash': user.password_hash,
+            'created_at': user.created_at,
+            'last_login': user.last_login
+        }
+    
+    @property
+    def users(self):
+        """All users by username (reads the whole table; prefer get_user)"""
+        return {data['username']: self.make_user(data) for data in self.store.all()}
     
     def hash_password(self, password):
         """Hash a password for storing"""
@@ -80,7 +96,7 @@ class AuthManager:
     
     def setup_admin_user(self):
         """Setup default admin user if none exists"""
-        if not self.users:
+        if self.store.count() == 0:
             admin_password = os.getenv("ADMIN_PASSWORD", "admin123")
             admin_user = User(
                 username="admin",
@@ -89,14 +105,11 @@ class AuthManager:
                 department="IT",
                 password_hash=self.hash_password(admin_password)
             )
-            self.users["admin"] = admin_user
-            self.save_users()
+            # Another process may have created it first
+            self.store.insert(self.user_data(admin_user))
     
     def register_user(self, username, email, role, department, password):
         """Register a new user"""
-        if username in self.users:
-            return False, "Username already exists"
-        
         user = User(
             username=username,
             email=email,
@@ -105,42 +118,38 @@ class AuthManager:
             password_hash=self.hash_password(password)
         )
         
-        self.users[username] = user
-        self.save_users()
+        if not self.store.insert(self.user_data(user)):
+            return False, "Username already exists"
         return True, "User registered successfully"
     
     def authenticate_user(self, username, password):
         """Authenticate a user"""
-        if username not in self.users:
+        user = self.get_user(username)
+        if user is None:
             return False, None
         
-        user = self.users[username]
         if self.verify_password(password, user.password_hash):
+            # Written behind, batched with other logins
             user.last_login = datetime.now().isoformat()
-            self.save_users()
+            self.store.record_login(username, user.last_login)
             return True, user
         
         return False, None
     
     def get_user(self, username):
         """Get user by username"""
-        return self.users.get(username)
+        data = self.store.get(username)
+        return self.make_user(data) if data else None
     
     def update_user_role(self, username, new_role):
         """Update user role (admin only)"""
-        if username in self.users:
-            self.users[username].role = new_role
-            self.save_users()
-            return True
-        return False
+        return self.store.update(username, role=new_role)
     
     def delete_user(self, username):
         """Delete a user (admin only)"""
-        if username in self.users and username != "admin":
-            del self.users[username]
-            self.save_users()
-            return True
-        return False
+        if username == "admin":
+            return False
+        return self.store.delete(username)
 
 
 def require_authentication():
@@ -169,11 +178,7 @@ def check_document_access(user, document_metadata):
     # Check role-based access
     doc_role = document_metadata.get("access_role")
     if doc_role and doc_role != "all":
-        role_hierarchy = ["employee", "manager", "admin"]
-        user_role_index = role_hierarchy.index(user.role) if user.role in role_hierarchy else 0
-        required_role_index = role_hierarchy.index(doc_role) if doc_role in role_hierarchy else 0
-        
-        if user_role_index < required_role_index:
+        if role_rank(user.role) < role_rank(doc_role):
             return False
     
     return True
@@ -195,4 +200,70 @@ def check_evaluation_access(user, evaluation):
         if eval_department and user.department == eval_department:
             return True
     
-    return False
\ No newline at end of file
+    return False
+
+
+class RetrievalAccessControl:
+    """Compile check_document_access/check_evaluation_access into the vector ids a user may retrieve.
+    
+    Searches are restricted to these ids, so forbidden chunks are never scored or sent to the LLM.
+    The part shared by everyone with the same role and department is computed from the metadata
+    index once and cached until the index changes; only the user's own evaluations are added per query.
+    """
+    
+    def __init__(self, metadata_index):
+        self.metadata_index = metadata_index
+        self.cache = {}
+    
+    def candidate_ids(self, user):
+        """Sorted vector ids the user may retrieve, or None if they may retrieve everything.
+        Call with the vector store's read lock held: the ids come from the metadata postings."""
+        if user.role == "admin":
+            return None
+        
+        key = (user.role, user.department)
+        cached = self.cache.get(key)
+        if cached is None or cached[0] != self.metadata_index.version:
+            cached = (self.metadata_index.version, self.shared_ids(user.role, user.department))
+            self.cache[key] = cached
+        
+        # Users can access their own evaluations
+        own_evaluations = self.metadata_index.select({"type": "employee_evaluation", "employee_id": user.username})
+        return np.union1d(cached[1], own_evaluations)
+    
+    def scope_key(self, user):
+        """Key shared by all users who may retrieve exactly the same ids"""
+        if user is None or user.role == "admin":
+            return "all"
+        if len(self.metadata_index.select({"type": "employee_evaluation", "employee_id": user.username})):
+            # Their own evaluations make the scope personal
+            return (user.role, user.department, user.username)
+        return (user.role, user.department)
+    
+    def shared_ids(self, role, department):
+        """Ids allowed by role and department alone"""
+        index = self.metadata_index
+        all_ids = np.arange(index.size, dtype=np.int64)
+        evaluations = index.positions("type", "employee_evaluation")
+        
+        # Documents: department must match (or be "all"/unset) and the required role must not exceed the user's
+        forbidden_departments = [
+            value for value in index.values("department")
+            if value and value != "all" and value != department
+        ]
+        forbidden_roles = [
+            value for value in index.values("access_role")
+            if value and value != "all" and role_rank(role) < role_rank(value)
+        ]
+        documents = np.setdiff1d(all_ids, evaluations, assume_unique=True)
+        documents = np.setdiff1d(documents, index.union("department", forbidden_departments), assume_unique=True)
+        documents = np.setdiff1d(documents, index.union("access_role", forbidden_roles), assume_unique=True)
+        # Lists or other non-scalar scopes are not indexed: deny them, as check_document_access does
+        for field in ["department", "access_role"]:
+            documents = np.setdiff1d(documents, index.unindexed_positions(field), assume_unique=True)
+        
+        # Managers can access evaluations in their department
+        if role == "manager":
+            department_evaluations = np.intersect1d(evaluations, index.positions("department", department), assume_unique=True)
+            return np.union1d(documents, department_evaluations)
+        return documents
@@ -0,0 +1,262 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+import openai
+
+from rag_components.document_processor import DocumentProcessor
+
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".docx")
+
+# One processor per worker process, reused for every file that worker handles
+worker_processor = None
+
+
+def load_and_split(file_path, metadata=None, embedding_model=None, report_token_savings=False):
+    """Load and split one file in a worker process.  Returns (file_path, chunks, stats, error), where
+    stats holds the page count and the embedding tokens of the chunks and (with `report_token_savings`)
+    of the previous splitter."""
+    global worker_processor
+    if worker_processor is None:
+        worker_processor = DocumentProcessor(embedding_model, report_token_savings=report_token_savings)
+    try:
+        page_count = 0
+        
+        def counted_pages():
+            nonlocal page_count
+            for page in worker_processor.iter_pages(file_path):
+                page_count += 1
+                yield page
+        
+        before = dict(worker_processor.token_stats)
+        chunks = worker_processor.split_documents(counted_pages(), file_path, metadata)
+        stats = {
+            "pages": page_count,
+            "embedding_tokens": worker_processor.token_stats["embedding_tokens"] - before["embedding_tokens"],
+            "baseline_tokens": worker_processor.token_stats["baseline_tokens"] - before["baseline_tokens"],
+        }
+        return file_path, chunks, stats, None
+    except Exception as e:
+        return file_path, [], {}, str(e)
+
+
+def find_files(paths):
+    """Expand directories into the supported files they contain"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(
+                    os.path.join(root, name) for name in sorted(names)
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS)
+                )
+        else:
+            files.append(path)
+    return files
+
+
+class BulkIngestor:
+    """Ingest many files into a FAISSManager at once.
+    
+    Files are loaded and split in a process pool.  Their chunks are collected into batches of
+    whole files, of about `batch_chunks` chunks, each batch is embedded as several requests of
+    `embedding_batch_size` texts sent with at most `max_concurrent_requests` in flight (rate-limit
+    errors are retried with exponential backoff), and each batch is written to the index once, as
+    one delta segment.
+    
+    Each file replaces the earlier version of its document (FAISSManager.upsert_documents), so
+    re-ingesting an edited file leaves no stale chunks.  Files already indexed unchanged as the
+    same document are skipped after splitting, and chunks whose text is indexed anywhere reuse
+    the stored embedding instead of being embedded again.
+    
+    With `report_token_savings`, files are also split with the previous character splitter to
+    report the embedding tokens saved (`tokens_saved`); this costs a second split of every page.
+    """
+    
+    def __init__(self, faiss_manager, max_workers=None, batch_chunks=2000, embedding_batch_size=256,
+                 max_concurrent_requests=4, max_retries=6, report_token_savings=False):
+        self.faiss_manager = faiss_manager
+        self.max_workers = max_workers or os.cpu_count()
+        self.batch_chunks = batch_chunks
+        self.embedding_batch_size = embedding_batch_size
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_retries = max_retries
+        self.report_token_savings = report_token_savings
+    
+    def embed_request(self, texts):
+        """Embed one request's worth of texts, backing off on rate limits"""
+        delay = 1.0
+        for attempt in range(self.max_retries):
+            try:
+                return self.faiss_manager.embeddings.embed_documents(texts)
+            except openai.RateLimitError:
+                if attempt == self.max_retries - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+    
+    def embed_batch(self, chunks):
+        """Embed a batch of chunks with bounded request concurrency, keeping their order"""
+        texts = [chunk.page_content for chunk in chunks]
+        requests = [
+            texts[start:start + self.embedding_batch_size]
+            for start in range(0, len(texts), self.embedding_batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_requests) as executor:
+            results = list(executor.map(self.embed_request, requests))
+        self.report["embedding_requests"] += len(requests)
+        return np.array([vector for result in results for vector in result], dtype=np.float32)
+    
+    def flush(self, chunks):
+        """Replace the documents of one batch of whole files, embedding only chunks not indexed yet"""
+        if not chunks:
+            return
+        documents_by_id = {}
+        for chunk in chunks:
+            documents_by_id.setdefault(chunk.metadata["document_id"], []).append(chunk)
+        counts = self.faiss_manager.upsert_documents(
+            documents_by_id, batch_size=len(chunks), embed=self.embed_batch
+        )
+        self.report["chunks_reused"] += counts["added"] - counts["embedded"]
+        self.report["chunks_replaced"] += counts["deleted"]
+        self.report["index_writes"] += 1
+    
+    def ingest(self, files, metadata=None, progress=None):
+        """Ingest files, given as paths or (path, metadata) pairs.  `metadata` applies to bare paths.
+        `progress(done, total)` is called as files finish splitting.  Returns a throughput report."""
+        files = [item if isinstance(item, tuple) else (item, metadata) for item in files]
+        self.report = {
+            "files": len(files),
+            "failed": {},
+            "pages": 0,
+            "chunks": 0,
+            "files_reused": 0,
+            "chunks_reused": 0,
+            "chunks_replaced": 0,
+            "embedding_requests": 0,
+            "index_writes": 0,
+            "embedding_tokens": 0,
+            "baseline_tokens": 0,
+        }
+        start = time.perf_counter()
+        
+        pending = []
+        batch_documents = set()
+        done = 0
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(
+                    load_and_split, path, file_metadata, self.faiss_manager.embedding_model, self.report_token_savings
+                )
+                for path, file_metadata in files
+            ]
+            for future in as_completed(futures):
+                file_path, chunks, stats, error = future.result()
+                done += 1
+                document_id = chunks[0].metadata["document_id"] if chunks else None
+                file_hash = chunks[0].metadata["file_hash"] if chunks else None
+                if error:
+                    self.report["failed"][file_path] = error
+                elif chunks and (
+                    (document_id, file_hash) in batch_documents
+                    or (self.faiss_manager.seen_file(file_hash)
+                        and self.faiss_manager.document_has_file(document_id, file_hash))
+                ):
+                    # Same content already indexed (or queued) as the same document, for the same audience
+                    self.report["files_reused"] += 1
+                else:
+                    if chunks and any(document_id == queued for queued, _ in batch_documents):
+                        # Another version of the same document is queued: write it first, the later one wins
+                        self.flush(pending)
+                        pending = []
+                        batch_documents = set()
+                    if chunks:
+                        batch_documents.add((document_id, file_hash))
+                    self.report["pages"] += stats["pages"]
+                    self.report["chunks"] += len(chunks)
+                    self.report["embedding_tokens"] += stats["embedding_tokens"]
+                    self.report["baseline_tokens"] += stats["baseline_tokens"]
+                    pending.extend(chunks)
+                
+                # Flush whole files only: a document split across writes would replace its own first part
+                if len(pending) >= self.batch_chunks:
+                    self.flush(pending)
+                    pending = []
+                    batch_documents = set()
+                
+                if progress:
+                    progress(done, len(files))
+        
+        self.flush(pending)
+        
+        elapsed = time.perf_counter() - start
+        self.report["seconds"] = elapsed
+        self.report["pages_per_sec"] = self.report["pages"] / elapsed if elapsed else 0.0
+        self.report["chunks_per_sec"] = self.report["chunks"] / elapsed if elapsed else 0.0
+        self.report["reuse_ratio"] = self.report["chunks_reused"] / self.report["chunks"] if self.report["chunks"] else 0.0
+        if self.report_token_savings:
+            self.report["tokens_saved"] = self.report["baseline_tokens"] - self.report["embedding_tokens"]
+        return self.report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest documents into the RAG FAISS index")
+    parser.add_argument("paths", nargs="+", help="Files or directories (.pdf, .txt, .docx)")
+    parser.add_argument("--index-path", default="faiss_index")
+    parser.add_argument("--embedding-model", default=None, help="defaults to EMBEDDING_MODEL; local-hashing runs offline")
+    parser.add_argument("--department", help="Department metadata for every document")
+    parser.add_argument("--type", dest="doc_type", help="Document type metadata for every document")
+    parser.add_argument("--workers", type=int, default=None, help="Processes for loading and splitting")
+    parser.add_argument("--batch-chunks", type=int, default=2000, help="Chunks per index write")
+    parser.add_argument("--embedding-batch-size", type=int, default=256, help="Texts per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Embedding requests in flight")
+    args = parser.parse_args()
+    
+    from dotenv import load_dotenv
+    from rag_components.faiss_manager import FAISSManager
+    
+    load_dotenv()
+    metadata = {}
+    if args.department:
+        metadata["department"] = args.department
+    if args.doc_type:
+        metadata["type"] = args.doc_type
+    
+    files = find_files(args.paths)
+    manager = FAISSManager(args.embedding_model, index_path=args.index_path)
+    ingestor = BulkIngestor(
+        manager,
+        max_workers=args.workers,
+        batch_chunks=args.batch_chunks,
+        embedding_batch_size=args.embedding_batch_size,
+        max_concurrent_requests=args.concurrency,
+        report_token_savings=True,
+    )
+    report = ingestor.ingest(
+        files,
+        metadata=metadata or None,
+        progress=lambda done, total: print(f"\r{done}/{total} files split", end="", flush=True)
+    )
+    print()
+    print(
+        f"{report['files'] - len(report['failed'])} files, {report['pages']} pages, {report['chunks']} chunks "
+        f"in {report['seconds']:.1f}s ({report['pages_per_sec']:.1f} pages/s, {report['chunks_per_sec']:.1f} chunks/s)"
+    )
+    print(
+        f"Reused: {report['files_reused']} unchanged files, {report['chunks_reused']} chunks "
+        f"({report['reuse_ratio']:.0%} of chunks not embedded again), "
+        f"{report['chunks_replaced']} chunks of earlier versions replaced"
+    )
+    print(
+        f"Embedding tokens: {report['embedding_tokens']} "
+        f"({report['tokens_saved']} fewer than 1000/200-character chunks)"
+    )
+    for file_path, error in report["failed"].items():
+        print(f"Failed: {file_path}: {error}")
+
+
+if __name__ == "__main__":
+    main()
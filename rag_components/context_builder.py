@@ -0,0 +1,138 @@
+from langchain_core.documents import Document
+
+from rag_components.sparse_index import tokenize
+from rag_components.text_splitter import get_encoding, split_units
+
+
+def at_word_boundary(text, position):
+    """Whether `position` in `text` does not fall inside a word"""
+    return position <= 0 or position >= len(text) or not (text[position - 1].isalnum() and text[position].isalnum())
+
+
+def overlap_length(left, right, min_overlap=20, max_overlap=2000):
+    """Length of the longest suffix of `left` that is also a prefix of `right`, if it is at least
+    `min_overlap` characters and starts and ends at word boundaries (0 otherwise), so that short
+    accidental matches such as a page number are not taken for the splitter's overlap"""
+    for length in range(min(len(left), len(right), max_overlap), min_overlap - 1, -1):
+        if (left.endswith(right[:length]) and at_word_boundary(left, len(left) - length)
+                and at_word_boundary(right, length)):
+            return length
+    return 0
+
+
+def merge_texts(left, right):
+    """Join two consecutive chunks, keeping their shared overlap once"""
+    length = overlap_length(left, right)
+    if length:
+        return left + right[length:]
+    return left + " " + right
+
+
+class ContextBuilder:
+    """Assemble retrieved chunks into the context of a prompt.
+    
+    Chunks of the same file and page whose `chunk_index` values are consecutive are merged into
+    one passage with their overlap kept once, and chunks whose text is already contained in another
+    passage are dropped.  If the passages still exceed `max_tokens`, whole sentences are kept by
+    query-term density (then retrieval rank) until the budget is reached, in their original order.
+    """
+    
+    def __init__(self, max_tokens=1500, model="gpt-3.5-turbo"):
+        self.max_tokens = max_tokens
+        self.encoding = get_encoding(model)
+    
+    def count_tokens(self, texts):
+        if not texts:
+            return []
+        return [len(tokens) for tokens in self.encoding.encode_batch(list(texts), disallowed_special=())]
+    
+    def merge_adjacent(self, documents):
+        """Merge consecutive chunks of the same file and page.  Passages keep the rank of their best chunk."""
+        groups = {}
+        for rank, doc in enumerate(documents):
+            source = doc.metadata.get("file_id") or doc.metadata.get("document_id")
+            if source is None or doc.metadata.get("chunk_index") is None:
+                source = ("chunk", rank)
+            groups.setdefault(source, []).append((rank, doc))
+        
+        passages = []
+        for members in groups.values():
+            members.sort(key=lambda member: member[1].metadata.get("chunk_index", 0))
+            rank, doc = members[0]
+            text, last_index, best_rank = doc.page_content, doc.metadata.get("chunk_index"), rank
+            last_page = doc.metadata.get("page")
+            metadata = dict(doc.metadata)
+            for rank, doc in members[1:]:
+                index = doc.metadata.get("chunk_index")
+                page = doc.metadata.get("page")
+                # No overlap is carried across pages, so chunks of different pages are kept apart
+                if last_index is not None and index == last_index + 1 and page == last_page:
+                    text = merge_texts(text, doc.page_content)
+                    best_rank = min(best_rank, rank)
+                else:
+                    passages.append((best_rank, text, metadata))
+                    text, best_rank, metadata = doc.page_content, rank, dict(doc.metadata)
+                last_index, last_page = index, page
+            passages.append((best_rank, text, metadata))
+        
+        passages.sort(key=lambda passage: passage[0])
+        return passages
+    
+    def drop_contained(self, passages):
+        """Drop passages whose text (ignoring spacing) appears inside a higher-ranked one"""
+        kept = []
+        normalized = []
+        for passage in passages:
+            text = " ".join(passage[1].split())
+            if any(text in other for other in normalized):
+                continue
+            kept.append(passage)
+            normalized.append(text)
+        return kept
+    
+    def trim(self, passages, question):
+        """Keep the densest sentences (in query terms) of the passages within the token budget"""
+        query_terms = set(tokenize(question))
+        sentences = [
+            (passage_rank, position, unit)
+            for passage_rank, (_, text, _) in enumerate(passages)
+            for position, (unit, _) in enumerate(split_units(text))
+        ]
+        counts = self.count_tokens([unit for _, _, unit in sentences])
+        
+        def priority(item):
+            (passage_rank, position, unit), tokens = item
+            density = sum(1 for term in tokenize(unit) if term in query_terms) / max(tokens, 1)
+            return (-density, passage_rank, position)
+        
+        kept = set()
+        used = 0
+        for (key, tokens) in sorted(zip(sentences, counts), key=priority):
+            if used + tokens <= self.max_tokens:
+                kept.add(key[:2])
+                used += tokens
+        
+        trimmed = []
+        for passage_rank, (rank, _, metadata) in enumerate(passages):
+            units = [unit for p, position, unit in sentences if p == passage_rank and (p, position) in kept]
+            if units:
+                trimmed.append((rank, " ".join(units), metadata))
+        return trimmed
+    
+    def build(self, documents, question):
+        """Return (context documents, stats) for the retrieved documents of a question"""
+        passages = self.drop_contained(self.merge_adjacent(documents))
+        tokens_before = sum(self.count_tokens([doc.page_content for doc in documents]))
+        tokens = sum(self.count_tokens([text for _, text, _ in passages]))
+        if self.max_tokens and tokens > self.max_tokens:
+            passages = self.trim(passages, question)
+            tokens = sum(self.count_tokens([text for _, text, _ in passages]))
+        
+        context = [Document(page_content=text, metadata=metadata) for _, text, metadata in passages]
+        stats = {
+            "chunks": len(documents),
+            "passages": len(context),
+            "tokens_before": tokens_before,
+            "tokens_after": tokens,
+        }
+        return context, stats
@@ -0,0 +1,102 @@
+import json
+import sqlite3
+import threading
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Keyed on-disk store for chunk text and metadata, used in place of LangChain's pickled InMemoryDocstore.
+    
+    Documents are only read when a search hit needs them, so process memory does not grow with
+    the corpus text, and several processes can share the same file (WAL mode).
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self.connection.commit()
+    
+    def add(self, texts):
+        """Add a dict of docstore id -> Document"""
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO documents (id, page_content, metadata) VALUES (?, ?, ?)",
+                [
+                    (doc_id, doc.page_content, json.dumps(doc.metadata, default=str))
+                    for doc_id, doc in texts.items()
+                ]
+            )
+            self.connection.commit()
+    
+    def delete(self, ids):
+        """Delete documents by docstore id"""
+        with self.lock:
+            self.connection.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in ids])
+            self.connection.commit()
+    
+    def search(self, search):
+        """Return the Document for an id, or an error string as LangChain's docstores do"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT page_content, metadata FROM documents WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+    
+    def mget(self, ids):
+        """Fetch several documents in one query.  Returns a dict of id -> Document."""
+        if not ids:
+            return {}
+        documents = {}
+        with self.lock:
+            for start in range(0, len(ids), 500):
+                batch = list(ids[start:start + 500])
+                placeholders = ",".join("?" for _ in batch)
+                rows = self.connection.execute(
+                    f"SELECT id, page_content, metadata FROM documents WHERE id IN ({placeholders})", batch
+                ).fetchall()
+                for doc_id, page_content, metadata in rows:
+                    documents[doc_id] = Document(page_content=page_content, metadata=json.loads(metadata))
+        return documents
+    
+    def iter_metadata(self, batch_size=1000):
+        """Yield (id, metadata) for every document without loading the text"""
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT rowid, id, metadata FROM documents WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for rowid, doc_id, metadata in rows:
+                yield doc_id, json.loads(metadata)
+            last_rowid = rows[-1][0]
+    
+    def iter_texts(self, batch_size=1000):
+        """Yield (id, page_content) for every document without parsing metadata"""
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.connection.execute(
+                    "SELECT rowid, id, page_content FROM documents WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for rowid, doc_id, page_content in rows:
+                yield doc_id, page_content
+            last_rowid = rows[-1][0]
+    
+    def count(self):
+        """Number of stored documents"""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
@@ -1,25 +1,40 @@
 import os
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
-from langchain_openai import OpenAIEmbeddings
+from langchain_community.document_loaders import TextLoader, Docx2txtLoader
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
 import tempfile
 import shutil
 from datetime import datetime
-import hashlib
+from rag_components.embeddings import get_embeddings, resolve_embedding_model
+from rag_components.utils import content_hash, file_content_hash, scoped_hash
+from rag_components.pdf_stream import iter_pdf_pages
+from rag_components.text_splitter import TokenAwareTextSplitter
 
 
 class DocumentProcessor:
     """Process documents for RAG system"""
     
-    def __init__(self, embedding_model="text-embedding-3-small"):
-        self.embeddings = OpenAIEmbeddings(model=embedding_model)
-        self.text_splitter = RecursiveCharacterTextSplitter(
+    def __init__(self, embedding_model=None, parallel_pdf=False,
+                 chunk_tokens=256, chunk_overlap_tokens=32, report_token_savings=False):
+        embedding_model = resolve_embedding_model(embedding_model)
+        self.embeddings = get_embeddings(embedding_model)
+        # Extract large PDFs in a process pool (see pdf_stream.iter_pdf_pages)
+        self.parallel_pdf = parallel_pdf
+        # Chunks sized in tokens of the embedding model, cut at sentence and heading boundaries
+        self.text_splitter = TokenAwareTextSplitter(
+            chunk_size=chunk_tokens,
+            chunk_overlap=chunk_overlap_tokens,
+            model=embedding_model,
+        )
+        # Previous character-based configuration, only used to report the embedding tokens saved
+        # (it splits and tokenizes every page a second time, so only the bulk_ingest CLI enables it)
+        self.baseline_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200,
             length_function=len,
-        )
+        ) if report_token_savings else None
+        self.token_stats = {"chunks": 0, "embedding_tokens": 0, "baseline_tokens": 0}
     
     def extract_metadata(self, file_path):
         """Extract basic metadata from a file"""
@@ -32,57 +47,90 @@ class DocumentProcessor:
             "size": stat.st_size,
             "created_date": datetime.fromtimestamp(stat.st_ctime).isoformat(),
             "modified_date": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-            "file_id": hashlib.md5(file_path.encode()).hexdigest()
+            # Identifies the content, so the same file under another name or path has the same id
+            "file_id": file_content_hash(file_path)
         }
         
         return metadata
     
+    def file_hash(self, file_path, metadata=None):
+        """Deduplication key of a file: its content hash combined with its access scope"""
+        return scoped_hash(file_content_hash(file_path), metadata or {})
+    
     def load_document(self, file_path):
         """Load document based on file extension"""
+        return list(self.iter_pages(file_path))
+    
+    def iter_pages(self, file_path):
+        """Yield a document's pages one at a time.  PDFs are streamed page-wise with bounded memory."""
         if file_path.endswith(".pdf"):
-            loader = PyPDFLoader(file_path)
-        elif file_path.endswith(".txt"):
+            yield from iter_pdf_pages(file_path, parallel=self.parallel_pdf)
+            return
+        
+        if file_path.endswith(".txt"):
             loader = TextLoader(file_path, encoding="utf-8")
         elif file_path.endswith(".docx"):
             loader = Docx2txtLoader(file_path)
         else:
             raise ValueError(f"Unsupported file type: {file_path}")
         
-        return loader.load()
+        yield from loader.lazy_load()
     
     def process_document(self, file_path, metadata=None):
         """Process a document and return chunks with metadata"""
-        # Load document
-        documents = self.load_document(file_path)
+        return self.split_documents(self.iter_pages(file_path), file_path, metadata)
+    
+    def split_documents(self, documents, file_path, metadata=None):
+        """Add file and custom metadata to loaded pages and split them into chunks"""
+        chunks = list(self.iter_chunks(file_path, metadata, pages=documents))
+        
+        for chunk in chunks:
+            chunk.metadata["total_chunks"] = len(chunks)
         
+        return chunks
+    
+    def iter_chunks(self, file_path, metadata=None, pages=None):
+        """Yield chunks page by page as the document is read, so embedding can start before
+        extraction finishes.  `total_chunks` is only known (and set) by split_documents."""
         # Extract file metadata
         file_metadata = self.extract_metadata(file_path)
+        chunk_index = 0
         
-        # Add metadata to each document
-        for doc in documents:
+        for page in (self.iter_pages(file_path) if pages is None else pages):
             # Add file metadata
-            doc.metadata.update(file_metadata)
+            page.metadata.update(file_metadata)
             
             # Add custom metadata
             if metadata:
-                doc.metadata.update(metadata)
+                page.metadata.update(metadata)
             
-            # Add chunk index
-            doc.metadata["total_chunks"] = len(documents)
-        
-        # Add chunk index to each document
-        for i, doc in enumerate(documents):
-            doc.metadata["chunk_index"] = i
-        
-        # Split document into chunks
-        chunks = self.text_splitter.split_documents(documents)
-        
-        # Update chunk metadata after splitting
-        for i, chunk in enumerate(chunks):
-            chunk.metadata["chunk_index"] = i
-            chunk.metadata["total_chunks"] = len(chunks)
-        
-        return chunks
+            # Split the page into chunks, counting their tokens in one batch
+            chunks = self.text_splitter.split_documents([page])
+            token_counts = self.text_splitter.count_tokens_batch([chunk.page_content for chunk in chunks])
+            self.token_stats["chunks"] += len(chunks)
+            self.token_stats["embedding_tokens"] += sum(token_counts)
+            if self.baseline_splitter is not None:
+                self.token_stats["baseline_tokens"] += sum(
+                    self.text_splitter.count_tokens_batch(self.baseline_splitter.split_text(page.page_content))
+                )
+            
+            for chunk, tokens in zip(chunks, token_counts):
+                chunk.metadata["tokens"] = tokens
+                chunk.metadata["chunk_index"] = chunk_index
+                chunk_index += 1
+                # Chunks of the same document are replaced or deleted together (FAISSManager.upsert_document)
+                chunk.metadata.setdefault("document_id", file_path)
+                # Deduplication keys: unchanged chunks of a re-uploaded or edited file are not embedded again
+                chunk.metadata["file_hash"] = scoped_hash(file_metadata["file_id"], chunk.metadata)
+                chunk.metadata["chunk_hash"] = scoped_hash(content_hash(chunk.page_content), chunk.metadata)
+                yield chunk
+    
+    def token_savings(self):
+        """Embedding tokens of the chunks split so far, against the previous 1000/200 character chunks"""
+        stats = dict(self.token_stats)
+        stats["tokens_saved"] = stats["baseline_tokens"] - stats["embedding_tokens"]
+        stats["saved_ratio"] = stats["tokens_saved"] / stats["baseline_tokens"] if stats["baseline_tokens"] else 0.0
+        return stats
     
     def create_vector_store(self, documents):
         """Create a FAISS vector store from documents"""
@@ -0,0 +1,86 @@
+import os
+import math
+import zlib
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from rag_components.sparse_index import tokenize
+
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Model names served on the CPU without any API call, e.g. "local-hashing" or "local-hashing-768"
+LOCAL_PREFIX = "local-hashing"
+
+
+def resolve_embedding_model(embedding_model=None):
+    """The embedding model to use: the one given, else EMBEDDING_MODEL from the environment"""
+    return embedding_model or os.getenv("EMBEDDING_MODEL") or DEFAULT_EMBEDDING_MODEL
+
+
+def get_embeddings(embedding_model=None):
+    """Embeddings for a model name.  `local-hashing[-<dimension>]` is the offline HashingEmbeddings;
+    any other name is an OpenAI embedding model."""
+    embedding_model = resolve_embedding_model(embedding_model)
+    if embedding_model.startswith(LOCAL_PREFIX):
+        suffix = embedding_model[len(LOCAL_PREFIX):].lstrip("-")
+        return HashingEmbeddings(dimension=int(suffix)) if suffix else HashingEmbeddings()
+    
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=embedding_model)
+
+
+@lru_cache(maxsize=200000)
+def feature_slot(feature, dimension):
+    """(column, sign) of a feature.  crc32 is stable across processes, unlike hash()."""
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % dimension, 1.0 if h & 0x80000000 else -1.0
+
+
+class HashingEmbeddings(Embeddings):
+    """Local embeddings built with the hashing trick, for tests, benchmarks and air-gapped installs.
+    
+    Each text is featurized into its search terms (the same tokenizer as the BM25 index) and the
+    character n-grams of those terms, so spelling variants and inflections still overlap.  Features
+    are hashed into `dimension` signed columns with sublinear term frequency, and rows are
+    L2-normalized so inner product is cosine similarity.  A batch is assembled into one NumPy matrix;
+    no model download or network call is involved, and the same text always gets the same vector.
+    """
+    
+    def __init__(self, dimension=384, ngram_range=(3, 5), ngram_weight=0.5):
+        self.dimension = dimension
+        self.ngram_range = ngram_range
+        self.ngram_weight = ngram_weight
+    
+    def features(self, text):
+        """{feature: weight} of a text"""
+        counts = {}
+        low, high = self.ngram_range
+        for term in tokenize(text):
+            counts[term] = counts.get(term, 0.0) + 1.0
+            padded = f"<{term}>"
+            for n in range(low, min(high, len(padded)) + 1):
+                for start in range(len(padded) - n + 1):
+                    gram = "#" + padded[start:start + n]
+                    counts[gram] = counts.get(gram, 0.0) + self.ngram_weight
+        return counts
+    
+    def embed_documents(self, texts):
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            for feature, count in self.features(text).items():
+                column, sign = feature_slot(feature, self.dimension)
+                rows.append(row)
+                columns.append(column)
+                values.append(sign * math.log1p(count))
+        
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64)), values)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        return matrix.tolist()
+    
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
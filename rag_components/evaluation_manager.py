@@ -1,5 +1,8 @@
 from langchain_core.documents import Document
 from datetime import datetime
+import numpy as np
+import pandas as pd
+from rag_components.evaluation_store import AGGREGATE_COLUMNS, EvaluationStore
 
 
 class EmployeeEvaluation:
@@ -18,47 +21,186 @@ class EmployeeEvaluation:
 
 
 class EvaluationManager:
-    """Manage employee evaluations"""
+    """Manage employee evaluations
     
-    def __init__(self):
-        self.evaluations = []
+    Evaluations are indexed by (employee_id, period, evaluator), by employee and by period, so
+    lookups and updates don't scan every evaluation.  An employee has at most one evaluation per
+    period from each evaluator: adding another one from the same evaluator replaces it, while one
+    from a different evaluator is kept alongside.
+    
+    With a `path`, evaluations are persisted in an EvaluationStore and survive restarts.  They are
+    only loaded into memory on the first lookup; aggregates read the store's score columns into a
+    DataFrame (cached until the next change) without loading the evaluations themselves.
+    """
+    
+    def __init__(self, path=None):
+        self.store = EvaluationStore(path) if path else None
+        self.loaded = self.store is None
+        self.version = 0  # Bumped on every change; invalidates the cached aggregate frame
+        self.cached_frame = None
+        self.cached_frame_version = None
+        self.evaluations = {}  # (employee_id, period, evaluator) -> evaluation, in insertion order
+        self.by_employee = {}  # employee_id -> {(period, evaluator): evaluation}
+        self.by_period = {}  # period -> {(employee_id, evaluator): evaluation}
+    
+    def ensure_loaded(self):
+        """Load persisted evaluations into the in-memory indexes, once"""
+        if self.loaded:
+            return
+        self.loaded = True
+        for row in self.store.rows():
+            evaluation = EmployeeEvaluation(
+                employee_id=row["employee_id"],
+                evaluator=row["evaluator"],
+                period=row["period"],
+                content=row["content"],
+                score=row["score"],
+                metadata=row["metadata"],
+                goals=row["goals"]
+            )
+            evaluation.created_at = row["created_at"]
+            evaluation.updated_at = row["updated_at"]
+            self.index_evaluation(evaluation)
+    
+    @staticmethod
+    def key(employee_id, period, evaluator):
+        """Identity of an evaluation; a missing evaluator is stored as ''"""
+        return employee_id, period, evaluator or ""
+    
+    def index_evaluation(self, evaluation):
+        employee_id, period, evaluator = self.key(evaluation.employee_id, evaluation.period, evaluation.evaluator)
+        self.evaluations[(employee_id, period, evaluator)] = evaluation
+        self.by_employee.setdefault(employee_id, {})[(period, evaluator)] = evaluation
+        self.by_period.setdefault(period, {})[(employee_id, evaluator)] = evaluation
     
     def add_evaluation(self, evaluation):
         """Add an evaluation to the manager"""
-        self.evaluations.append(evaluation)
+        self.add_evaluations([evaluation])
+    
+    def add_evaluations(self, evaluations):
+        """Add many evaluations, persisted in one transaction"""
+        evaluations = list(evaluations)
+        self.ensure_loaded()
+        for evaluation in evaluations:
+            self.index_evaluation(evaluation)
+        if self.store is not None:
+            self.store.upsert(evaluations)
+        self.version += 1
     
-    def update_evaluation(self, employee_id, period, **kwargs):
+    def remove_evaluation(self, employee_id, period, evaluator):
+        """Remove an evaluation.  Returns it, or None if there was none."""
+        self.ensure_loaded()
+        employee_id, period, evaluator = self.key(employee_id, period, evaluator)
+        evaluation = self.evaluations.pop((employee_id, period, evaluator), None)
+        if evaluation is not None:
+            if self.store is not None:
+                self.store.delete(employee_id, period, evaluator)
+            self.version += 1
+            del self.by_employee[employee_id][(period, evaluator)]
+            if not self.by_employee[employee_id]:
+                del self.by_employee[employee_id]
+            del self.by_period[period][(employee_id, evaluator)]
+            if not self.by_period[period]:
+                del self.by_period[period]
+        return evaluation
+    
+    def update_evaluation(self, employee_id, period, evaluator, **kwargs):
         """Update an existing evaluation"""
-        for eval in self.evaluations:
-            if eval.employee_id == employee_id and eval.period == period:
-                for key, value in kwargs.items():
-                    if hasattr(eval, key):
-                        setattr(eval, key, value)
-                eval.updated_at = datetime.now().isoformat()
-                return True
-        return False
+        eval = self.get_evaluation(employee_id, period, evaluator)
+        if eval is None:
+            return False
+        
+        # Re-index if the update moves it to another employee, period or evaluator
+        if "employee_id" in kwargs or "period" in kwargs or "evaluator" in kwargs:
+            self.remove_evaluation(employee_id, period, evaluator)
+        for key, value in kwargs.items():
+            if hasattr(eval, key):
+                setattr(eval, key, value)
+        eval.updated_at = datetime.now().isoformat()
+        self.add_evaluation(eval)
+        return True
     
     def get_evaluations_by_employee(self, employee_id):
         """Get all evaluations for an employee"""
-        return [e for e in self.evaluations if e.employee_id == employee_id]
+        self.ensure_loaded()
+        return list(self.by_employee.get(employee_id, {}).values())
     
     def get_evaluations_by_period(self, period):
         """Get all evaluations for a period"""
-        return [e for e in self.evaluations if e.period == period]
+        self.ensure_loaded()
+        return list(self.by_period.get(period, {}).values())
     
-    def get_evaluation(self, employee_id, period):
+    def get_evaluation(self, employee_id, period, evaluator):
         """Get a specific evaluation"""
-        for eval in self.evaluations:
-            if eval.employee_id == employee_id and eval.period == period:
-                return eval
-        return None
+        self.ensure_loaded()
+        return self.evaluations.get(self.key(employee_id, period, evaluator))
     
     def get_average_score(self, employee_id):
         """Calculate average score for an employee"""
         employee_evals = self.get_evaluations_by_employee(employee_id)
         if not employee_evals:
             return 0
-        return sum([e.score for e in employee_evals]) / len(employee_evals)
+        return float(np.mean([e.score for e in employee_evals]))
+    
+    def frame(self):
+        """Scores of all evaluations as a DataFrame with a `period_order` column for trends"""
+        if self.cached_frame is not None and self.cached_frame_version == self.version:
+            return self.cached_frame
+        version = self.version
+        
+        if self.store is not None:
+            frame = self.store.frame()
+        else:
+            frame = pd.DataFrame(
+                [
+                    (e.employee_id, e.period, e.evaluator, e.metadata.get("department", ""), e.score, e.created_at)
+                    for e in self.evaluations.values()
+                ],
+                columns=AGGREGATE_COLUMNS
+            )
+        frame["score"] = frame["score"].astype(float)
+        
+        # Chronological rank of periods such as "Q1 2024", "2024-03" or "2023": year, then the
+        # first small number left in the label; labels without a year sort by creation date
+        periods = frame["period"].astype(str)
+        year = periods.str.extract(r"(\d{4})")[0].astype(float)
+        part = periods.str.replace(r"\d{4}", "", regex=True).str.extract(r"(\d{1,2})")[0].astype(float).fillna(0)
+        frame["period_key"] = year * 100 + part
+        ordered = frame.sort_values(["period_key", "created_at"], na_position="last")
+        frame["period_order"] = ordered.groupby("period", sort=False).ngroup().reindex(frame.index)
+        
+        self.cached_frame, self.cached_frame_version = frame, version
+        return frame
+    
+    def aggregate(self, by="employee_id"):
+        """Score statistics grouped by `employee_id`, `period`, `department` or `evaluator`.
+        
+        One row per group with count, mean, std, min, median, p90 and max of the scores, the
+        percentile of the group's mean among all groups, and (except by period) the trend: the
+        least-squares slope of the score per period, positive when scores improve.
+        """
+        frame = self.frame()
+        columns = ["count", "mean", "std", "min", "median", "p90", "max", "percentile", "trend"]
+        if frame.empty:
+            return pd.DataFrame(columns=columns)
+        
+        grouped = frame.groupby(by)["score"]
+        result = grouped.agg(["count", "mean", "std", "min", "median", "max"])
+        result["p90"] = grouped.quantile(0.9)
+        result["percentile"] = result["mean"].rank(pct=True) * 100
+        
+        if by == "period":
+            result["trend"] = np.nan
+        else:
+            # slope = cov(x, y) / var(x), from per-group means of x, y, xy and x²
+            x = frame["period_order"].astype(float)
+            y = frame["score"]
+            moments = pd.DataFrame({"x": x, "y": y, "xy": x * y, "xx": x * x, by: frame[by]}).groupby(by).mean()
+            variance = moments["xx"] - moments["x"] ** 2
+            covariance = moments["xy"] - moments["x"] * moments["y"]
+            result["trend"] = (covariance / variance.where(variance > 0)).fillna(0.0)
+        
+        return result[columns]
     
     def get_evaluations_summary(self, employee_id):
         """Get a summary of all evaluations for an employee"""
@@ -66,12 +208,13 @@ class EvaluationManager:
         if not employee_evals:
             return "Nenhuma avaliação encontrada."
         
-        avg_score = self.get_average_score(employee_id)
-        total_evals = len(employee_evals)
+        stats = self.aggregate("employee_id").loc[employee_id]
         
         summary = f"Resumo de Avaliações para o Funcionário {employee_id}:\n"
-        summary += f"- Total de avaliações: {total_evals}\n"
-        summary += f"- Nota média: {avg_score:.2f}\n\n"
+        summary += f"- Total de avaliações: {int(stats['count'])}\n"
+        summary += f"- Nota média: {stats['mean']:.2f}\n"
+        summary += f"- Tendência: {stats['trend']:+.2f} por período\n"
+        summary += f"- Percentil entre funcionários: {stats['percentile']:.0f}\n\n"
         
         for eval in employee_evals:
             summary += f"Período: {eval.period}\n"
@@ -80,11 +223,15 @@ class EvaluationManager:
         
         return summary
     
-    def to_documents(self):
-        """Convert evaluations to LangChain documents for vector storage"""
-        documents = []
-        for eval in self.evaluations:
-            content = f"""
+    @staticmethod
+    def document_id(evaluation):
+        """Vector-store document id of an evaluation: one per employee, period and evaluator"""
+        employee_id, period, evaluator = EvaluationManager.key(evaluation.employee_id, evaluation.period, evaluation.evaluator)
+        return f"evaluation:{employee_id}:{period}:{evaluator}"
+    
+    def to_document(self, eval):
+        """Convert one evaluation to a LangChain document for vector storage"""
+        content = f"""
             Avaliação de Funcionário
             ID do Funcionário: {eval.employee_id}
             Avaliador: {eval.evaluator}
@@ -93,20 +240,24 @@ class EvaluationManager:
             Conteúdo: {eval.content}
             Metas: {", ".join(eval.goals) if eval.goals else "Nenhuma"}
             """
-            
-            metadata = {
-                "type": "employee_evaluation",
-                "employee_id": eval.employee_id,
-                "evaluator": eval.evaluator,
-                "period": eval.period,
-                "score": eval.score,
-                "created_at": eval.created_at,
-                "updated_at": eval.updated_at
-            }
-            
-            metadata.update(eval.metadata)
-            
-            doc = Document(page_content=content, metadata=metadata)
-            documents.append(doc)
         
-        return documents
\ No newline at end of file
+        metadata = {
+            "type": "employee_evaluation",
+            "employee_id": eval.employee_id,
+            "evaluator": eval.evaluator,
+            "period": eval.period,
+            "score": eval.score,
+            "created_at": eval.created_at,
+            "updated_at": eval.updated_at
+        }
+        
+        metadata.update(eval.metadata)
+        
+        return Document(page_content=content, metadata=metadata)
+    
+    def to_documents(self, evaluations=None):
+        """Convert evaluations (all of them by default) to LangChain documents for vector storage"""
+        if evaluations is None:
+            self.ensure_loaded()
+            evaluations = self.evaluations.values()
+        return [self.to_document(eval) for eval in evaluations]
@@ -0,0 +1,114 @@
+import json
+import sqlite3
+import threading
+
+import pandas as pd
+
+
+# Columns read for aggregates; the evaluation text is never loaded for them
+AGGREGATE_COLUMNS = ["employee_id", "period", "evaluator", "department", "score", "created_at"]
+
+TABLE_SCHEMA = """(
+    employee_id TEXT NOT NULL,
+    period TEXT NOT NULL,
+    evaluator TEXT NOT NULL DEFAULT '',
+    department TEXT,
+    score REAL,
+    content TEXT,
+    goals TEXT,
+    metadata TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (employee_id, period, evaluator)
+)"""
+
+
+class EvaluationStore:
+    """On-disk table of employee evaluations, one row per (employee_id, period, evaluator).
+    
+    Scores, periods and departments are stored as their own columns, so aggregates read only
+    those columns straight into a DataFrame.  The file can be shared by several processes (WAL mode).
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS evaluations {TABLE_SCHEMA}")
+        self.migrate_key()
+        self.connection.execute("CREATE INDEX IF NOT EXISTS evaluations_period ON evaluations (period)")
+        self.connection.commit()
+    
+    def migrate_key(self):
+        """Rebuild a table keyed by (employee_id, period) alone, from before evaluations were
+        also keyed by evaluator"""
+        if self.keyed_by_evaluator():
+            return
+        # Another process sharing the file may be migrating it too: check again under the write lock
+        self.connection.execute("BEGIN IMMEDIATE")
+        if self.keyed_by_evaluator():
+            self.connection.rollback()
+            return
+        self.connection.execute("ALTER TABLE evaluations RENAME TO evaluations_old")
+        self.connection.execute(f"CREATE TABLE evaluations {TABLE_SCHEMA}")
+        self.connection.execute(
+            "INSERT INTO evaluations SELECT employee_id, period, COALESCE(evaluator, ''), department, score, "
+            "content, goals, metadata, created_at, updated_at FROM evaluations_old ORDER BY rowid"
+        )
+        self.connection.execute("DROP TABLE evaluations_old")
+        self.connection.commit()
+    
+    def keyed_by_evaluator(self):
+        key = [row[1] for row in self.connection.execute("PRAGMA table_info(evaluations)") if row[5]]
+        return "evaluator" in key
+    
+    def upsert(self, evaluations):
+        """Insert or replace evaluations in one transaction"""
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        e.employee_id, e.period, e.evaluator or "", e.metadata.get("department", ""), e.score,
+                        e.content, json.dumps(e.goals), json.dumps(e.metadata, default=str),
+                        e.created_at, e.updated_at
+                    )
+                    for e in evaluations
+                ]
+            )
+            self.connection.commit()
+    
+    def delete(self, employee_id, period, evaluator):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM evaluations WHERE employee_id = ? AND period = ? AND evaluator = ?",
+                (employee_id, period, evaluator or "")
+            )
+            self.connection.commit()
+    
+    def rows(self):
+        """All evaluations as dicts, in insertion order"""
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT employee_id, period, evaluator, score, content, goals, metadata, created_at, updated_at "
+                "FROM evaluations ORDER BY rowid"
+            )
+            names = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+        for row in rows:
+            row = dict(zip(names, row))
+            row["goals"] = json.loads(row["goals"] or "[]")
+            row["metadata"] = json.loads(row["metadata"] or "{}")
+            yield row
+    
+    def frame(self):
+        """The aggregate columns of every evaluation as a DataFrame"""
+        with self.lock:
+            return pd.read_sql_query(
+                f"SELECT {', '.join(AGGREGATE_COLUMNS)} FROM evaluations ORDER BY rowid", self.connection
+            )
+    
+    def close(self):
+        with self.lock:
+            self.connection.close()
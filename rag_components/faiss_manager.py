@@ -1,91 +1,888 @@
 import os
+import json
+import uuid
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError:  # Windows: the manifest lock only covers this process
+    fcntl = None
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-import pickle
+from rag_components.ann_index import extract_vectors, is_lossy, select_and_build_index, set_search_params
+from rag_components.docstore import SQLiteDocstore
+from rag_components.embeddings import DEFAULT_EMBEDDING_MODEL, get_embeddings, resolve_embedding_model
+from rag_components.metadata_index import MetadataIndex
+from rag_components.segmented_index import SegmentedIndex, read_index
+from rag_components.sparse_index import BM25Index, reciprocal_rank_fusion
+from rag_components.utils import ReadWriteLock, content_hash, scoped_hash
 from datetime import datetime
 
 
 class FAISSManager:
-    """Manage FAISS vector store for enterprise documents"""
+    """Manage FAISS vector store for enterprise documents
     
-    def __init__(self, embedding_model="text-embedding-3-small", index_path="faiss_index"):
-        self.embedding_model = embedding_model
-        self.embeddings = OpenAIEmbeddings(model=embedding_model)
+    On disk the store is a base segment plus append-only delta segments, one per added batch,
+    listed in `manifest.json`.  Adding documents only writes the new delta, so write cost is
+    proportional to the batch, not the corpus.  `compact()` folds the deltas back into a new base;
+    it runs in the background once `max_delta_segments` deltas have accumulated.
+    
+    Each segment is a raw FAISS index (`<name>.faiss`) plus its docstore ids (`<name>.ids.json`).
+    Segments are memory-mapped when loaded, so processes serving the same store share their pages,
+    and chunk text/metadata live in `docstore.sqlite`, read only for the hits of a search.
+    Stores saved in LangChain's pickled layout (`index.pkl`) are converted on first load.
+    
+    Metadata fields are kept in an inverted index (metadata_index.py), so filtered searches
+    only score the vectors the filter allows.  A BM25 index over the chunk text (sparse_index.py),
+    built from the docstore on the first hybrid search and then kept in sync, lets `hybrid_search`
+    find exact terms such as employee ids and policy codes that embeddings miss.
+    
+    Chunks carry a `chunk_hash` (text plus access scope); chunks already indexed are skipped
+    before embedding, and `ingest_stats` records how much was reused.
+    
+    Chunks carry a `document_id`; `upsert_document`/`delete_document` replace or remove one
+    document's chunks by tombstoning their vectors (see `deleted` in the manifest) until compaction.
+    
+    Searches hold the read side of `lock` and writes its write side, so one manager can be shared
+    by every session of a process.  Each manifest write bumps its `version`; `refresh()` reloads the
+    store when another process (e.g. the bulk_ingest CLI) has written a newer one.  Manifest
+    updates also hold a file lock (`manifest.lock`), so processes never interleave them, and a
+    compaction never drops segments it has not loaded.
+    
+    The embedding model (OpenAI, or the offline `local-hashing` backend of embeddings.py) is
+    recorded in the manifest, and a store is never opened with a different one.
+    
+    Compaction also rebuilds the base index, choosing exact (flat), HNSW or IVF-PQ search by
+    corpus size and `latency_target_ms` (see ann_index.py).  The recall@k/latency report that
+    justified the choice is saved as `index_report.json`.
+    """
+    
+    def __init__(self, embedding_model=None, index_path="faiss_index", max_delta_segments=20,
+                 latency_target_ms=None, index_params=None, mmap=True, max_deleted_fraction=0.2):
+        self.embedding_model = resolve_embedding_model(embedding_model)
+        self.embeddings = get_embeddings(self.embedding_model)
         self.index_path = index_path
+        self.max_delta_segments = max_delta_segments
+        self.latency_target_ms = latency_target_ms
+        self.index_params = index_params
+        self.mmap = mmap
+        self.max_deleted_fraction = max_deleted_fraction
         self.vector_store = None
+        self.docstore = None
+        self.metadata_index = MetadataIndex()
+        self.sparse_index = None
+        self.ingest_stats = {"files": 0, "files_reused": 0, "chunks": 0, "chunks_reused": 0}
+        self.lock = ReadWriteLock()
+        self.compaction_thread = None
+        # Serializes compactions, whether started in the background or called directly
+        self.compaction_lock = threading.Lock()
+        # Manifest version this process has loaded or written, and when it last checked the disk
+        self.manifest_version = 0
+        self.manifest_checked_at = 0.0
         self.load_vector_store()
     
+    @property
+    def manifest_path(self):
+        return os.path.join(self.index_path, "manifest.json")
+    
+    def read_manifest(self):
+        """Read the segment manifest.  Stores written before segmentation only have the base."""
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        return {"base": "index", "segments": [], "next_segment": 1}
+    
+    @contextmanager
+    def manifest_lock(self):
+        """Exclusive lock on the manifest across processes (flock on `manifest.lock`), held around
+        every read-modify-write of the manifest.  Taken after `lock`, never the other way round."""
+        os.makedirs(self.index_path, exist_ok=True)
+        with open(os.path.join(self.index_path, "manifest.lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def manifest_is_newer(self):
+        """Whether another process wrote the manifest since this one last loaded or wrote it"""
+        return self.read_manifest().get("version", 0) > self.manifest_version
+    
+    def write_manifest(self, manifest):
+        """Atomically replace the segment manifest, bumping its version"""
+        disk_version = manifest.get("version", 0)
+        manifest["version"] = max(disk_version, self.manifest_version) + 1
+        if disk_version <= self.manifest_version:
+            self.manifest_version = manifest["version"]
+        # Otherwise another process wrote since our last load: stay behind so refresh() reloads
+        manifest["embedding_model"] = self.embedding_model
+        os.makedirs(self.index_path, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+    
+    @property
+    def report_path(self):
+        return os.path.join(self.index_path, "index_report.json")
+    
+    def read_index_report(self):
+        """Read the report written by the last index rebuild, if any"""
+        if os.path.exists(self.report_path):
+            with open(self.report_path, "r") as f:
+                return json.load(f)
+        return None
+    
+    def get_docstore(self):
+        """Open the on-disk docstore on first use"""
+        if self.docstore is None:
+            os.makedirs(self.index_path, exist_ok=True)
+            self.docstore = SQLiteDocstore(os.path.join(self.index_path, "docstore.sqlite"))
+        return self.docstore
+    
+    def make_vector_store(self, index, docstore_ids):
+        """Wrap a segmented index and its docstore ids in a LangChain FAISS vector store"""
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=self.get_docstore(),
+            index_to_docstore_id=dict(enumerate(docstore_ids))
+        )
+    
+    def index_metadata(self, documents, offset):
+        """Add a batch stored from vector id `offset` onwards to the metadata (and, once built, BM25) index"""
+        for position, doc in enumerate(documents):
+            self.metadata_index.add(offset + position, doc.metadata)
+            if self.sparse_index is not None:
+                self.sparse_index.add(offset + position, doc.page_content)
+    
+    def get_sparse_index(self):
+        """Build the BM25 index from the docstore on first use"""
+        with self.lock.read():
+            if self.sparse_index is not None:
+                return self.sparse_index
+        # Only building takes the write side; another thread may have built it meanwhile
+        with self.lock:
+            if self.sparse_index is None:
+                sparse_index = BM25Index()
+                if self.vector_store is not None:
+                    positions = {doc_id: position for position, doc_id in self.vector_store.index_to_docstore_id.items()}
+                    texts = sorted(
+                        (positions[doc_id], text)
+                        for doc_id, text in self.get_docstore().iter_texts()
+                        if doc_id in positions
+                    )
+                    for position, text in texts:
+                        sparse_index.add(position, text)
+                    sparse_index.delete(self.vector_store.index.deleted)
+                self.sparse_index = sparse_index
+            return self.sparse_index
+    
+    def rebuild_metadata_index(self, docstore_ids):
+        """Rebuild the metadata index from the docstore, reading metadata only"""
+        positions = {doc_id: position for position, doc_id in enumerate(docstore_ids)}
+        entries = sorted(
+            (positions[doc_id], metadata)
+            for doc_id, metadata in self.get_docstore().iter_metadata()
+            if doc_id in positions
+        )
+        self.metadata_index.clear()
+        for position, metadata in entries:
+            self.metadata_index.add(position, metadata)
+    
+    def segment_path(self, name, extension):
+        return os.path.join(self.index_path, f"{name}{extension}")
+    
+    def segment_exists(self, name):
+        return os.path.exists(self.segment_path(name, ".faiss"))
+    
+    def write_segment(self, name, index, docstore_ids, raw=None):
+        """Write a segment's index and docstore ids, and its original vectors (`<name>.vectors.npy`)
+        if the index is lossy; the manifest is updated separately"""
+        os.makedirs(self.index_path, exist_ok=True)
+        if raw is not None:
+            tmp_path = self.segment_path(name, ".vectors.tmp.npy")
+            np.save(tmp_path, np.ascontiguousarray(raw, dtype=np.float32))
+            os.replace(tmp_path, self.segment_path(name, ".vectors.npy"))
+        faiss.write_index(index, self.segment_path(name, ".faiss"))
+        tmp_path = self.segment_path(name, ".ids.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(docstore_ids, f)
+        os.replace(tmp_path, self.segment_path(name, ".ids.json"))
+    
+    def read_segment(self, name):
+        """Read a segment.  Returns (index, docstore_ids, memory_mapped, raw vectors or None)."""
+        index, memory_mapped = read_index(self.segment_path(name, ".faiss"), mmap=self.mmap)
+        with open(self.segment_path(name, ".ids.json"), "r") as f:
+            docstore_ids = json.load(f)
+        raw = None
+        if os.path.exists(self.segment_path(name, ".vectors.npy")):
+            raw = np.load(self.segment_path(name, ".vectors.npy"), mmap_mode="r" if self.mmap else None)
+        return index, docstore_ids, memory_mapped, raw
+    
+    def remove_segment_files(self, name):
+        for extension in [".faiss", ".ids.json", ".vectors.npy", ".pkl"]:
+            path = self.segment_path(name, extension)
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def migrate_pickled_segment(self, name):
+        """Convert a segment saved by LangChain's save_local: documents go to the sqlite docstore,
+        ids to `<name>.ids.json`.  The pickle is only removed once both are written."""
+        legacy = FAISS.load_local(
+            self.index_path,
+            self.embeddings,
+            index_name=name,
+            allow_dangerous_deserialization=True
+        )
+        docstore_ids = [legacy.index_to_docstore_id[i] for i in range(legacy.index.ntotal)]
+        self.get_docstore().add({doc_id: legacy.docstore.search(doc_id) for doc_id in docstore_ids})
+        
+        tmp_path = self.segment_path(name, ".ids.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(docstore_ids, f)
+        os.replace(tmp_path, self.segment_path(name, ".ids.json"))
+        os.remove(self.segment_path(name, ".pkl"))
+    
+    def embed_documents(self, documents):
+        """Embed documents' text as a float32 matrix"""
+        return np.array(
+            self.embeddings.embed_documents([doc.page_content for doc in documents]),
+            dtype=np.float32
+        )
+    
+    def build_segment(self, vectors):
+        """Put a batch of vectors in a new flat index.  Returns (index, docstore_ids)."""
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+        return index, [str(uuid.uuid4()) for _ in range(vectors.shape[0])]
+    
     def create_vector_store(self, documents):
         """Create a new FAISS vector store from documents"""
         if not documents:
             raise ValueError("No documents provided to create vector store")
         
-        self.vector_store = FAISS.from_documents(documents, self.embeddings)
+        index, docstore_ids = self.build_segment(self.embed_documents(documents))
+        self.get_docstore().add(dict(zip(docstore_ids, documents)))
+        self.vector_store = self.make_vector_store(SegmentedIndex(index.d, [index]), docstore_ids)
+        self.metadata_index.clear()
+        self.sparse_index = None
+        self.index_metadata(documents, 0)
         return self.vector_store
     
+    def seen_file(self, file_hash):
+        """Count a file in the ingest statistics and tell whether the same content
+        (with the same access scope) is already indexed"""
+        with self.lock:
+            reused = self.metadata_index.contains("file_hash", file_hash)
+            self.ingest_stats["files"] += 1
+            self.ingest_stats["files_reused"] += int(reused)
+        return reused
+    
+    def document_has_file(self, document_id, file_hash):
+        """Whether a document's live chunks were split from this file content (same access scope),
+        i.e. re-ingesting the file under that document_id would change nothing"""
+        with self.lock.read():
+            return bool(len(np.intersect1d(
+                self.document_vector_ids(document_id),
+                self.metadata_index.positions("file_hash", file_hash),
+                assume_unique=True
+            )))
+    
+    def new_documents(self, documents):
+        """Drop chunks that are already indexed, or repeated within the batch, under the same
+        document_id (by chunk_hash).  The same chunk under another document is kept, so deleting
+        that document does not remove it.  Chunks without a hash (e.g. evaluations) get it computed here."""
+        new = []
+        batch_keys = set()
+        with self.lock:
+            for doc in documents:
+                chunk_hash = doc.metadata.get("chunk_hash")
+                if chunk_hash is None:
+                    chunk_hash = scoped_hash(content_hash(doc.page_content), doc.metadata)
+                    doc.metadata["chunk_hash"] = chunk_hash
+                document_id = doc.metadata.get("document_id")
+                indexed = self.metadata_index.positions("chunk_hash", chunk_hash)
+                if document_id is not None and len(indexed):
+                    indexed = np.intersect1d(indexed, self.document_vector_ids(document_id), assume_unique=True)
+                if (document_id, chunk_hash) in batch_keys or len(indexed):
+                    continue
+                batch_keys.add((document_id, chunk_hash))
+                new.append(doc)
+            
+            self.ingest_stats["chunks"] += len(documents)
+            self.ingest_stats["chunks_reused"] += len(documents) - len(new)
+        return new
+    
+    def reuse_ratio(self):
+        """Fraction of ingested chunks that were already indexed and not embedded again"""
+        chunks = self.ingest_stats["chunks"]
+        return self.ingest_stats["chunks_reused"] / chunks if chunks else 0.0
+    
     def add_documents(self, documents):
-        """Add documents to the existing vector store or create a new one"""
+        """Add documents to the existing vector store or create a new one.
+        Chunks already indexed are skipped; only the new ones are written to disk, as a delta segment."""
         if not documents:
             raise ValueError("No documents provided to add")
         
-        if self.vector_store is None:
-            self.create_vector_store(documents)
-        else:
-            # Add documents to existing store
-            self.vector_store.add_documents(documents)
+        # Embed and index only the new chunks of the batch
+        documents = self.new_documents(documents)
+        if documents:
+            self.add_embedded_documents(documents, self.embed_documents(documents))
+    
+    def add_embedded_documents(self, documents, vectors):
+        """Add documents whose embeddings were already computed (one row per document).
+        The batch is written to disk as a single delta segment."""
+        if not documents:
+            raise ValueError("No documents provided to add")
+        if len(documents) != len(vectors):
+            raise ValueError("Number of documents and embeddings differ")
+        
+        segment, docstore_ids = self.build_segment(vectors)
+        
+        with self.lock, self.manifest_lock():
+            self.get_docstore().add(dict(zip(docstore_ids, documents)))
+            manifest = self.read_manifest()
+            
+            if self.vector_store is None and not self.segment_exists(manifest["base"]):
+                # First batch becomes the base segment
+                segment_name = manifest["base"]
+            else:
+                segment_name = f"delta_{manifest['next_segment']:06d}"
+                manifest["segments"].append(segment_name)
+                manifest["next_segment"] += 1
+            
+            self.write_segment(segment_name, segment, docstore_ids)
+            self.write_manifest(manifest)
+            
+            if self.vector_store is None:
+                offset = 0
+                self.metadata_index.clear()
+                self.sparse_index = None
+                self.vector_store = self.make_vector_store(SegmentedIndex(segment.d, [segment]), docstore_ids)
+            else:
+                offset = self.vector_store.index.ntotal
+                self.vector_store.index.add_segment(segment)
+                for position, docstore_id in enumerate(docstore_ids):
+                    self.vector_store.index_to_docstore_id[offset + position] = docstore_id
+            self.index_metadata(documents, offset)
+            
+            if len(manifest["segments"]) >= self.max_delta_segments:
+                self.compact_in_background()
+    
+    def document_vector_ids(self, document_id):
+        """Vector ids of a document's live chunks"""
+        return self.metadata_index.positions("document_id", document_id)
+    
+    def delete_document(self, document_id):
+        """Delete a document's chunks.  Their vectors are tombstoned (skipped by searches) and
+        dropped at the next compaction, which starts once too large a share of the index is deleted.
+        Returns the number of chunks deleted."""
+        with self.lock:
+            ids = self.document_vector_ids(document_id)
+            if self.vector_store is None or not len(ids):
+                return 0
+            
+            docstore_ids = [self.vector_store.index_to_docstore_id[int(i)] for i in ids]
+            self.vector_store.index.delete(ids)
+            self.metadata_index.delete(ids)
+            if self.sparse_index is not None:
+                self.sparse_index.delete(ids)
+            
+            with self.manifest_lock():
+                manifest = self.read_manifest()
+                manifest["deleted"] = manifest.get("deleted", []) + docstore_ids
+                self.write_manifest(manifest)
+            self.get_docstore().delete(docstore_ids)
+            
+            index = self.vector_store.index
+            if len(index.deleted) > self.max_deleted_fraction * index.ntotal:
+                self.compact_in_background()
+        return len(ids)
+    
+    def upsert_document(self, document_id, documents, batch_size=256):
+        """Replace all chunks of a document.  Chunks whose text is already indexed (same chunk_hash)
+        reuse the stored embedding, so only new or changed chunks are embedded and the cost is
+        proportional to the change.  Returns counts of deleted, added and embedded chunks.
+        
+        `documents` may be a generator (DocumentProcessor.iter_chunks): chunks are taken in
+        batches of `batch_size` and each batch is embedded in the background while the next one
+        is being extracted.  The old chunks are only replaced once every batch is embedded."""
+        return self.upsert_documents({document_id: documents}, batch_size=batch_size)
+    
+    def upsert_documents(self, documents_by_id, batch_size=256, embed=None):
+        """Replace the chunks of many documents, given as {document_id: chunks}, with one index write
+        for all of them (see upsert_document).  `embed` maps a list of chunks to their vectors (default
+        `embed_documents`).  Returns total counts of deleted, added and embedded chunks."""
+        chunks = []
+        batches = []
+        embedded_count = 0
+        
+        def tagged_chunks():
+            for document_id, documents in documents_by_id.items():
+                for doc in documents:
+                    doc.metadata["document_id"] = document_id
+                    yield doc
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            batch = []
+            for doc in tagged_chunks():
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    embedded_count += self.submit_upsert_batch(executor, batch, batches, embed)
+                    chunks.extend(batch)
+                    batch = []
+            if batch:
+                embedded_count += self.submit_upsert_batch(executor, batch, batches, embed)
+                chunks.extend(batch)
+            
+            vectors = [vector for vectors in (future.result() for future in batches) for vector in vectors]
+        
+        with self.lock:
+            deleted = sum(self.delete_document(document_id) for document_id in documents_by_id)
+            if chunks:
+                self.add_embedded_documents(chunks, np.array(vectors, dtype=np.float32))
+            self.ingest_stats["chunks"] += len(chunks)
+            self.ingest_stats["chunks_reused"] += len(chunks) - embedded_count
         
-        # Save the updated vector store
-        self.save_vector_store()
+        return {"deleted": deleted, "added": len(chunks), "embedded": embedded_count}
     
-    def similarity_search(self, query, k=5, filter=None):
+    def submit_upsert_batch(self, executor, batch, batches, embed=None):
+        """Look up reusable vectors for a batch of upserted chunks (from any document) and submit the
+        rest for embedding, each distinct chunk once.  Appends a future of the batch's vectors, in
+        order, to `batches`; returns how many chunks are embedded."""
+        embed = embed or self.embed_documents
+        reused = {}
+        with self.lock.read():
+            for doc in batch:
+                if "chunk_hash" not in doc.metadata:
+                    doc.metadata["chunk_hash"] = scoped_hash(content_hash(doc.page_content), doc.metadata)
+                positions = self.metadata_index.positions("chunk_hash", doc.metadata["chunk_hash"])
+                if self.vector_store is not None and len(positions):
+                    reused[doc.metadata["chunk_hash"]] = self.vector_store.index.original(int(positions[0]))
+        
+        to_embed = list({
+            doc.metadata["chunk_hash"]: doc for doc in batch if doc.metadata["chunk_hash"] not in reused
+        }.values())
+        
+        def batch_vectors():
+            # Embed outside the lock
+            if to_embed:
+                reused.update(zip((doc.metadata["chunk_hash"] for doc in to_embed), embed(to_embed)))
+            return [reused[doc.metadata["chunk_hash"]] for doc in batch]
+        
+        batches.append(executor.submit(batch_vectors))
+        return len(to_embed)
+    
+    def similarity_search(self, query, k=5, filter=None, ids=None):
         """Perform similarity search on the vector store"""
         if self.vector_store is None:
             return []
         
-        if filter:
-            return self.vector_store.similarity_search(query, k=k, filter=filter)
+        if filter or ids is not None:
+            return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter, ids=ids)]
         else:
-            return self.vector_store.similarity_search(query, k=k)
+            with self.lock.read():
+                return self.vector_store.similarity_search(query, k=k)
+    
+    def similarity_search_with_score(self, query, k=5, filter=None, ids=None):
+        """Search with (document, L2 distance) results.  Filters the metadata index can answer, and
+        `ids` (sorted vector ids, e.g. from access control), are applied before the search so only
+        eligible vectors are scored; other filters fall back to LangChain's post-filtering."""
+        if self.vector_store is None:
+            return []
+        if ids is None and (not filter or not self.metadata_index.supports(filter)):
+            with self.lock.read():
+                return self.vector_store.similarity_search_with_score(query, k=k, filter=filter)
+        
+        embedding = self.embeddings.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter, ids=ids)
+    
+    def similarity_search_by_vector(self, embedding, k=5, filter=None, ids=None):
+        """Search with an already computed query embedding"""
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter, ids=ids)]
+    
+    def similarity_search_with_score_by_vector(self, embedding, k=5, filter=None, ids=None):
+        """Search with an already computed query embedding; see similarity_search_with_score"""
+        if self.vector_store is None:
+            return []
+        with self.lock.read():
+            if ids is None and (not filter or not self.metadata_index.supports(filter)):
+                return self.vector_store.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+            
+            ids = self.allowed_ids(filter, ids)
+            if not len(ids):
+                return []
+            
+            distances, positions = self.vector_store.index.search(np.array([embedding], dtype=np.float32), k, ids=ids)
+            return self.fetch_hits(self.vector_store.index_to_docstore_id, [
+                (int(position), float(distance))
+                for distance, position in zip(distances[0], positions[0])
+                if position >= 0
+            ])
+    
+    def allowed_ids(self, filter, ids):
+        """Sorted vector ids allowed by a metadata filter and/or given ids; None if neither restricts"""
+        if filter:
+            if not self.metadata_index.supports(filter):
+                raise ValueError("Filters combined with vector ids must be plain field/value dicts")
+            selected = self.metadata_index.select(filter)
+            ids = selected if ids is None else np.intersect1d(ids, selected, assume_unique=True)
+        return ids
+    
+    def fetch_hits(self, index_to_docstore_id, hits):
+        """Documents of (vector id, score) hits, in order, with one docstore read"""
+        hits = [(index_to_docstore_id[position], score) for position, score in hits]
+        documents = self.get_docstore().mget([doc_id for doc_id, _ in hits])
+        return [(documents[doc_id], score) for doc_id, score in hits if doc_id in documents]
+    
+    def hybrid_search(self, query, k=5, filter=None, ids=None, embedding=None, fetch_k=None, rrf_k=60):
+        """Search with both the embeddings and BM25 over the chunk text, merged by reciprocal rank fusion.
+        
+        Each side returns its `fetch_k` best chunks (default 4k) among those allowed by `filter`
+        and `ids`; the query is embedded (unless `embedding` is given) in a thread while BM25
+        scores.  Returns (document, fused score) pairs, highest first.
+        """
+        if self.vector_store is None:
+            return []
+        fetch_k = fetch_k or max(4 * k, 20)
+        sparse_index = self.get_sparse_index()
+        
+        def keyword_search():
+            allowed = self.allowed_ids(filter, ids)
+            if allowed is not None and not len(allowed):
+                return allowed, []
+            positions, _ = sparse_index.search(query, fetch_k, ids=allowed)
+            return allowed, positions.tolist()
+        
+        # Embed the query (a network call, made without holding the lock) while BM25 scores
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending = executor.submit(self.embeddings.embed_query, query) if embedding is None else None
+            with self.lock.read():
+                version = self.metadata_index.version
+                allowed, sparse = keyword_search()
+            if pending is not None:
+                embedding = pending.result()
+        
+        with self.lock.read():
+            if self.vector_store is None:
+                return []
+            if self.metadata_index.version != version:
+                # Ids changed while embedding (e.g. a compaction); score keywords again, or go
+                # dense-only for this query if the store was reloaded and BM25 is not rebuilt yet
+                sparse_index = self.sparse_index
+                if sparse_index is not None:
+                    allowed, sparse = keyword_search()
+                else:
+                    allowed, sparse = self.allowed_ids(filter, ids), []
+            if allowed is not None and not len(allowed):
+                return []
+            
+            _, positions = self.vector_store.index.search(np.array([embedding], dtype=np.float32), fetch_k, ids=allowed)
+            dense = [int(position) for position in positions[0] if position >= 0]
+            fused = reciprocal_rank_fusion([dense, sparse], k=rrf_k)
+            return self.fetch_hits(self.vector_store.index_to_docstore_id, fused[:k])
+    
+    def search_batch(self, embeddings, k=5, filter=None, ids=None, queries=None, fetch_k=None, rrf_k=60):
+        """Search many already embedded queries with one matrix search and one docstore read.
+        
+        With `queries` (the texts of the embeddings), results fuse BM25 and dense rankings like
+        `hybrid_search` and scores are fused scores; otherwise they are L2 distances.  Returns one
+        list of (document, score) pairs per query, in order.
+        """
+        if self.vector_store is None or not len(embeddings):
+            return [[] for _ in embeddings]
+        if queries is not None:
+            self.get_sparse_index()
+            fetch_k = fetch_k or max(4 * k, 20)
+        
+        with self.lock.read():
+            if self.vector_store is None:
+                return [[] for _ in embeddings]
+            allowed = self.allowed_ids(filter, ids)
+            if allowed is not None and not len(allowed):
+                return [[] for _ in embeddings]
+            
+            distances, positions = self.vector_store.index.search(
+                np.array(embeddings, dtype=np.float32), fetch_k if queries is not None else k, ids=allowed
+            )
+            # Dense-only if the store was reloaded since the BM25 index was built
+            sparse_index = self.sparse_index if queries is not None else None
+            hits = []
+            for row in range(len(embeddings)):
+                dense = [
+                    (int(position), float(distance))
+                    for distance, position in zip(distances[row], positions[row])
+                    if position >= 0
+                ]
+                if queries is None:
+                    hits.append(dense)
+                    continue
+                sparse = []
+                if sparse_index is not None:
+                    sparse = sparse_index.search(queries[row], fetch_k, ids=allowed)[0].tolist()
+                fused = reciprocal_rank_fusion([[position for position, _ in dense], sparse], k=rrf_k)
+                hits.append(fused[:k])
+            
+            index_to_docstore_id = self.vector_store.index_to_docstore_id
+            documents = self.get_docstore().mget(
+                list({index_to_docstore_id[position] for row in hits for position, _ in row})
+            )
+            return [
+                [
+                    (documents[index_to_docstore_id[position]], score)
+                    for position, score in row
+                    if index_to_docstore_id[position] in documents
+                ]
+                for row in hits
+            ]
     
     def max_marginal_relevance_search(self, query, k=5, fetch_k=20):
         """Perform Max Marginal Relevance search to improve diversity"""
         if self.vector_store is None:
             return []
         
-        return self.vector_store.max_marginal_relevance_search(query, k=k, fetch_k=fetch_k)
+        with self.lock.read():
+            return self.vector_store.max_marginal_relevance_search(query, k=k, fetch_k=fetch_k)
     
     def save_vector_store(self):
-        """Save the vector store to disk"""
+        """Save the whole vector store to disk as a single base segment"""
+        self.compact()
+    
+    def rebuild_index(self):
+        """Rebuild the in-memory index with the type suited to the corpus size, dropping tombstoned vectors.
+        The build runs without holding the lock; vectors added or deleted meanwhile are carried over before the swap.
+        The build uses the original vectors, not IVF-PQ reconstructions, so repeated rebuilds lose no recall;
+        a lossy result keeps them as its raw vectors.  Returns the index report, or None if nothing was swapped."""
+        with self.compaction_lock:
+            return self.build_and_swap_index()[0]
+    
+    def build_and_swap_index(self):
+        """Body of rebuild_index (call with `compaction_lock` held).  Returns (report, rebuilt index), or
+        (None, None) if there was nothing to rebuild or the store was reloaded during the build."""
+        with self.lock:
+            if self.vector_store is None or self.vector_store.index.ntotal == 0:
+                return None, None
+            current = self.vector_store.index
+            snapshot_total = current.ntotal
+            kept = np.setdiff1d(np.arange(snapshot_total, dtype=np.int64), current.deleted, assume_unique=True)
+            vectors = current.original_n(0, snapshot_total)[kept]
+        
+        if len(kept):
+            index, report = select_and_build_index(vectors, self.latency_target_ms, self.index_params)
+        else:
+            index, report = faiss.IndexFlatL2(current.d), {"index_type": "flat", "n_vectors": 0}
+        
+        with self.lock:
+            if self.vector_store is None or self.vector_store.index is not current:
+                # Reloaded meanwhile (refresh): the snapshot's ids no longer match, so drop the build
+                return None, None
+            late = np.arange(snapshot_total, current.ntotal, dtype=np.int64)
+            late_vectors = current.original_n(snapshot_total, len(late))
+            if len(late):
+                index.add(late_vectors)
+            
+            # Renumber: kept vectors first, then the ones added during the build
+            old_positions = np.concatenate([kept, late])
+            old_to_new = np.full(current.ntotal, -1, dtype=np.int64)
+            old_to_new[old_positions] = np.arange(len(old_positions), dtype=np.int64)
+            
+            rebuilt = SegmentedIndex(index.d)
+            rebuilt.add_segment(index, raw=np.vstack([vectors, late_vectors]) if is_lossy(index) else None)
+            still_deleted = old_to_new[current.deleted]
+            rebuilt.delete(still_deleted[still_deleted >= 0])
+            
+            old_docstore_ids = self.vector_store.index_to_docstore_id
+            self.vector_store.index_to_docstore_id = {
+                new: old_docstore_ids[int(old)] for new, old in enumerate(old_positions)
+            }
+            self.vector_store.index = rebuilt
+            self.metadata_index.remap(old_to_new, len(old_positions))
+            if self.sparse_index is not None:
+                self.sparse_index.remap(old_to_new, len(old_positions))
+        
+        return report, rebuilt
+    
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Tune recall/latency of an IVF (nprobe) or HNSW (efSearch) index"""
         if self.vector_store is not None:
-            self.vector_store.save_local(self.index_path)
+            for segment in self.vector_store.index.segments:
+                set_search_params(segment, nprobe=nprobe, ef_search=ef_search)
+    
+    def compact(self):
+        """Rebuild the index and merge the base and all delta segments into a new base segment, dropping the deltas.
+        
+        The new base replaces every segment in the manifest, so it must hold all of them: segments
+        another process (e.g. the bulk_ingest CLI) appended are loaded before the rebuild, and if one
+        is appended during the rebuild the switch is abandoned and the store reloaded instead.
+        Compactions run one at a time (`compaction_lock`).
+        """
+        with self.compaction_lock:
+            self.compact_locked()
+    
+    def compact_locked(self):
+        """Body of compact (call with `compaction_lock` held)"""
+        with self.lock:
+            if self.manifest_is_newer():
+                self.load_vector_store()
+        
+        report, rebuilt = self.build_and_swap_index()
+        
+        with self.lock, self.manifest_lock():
+            if self.vector_store is None or report is None:
+                return
+            if self.vector_store.index is not rebuilt:
+                # Reloaded since the swap: the rebuilt base is gone, and the next compaction redoes it
+                return
+            if self.manifest_is_newer():
+                # Written by another process during the rebuild: its segments are not in our base
+                self.load_vector_store()
+                return
+            
+            with open(self.report_path, "w") as f:
+                json.dump(report, f, indent=2)
+            
+            # Fold in any segment added between the rebuild and now
+            index = self.vector_store.index
+            base, raw = index.segments[0], index.raw[0]
+            for segment in index.segments[1:]:
+                vectors = extract_vectors(segment)
+                base.add(vectors)
+                if raw is not None:
+                    raw = np.vstack([raw, vectors])
+            self.vector_store.index = SegmentedIndex(base.d)
+            self.vector_store.index.add_segment(base, raw=raw)
+            self.vector_store.index.delete(index.deleted)
+            docstore_ids = [self.vector_store.index_to_docstore_id[i] for i in range(base.ntotal)]
+            
+            manifest = self.read_manifest()
+            old_segments = [manifest["base"]] + manifest["segments"]
+            
+            # Write the new base under a fresh name, then switch the manifest to it
+            new_base = f"base_{manifest['next_segment']:06d}"
+            self.write_segment(new_base, base, docstore_ids, raw=raw)
+            self.write_manifest({
+                "version": manifest.get("version", 0),
+                "base": new_base,
+                "segments": [],
+                "next_segment": manifest["next_segment"] + 1,
+                # Deletions that happened while rebuilding
+                "deleted": [docstore_ids[int(i)] for i in index.deleted]
+            })
+            
+            # Reopen the new base from disk so its pages are shared between processes again
+            segment, _, memory_mapped, raw = self.read_segment(new_base)
+            if memory_mapped:
+                self.vector_store.index = SegmentedIndex(segment.d)
+                self.vector_store.index.add_segment(segment, read_only=True, raw=raw)
+                self.vector_store.index.delete(index.deleted)
+            
+            for name in old_segments:
+                if name != new_base:
+                    self.remove_segment_files(name)
+    
+    def compact_in_background(self):
+        """Start a compaction thread unless one is already running"""
+        if self.compaction_thread is not None and self.compaction_thread.is_alive():
+            return
+        self.compaction_thread = threading.Thread(target=self.compact, name="faiss-compaction", daemon=True)
+        self.compaction_thread.start()
     
     def load_vector_store(self):
-        """Load the vector store from disk"""
-        if os.path.exists(self.index_path) and os.listdir(self.index_path):
-            try:
-                self.vector_store = FAISS.load_local(
-                    self.index_path, 
-                    self.embeddings, 
-                    allow_dangerous_deserialization=True
+        """Open the base and delta segments from disk (memory-mapped where possible)"""
+        with self.lock:
+            self.manifest_checked_at = time.monotonic()
+            manifest = self.read_manifest()
+            self.manifest_version = manifest.get("version", 0)
+            names = [name for name in [manifest["base"]] + manifest["segments"] if self.segment_exists(name)]
+            if not names:
+                self.vector_store = None
+                return
+            
+            # Stores written before the model was recorded were built with the old default
+            built_with = manifest.get("embedding_model", DEFAULT_EMBEDDING_MODEL)
+            if built_with != self.embedding_model:
+                raise ValueError(
+                    f"{self.index_path} was built with {built_with}, not {self.embedding_model}; "
+                    f"rebuild it or use the same embedding model"
                 )
+            
+            try:
+                index = None
+                docstore_ids = []
+                for name in names:
+                    if os.path.exists(self.segment_path(name, ".pkl")):
+                        self.migrate_pickled_segment(name)
+                    
+                    segment, segment_ids, memory_mapped, raw = self.read_segment(name)
+                    if index is None:
+                        index = SegmentedIndex(segment.d)
+                    index.add_segment(segment, read_only=memory_mapped, raw=raw)
+                    docstore_ids.extend(segment_ids)
+                
+                # Re-apply tombstones of documents deleted since the last compaction
+                deleted = set(manifest.get("deleted", []))
+                if deleted:
+                    index.delete([position for position, doc_id in enumerate(docstore_ids) if doc_id in deleted])
+                
+                self.vector_store = self.make_vector_store(index, docstore_ids)
+                self.rebuild_metadata_index(docstore_ids)
+                self.sparse_index = None
             except Exception as e:
                 print(f"Error loading vector store: {e}")
                 self.vector_store = None
-        else:
-            self.vector_store = None
+            
+            # Local embedders know their dimension: catch a store built with another one up front
+            dimension = getattr(self.embeddings, "dimension", None)
+            if self.vector_store is not None and dimension is not None and self.vector_store.index.d != dimension:
+                self.vector_store = None
+                raise ValueError(
+                    f"{self.index_path} holds {index.d}-dimensional vectors, but {self.embedding_model} "
+                    f"produces {dimension}; rebuild it or use the same embedding model"
+                )
+    
+    def refresh(self, min_interval=1.0):
+        """Reload the store if another process wrote a newer manifest.  Checks the disk at most
+        every `min_interval` seconds; returns True if the store was reloaded."""
+        if time.monotonic() - self.manifest_checked_at < min_interval:
+            return False
+        self.manifest_checked_at = time.monotonic()
+        if not self.manifest_is_newer():
+            return False
+        with self.lock:
+            # Re-check under the lock: a write from this process may have caught up meanwhile
+            if not self.manifest_is_newer():
+                return False
+            self.load_vector_store()
+        return True
     
     def delete_vector_store(self):
         """Delete the vector store from disk"""
         if os.path.exists(self.index_path):
             import shutil
+            if self.docstore is not None:
+                self.docstore.connection.close()
+                self.docstore = None
             shutil.rmtree(self.index_path)
             self.vector_store = None
+            self.metadata_index.clear()
+            self.sparse_index = None
+    
+    @property
+    def epoch(self):
+        """Changes whenever the indexed content changes (adds, deletes, loads); keys answer caches"""
+        return self.metadata_index.version
     
     def get_document_count(self):
         """Get the number of documents in the vector store"""
         if self.vector_store is None:
             return 0
-        return len(self.vector_store.docstore._dict)
+        return self.vector_store.index.ntotal - len(self.vector_store.index.deleted)
     
     def get_index_stats(self):
         """Get statistics about the vector store"""
@@ -95,11 +892,17 @@ class FAISSManager:
                 "last_updated": None
             }
         
-        # Save stats to a file
-        stats_file = f"{self.index_path}/stats.pkl"
+        index = self.vector_store.index
         stats = {
-            "document_count": len(self.vector_store.docstore._dict),
+            "document_count": index.ntotal - len(index.deleted),
+            "deleted_vectors": len(index.deleted),
+            "delta_segments": len(self.read_manifest()["segments"]),
+            "index_type": type(index.segments[0]).__name__,
+            "memory_mapped_segments": sum(index.read_only),
+            "metadata_keys": len(self.metadata_index.postings),
+            "ingest": {**self.ingest_stats, "reuse_ratio": self.reuse_ratio()},
+            "index_report": self.read_index_report(),
             "last_updated": datetime.now().isoformat()
         }
         
-        return stats
\ No newline at end of file
+        return stats
@@ -0,0 +1,122 @@
+from array import array
+
+import numpy as np
+
+
+# Metadata values that are indexed; anything else (lists, dicts) is left to post-filtering
+INDEXABLE_TYPES = (str, int, float, bool)
+
+
+class MetadataIndex:
+    """Inverted index from metadata (field, value) pairs to vector ids.
+    
+    Filters are resolved to the sorted ids of the eligible vectors before searching, so a selective
+    filter (one department, one employee_id) only scores its own vectors instead of over-fetching
+    and discarding.  Filters follow LangChain's dict form: every field must match, and a list value
+    matches any of its items.
+    
+    Vectors with a non-empty value that cannot be indexed (a list, a dict) are still recorded per
+    field, so access control can exclude them instead of treating the field as unset.
+    """
+    
+    def __init__(self):
+        self.postings = {}
+        # field -> ids whose value for it is set but not indexable
+        self.unindexed = {}
+        # Number of vector ids covered, and a counter bumped on every change for caches built on top
+        self.size = 0
+        self.version = 0
+        # Sorted ids of deleted vectors, left out of every lookup
+        self.deleted = np.zeros(0, dtype=np.int64)
+    
+    def add(self, position, metadata):
+        """Index the metadata of the vector stored at `position`.  Positions must be added in increasing order."""
+        for field, value in metadata.items():
+            if isinstance(value, INDEXABLE_TYPES):
+                self.postings.setdefault((field, value), array("q")).append(position)
+            elif value:
+                self.unindexed.setdefault(field, array("q")).append(position)
+        self.size = max(self.size, position + 1)
+        self.version += 1
+    
+    def clear(self):
+        self.postings = {}
+        self.unindexed = {}
+        self.size = 0
+        self.deleted = np.zeros(0, dtype=np.int64)
+        self.version += 1
+    
+    def delete(self, ids):
+        """Leave deleted vector ids out of lookups"""
+        self.deleted = np.union1d(self.deleted, np.asarray(ids, dtype=np.int64))
+        self.version += 1
+    
+    def remap(self, old_to_new, size):
+        """Renumber ids after the index was rebuilt; ids mapped to -1 are dropped"""
+        for key, postings in list(self.postings.items()):
+            ids = old_to_new[np.frombuffer(postings, dtype=np.int64)]
+            ids = ids[ids >= 0]
+            if len(ids):
+                self.postings[key] = array("q", ids.astype(np.int64).tobytes())
+            else:
+                del self.postings[key]
+        for field, postings in list(self.unindexed.items()):
+            ids = old_to_new[np.frombuffer(postings, dtype=np.int64)]
+            ids = ids[ids >= 0]
+            if len(ids):
+                self.unindexed[field] = array("q", np.sort(ids).astype(np.int64).tobytes())
+            else:
+                del self.unindexed[field]
+        deleted = old_to_new[self.deleted]
+        self.deleted = np.sort(deleted[deleted >= 0])
+        self.size = size
+        self.version += 1
+    
+    def supports(self, filter):
+        """Whether a filter can be answered from the index"""
+        if not isinstance(filter, dict):
+            return False
+        for field, value in filter.items():
+            if str(field).startswith("$"):
+                return False
+            values = value if isinstance(value, list) else [value]
+            if not all(isinstance(item, INDEXABLE_TYPES) for item in values):
+                return False
+        return True
+    
+    def contains(self, field, value):
+        """Whether any (not deleted) vector has this value for the field"""
+        return len(self.positions(field, value)) > 0
+    
+    def positions(self, field, value):
+        return self.live_ids(self.postings.get((field, value)))
+    
+    def unindexed_positions(self, field):
+        """Sorted ids of the vectors whose value for the field is set but not indexable"""
+        return self.live_ids(self.unindexed.get(field))
+    
+    def live_ids(self, postings):
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+        ids = np.frombuffer(postings, dtype=np.int64).copy()
+        if len(self.deleted):
+            ids = np.setdiff1d(ids, self.deleted, assume_unique=True)
+        return ids
+    
+    def values(self, field):
+        """Distinct indexed values of a field"""
+        return [value for indexed_field, value in self.postings if indexed_field == field]
+    
+    def union(self, field, values):
+        """Sorted ids of the vectors whose field has any of the values"""
+        return np.unique(np.concatenate([self.positions(field, value) for value in values] or [np.zeros(0, dtype=np.int64)]))
+    
+    def select(self, filter):
+        """Sorted ids of the vectors matching the filter, or None if the filter is empty"""
+        selected = None
+        for field, value in filter.items():
+            ids = self.union(field, value if isinstance(value, list) else [value])
+            selected = ids if selected is None else np.intersect1d(selected, ids, assume_unique=True)
+            if not len(selected):
+                break
+        return selected
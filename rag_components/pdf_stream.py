@@ -0,0 +1,70 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+
+def open_reader(source):
+    """Open a PDF from a path or a seekable binary stream (e.g. a Streamlit upload)"""
+    if not isinstance(source, str):
+        source.seek(0)
+    return PdfReader(source)
+
+
+def extract_page_range(source, start, end):
+    """Extract the text of pages [start, end) with a reader of its own, so its object cache is dropped afterwards"""
+    reader = open_reader(source)
+    return [reader.pages[i].extract_text() or "" for i in range(start, min(end, len(reader.pages)))]
+
+
+def count_pages(source):
+    return len(open_reader(source).pages)
+
+
+def iter_pdf_pages(source, source_name=None, pages_per_window=16, parallel=False, max_workers=None):
+    """Yield one Document per PDF page, in order, without materializing the whole document.
+    
+    Pages are extracted in windows of `pages_per_window`, each with a fresh reader, so memory stays
+    flat however long the PDF is.  With `parallel` (paths only), windows are extracted in a process
+    pool with at most two windows per worker in flight, and pages are still yielded in order as soon
+    as their window is done.  Metadata follows PyPDFLoader: `source` and `page` (0-based).
+    """
+    if source_name is None:
+        source_name = source if isinstance(source, str) else getattr(source, "name", "")
+    total_pages = count_pages(source)
+    
+    def make_page(number, text):
+        return Document(
+            page_content=text,
+            metadata={"source": source_name, "page": number, "total_pages": total_pages}
+        )
+    
+    starts = range(0, total_pages, pages_per_window)
+    
+    if not parallel or not isinstance(source, str) or total_pages <= pages_per_window:
+        for start in starts:
+            for offset, text in enumerate(extract_page_range(source, start, start + pages_per_window)):
+                yield make_page(start + offset, text)
+        return
+    
+    max_workers = max_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        windows = iter(starts)
+        
+        def submit_next():
+            start = next(windows, None)
+            if start is not None:
+                pending.append((start, executor.submit(extract_page_range, source, start, start + pages_per_window)))
+        
+        for _ in range(2 * max_workers):
+            submit_next()
+        
+        while pending:
+            start, future = pending.popleft()
+            texts = future.result()
+            submit_next()
+            for offset, text in enumerate(texts):
+                yield make_page(start + offset, text)
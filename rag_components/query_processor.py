@@ -1,18 +1,41 @@
 from langchain_openai import OpenAI
 from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
+from langchain.chains.combine_documents import create_stuff_documents_chain
 import openai
+from rag_components.context_builder import ContextBuilder
 import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 
 class QueryProcessor:
-    """Process queries using RAG"""
+    """Process queries using RAG
     
-    def __init__(self, vector_store, model="gpt-3.5-turbo"):
-        self.vector_store = vector_store
+    A processor is built once per (model, max_tokens, k) and reused across questions: the LLM
+    client, prompt and stuff chain are created here, so answering a question only costs the
+    query embedding, the vector search and the LLM call.  Retrieval goes through the FAISS
+    manager, so documents added after the processor was built are searched too.
+    
+    With `hybrid`, retrieval fuses BM25 keyword and embedding search (FAISSManager.hybrid_search);
+    the query is then embedded concurrently with the keyword search, so its time is part of search_ms.
+    
+    Retrieved chunks go through a ContextBuilder before the prompt: adjacent chunks are merged
+    without their overlap, duplicates dropped and the rest trimmed to `max_context_tokens`.
+    
+    `query_batch` answers many questions at once: one embedding request, one matrix search
+    (FAISSManager.search_batch) and LLM calls on at most `max_concurrency` threads.
+    """
+    
+    def __init__(self, faiss_manager, model="gpt-3.5-turbo", max_tokens=500, k=5, hybrid=True,
+                 max_context_tokens=1500):
+        self.faiss_manager = faiss_manager
         self.model = model
+        self.max_tokens = max_tokens
+        self.k = k
+        self.hybrid = hybrid
         # Removido o parâmetro temperature pois alguns modelos não o suportam
-        self.llm = OpenAI(model_name=model, max_completion_tokens=500)
+        self.llm = OpenAI(model_name=model, max_completion_tokens=max_tokens)
         
         # Create prompt template
         template = """
@@ -34,31 +57,93 @@ class QueryProcessor:
             input_variables=["context", "question"]
         )
         
-        # Create retrieval QA chain
-        self.qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=vector_store.as_retriever(search_kwargs={"k": 5}),
-            chain_type_kwargs={"prompt": self.prompt_template},
-            return_source_documents=True
-        )
+        # "Stuff" chain: the assembled context goes into one prompt
+        self.answer_chain = create_stuff_documents_chain(self.llm, self.prompt_template)
+        self.context_builder = ContextBuilder(max_tokens=max_context_tokens, model=model)
     
-    def query(self, question, max_tokens=500):
-        """Process a query and return answer with source documents"""
-        # Atualizar o LLM com os parâmetros fornecidos (sem temperature)
-        self.llm = OpenAI(model_name=self.model, max_completion_tokens=max_tokens)
+    def query(self, question, ids=None, embedding=None):
+        """Process a query and return answer with source documents and per-stage timings (ms).
+        `ids` restricts retrieval to those vector ids (see RetrievalAccessControl); `embedding` is
+        the question's embedding when the caller already computed it."""
+        timings = {}
+        start = time.perf_counter()
         
-        # Recriar a cadeia com o novo LLM
-        self.qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=self.vector_store.as_retriever(search_kwargs={"k": 5}),
-            chain_type_kwargs={"prompt": self.prompt_template},
-            return_source_documents=True
-        )
+        if embedding is None and not self.hybrid:
+            embedding = self.faiss_manager.embeddings.embed_query(question)
+        timings["embedding_ms"] = (time.perf_counter() - start) * 1000
+        
+        stage_start = time.perf_counter()
+        if self.hybrid:
+            source_documents = [
+                doc for doc, _ in self.faiss_manager.hybrid_search(question, k=self.k, ids=ids, embedding=embedding)
+            ]
+        else:
+            source_documents = self.faiss_manager.similarity_search_by_vector(embedding, k=self.k, ids=ids)
+        timings["search_ms"] = (time.perf_counter() - stage_start) * 1000
+        
+        stage_start = time.perf_counter()
+        context, context_stats = self.context_builder.build(source_documents, question)
+        timings["context_ms"] = (time.perf_counter() - stage_start) * 1000
+        
+        stage_start = time.perf_counter()
+        answer = self.answer_chain.invoke({"context": context, "question": question})
+        timings["llm_ms"] = (time.perf_counter() - stage_start) * 1000
+        timings["total_ms"] = (time.perf_counter() - start) * 1000
         
-        result = self.qa_chain.invoke({"query": question})
         return {
-            "answer": result["result"],
-            "source_documents": result["source_documents"]
-        }
\ No newline at end of file
+            "answer": answer,
+            "source_documents": source_documents,
+            "timings": timings,
+            "context_stats": context_stats
+        }
+    
+    def query_batch(self, questions, ids=None, embeddings=None, max_concurrency=8):
+        """Answer several questions, returning one result like `query` per question, in order.
+        The embedding and search stages run once for the batch, so their timings are the batch time
+        divided by the number of questions.  A question whose LLM call failed gets its exception
+        instead of a result."""
+        questions = list(questions)
+        if not questions:
+            return []
+        start = time.perf_counter()
+        
+        if embeddings is None:
+            embeddings = self.faiss_manager.embeddings.embed_documents(questions)
+        embedding_ms = (time.perf_counter() - start) * 1000
+        
+        stage_start = time.perf_counter()
+        hits = self.faiss_manager.search_batch(
+            embeddings, k=self.k, ids=ids, queries=questions if self.hybrid else None
+        )
+        search_ms = (time.perf_counter() - stage_start) * 1000
+        
+        def answer_question(question, source_documents):
+            timings = {"embedding_ms": embedding_ms / len(questions), "search_ms": search_ms / len(questions)}
+            stage_start = time.perf_counter()
+            context, context_stats = self.context_builder.build(source_documents, question)
+            timings["context_ms"] = (time.perf_counter() - stage_start) * 1000
+            
+            stage_start = time.perf_counter()
+            answer = self.answer_chain.invoke({"context": context, "question": question})
+            timings["llm_ms"] = (time.perf_counter() - stage_start) * 1000
+            timings["total_ms"] = sum(timings.values())
+            return {
+                "answer": answer,
+                "source_documents": source_documents,
+                "timings": timings,
+                "context_stats": context_stats
+            }
+        
+        # Each call runs in a copy of the caller's context, so usage callbacks (get_openai_callback) see it
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(questions)))) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, answer_question, question, [doc for doc, _ in results])
+                for question, results in zip(questions, hits)
+            ]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
@@ -1,6 +1,5 @@
 import streamlit as st
 import openai
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 import os, datetime, pickle, time
 import google.generativeai as genai
@@ -9,6 +8,13 @@ from google.generativeai.types import HarmCategory, HarmBlockThreshold
 from rag_components.document_processor import DocumentProcessor
 from rag_components.query_processor import QueryProcessor
 from rag_components.evaluation_manager import EvaluationManager
+from rag_components.faiss_manager import FAISSManager
+from rag_components.embeddings import get_embeddings, resolve_embedding_model
+from rag_components.usage_ledger import get_usage_ledger
+from rag_components.auth import RetrievalAccessControl
+from rag_components.answer_cache import AnswerCache, normalize_question
+from rag_components.bulk_ingest import BulkIngestor
+from langchain_community.callbacks import get_openai_callback
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -30,8 +36,10 @@ class RAGAgent:
     def __init__(
         self,
         model="gpt-3.5-turbo",
-        embedding_model="text-embedding-3-small",
+        embedding_model=None,
         summary_model="gpt-3.5-turbo",
+        cache_similarity_threshold=None,
+        hybrid_search=True,
     ):
         # Initialize the AI agent
         self.set_model(model)
@@ -39,17 +47,31 @@ class RAGAgent:
         # initialize the summary model
         self.set_summary_model(summary_model)
         
-        # Initialize the embeddings model
-        self.embeddings = OpenAIEmbeddings(model=embedding_model)
+        # Initialize the embeddings model (EMBEDDING_MODEL, or "local-hashing" to run offline)
+        embedding_model = resolve_embedding_model(embedding_model)
+        self.embeddings = get_embeddings(embedding_model)
         
         # Initialize document processor
         self.document_processor = DocumentProcessor(embedding_model)
         
         # Initialize evaluation manager
-        self.evaluation_manager = EvaluationManager()
+        self.evaluation_manager = EvaluationManager(path="evaluations.sqlite")
         
-        # Initialize vector store for documents
-        self.vector_store = None
+        # Initialize vector store for documents (segmented on-disk persistence)
+        self.faiss_manager = FAISSManager(embedding_model, index_path="faiss_index")
+        
+        # Per role/department candidate sets for access-controlled retrieval
+        self.access_control = RetrievalAccessControl(self.faiss_manager.metadata_index)
+        
+        # Query pipelines reused across questions, keyed by (model, max_tokens, k, hybrid)
+        self.query_pipelines = {}
+        # Fuse BM25 keyword search with embedding search, so exact ids and codes are found
+        self.hybrid_search = hybrid_search
+        self.last_query_timings = None
+        
+        # Answers to repeated questions, per access scope, dropped whenever the index changes.
+        # With a threshold (cosine similarity, e.g. 0.95), near-identical questions also hit.
+        self.answer_cache = AnswerCache(similarity_threshold=cache_similarity_threshold)
         
         # token and usage statistics
         self.total_cost = 0
@@ -60,23 +82,30 @@ class RAGAgent:
         
         # NSFW filter
         self.nsfw = False
-        
-        # Load existing vector store if it exists
-        self.load_vector_store()
+    
+    @property
+    def vector_store(self):
+        """The LangChain FAISS store held by the FAISS manager (None until documents are added)"""
+        return self.faiss_manager.vector_store
     
     def load_vector_store(self):
         """Load existing vector store from disk"""
-        try:
-            if os.path.exists("faiss_index"):
-                self.vector_store = self.document_processor.load_vector_store("faiss_index")
-        except Exception as e:
-            print(f"Could not load vector store: {e}")
-            self.vector_store = None
+        self.faiss_manager.load_vector_store()
+        self.query_pipelines = {}
     
     def save_vector_store(self):
-        """Save vector store to disk"""
-        if self.vector_store:
-            self.document_processor.save_vector_store(self.vector_store, "faiss_index")
+        """Compact the vector store on disk into a single base segment"""
+        self.faiss_manager.compact()
+    
+    def get_query_pipeline(self, max_tokens=500, k=5, model=None) -> QueryProcessor:
+        """Return the cached query pipeline for a model (the current one by default), building it on first use"""
+        model = model or self.model
+        key = (model, max_tokens, k, self.hybrid_search)
+        if key not in self.query_pipelines:
+            self.query_pipelines[key] = QueryProcessor(
+                self.faiss_manager, model, max_tokens=max_tokens, k=k, hybrid=self.hybrid_search
+            )
+        return self.query_pipelines[key]
     
     def set_model(self, model="gpt-3.5-turbo") -> None:
         """Change the model the AI uses to generate responses."""
@@ -129,61 +158,118 @@ class RAGAgent:
     def add_document(self, file_path, metadata=None) -> None:
         """Add a document to the RAG system"""
         try:
-            # Process document
-            documents = self.document_processor.process_document(file_path, metadata)
+            # Same content already indexed as this document, for the same audience: nothing to do.
+            # The same content under another document_id is still indexed under this one (its
+            # chunks reuse the stored embeddings), so deleting either document keeps the other.
+            document_id = (metadata or {}).get("document_id", file_path)
+            file_hash = self.document_processor.file_hash(file_path, metadata)
+            if self.faiss_manager.seen_file(file_hash) and self.faiss_manager.document_has_file(document_id, file_hash):
+                return
             
-            # Add to vector store
-            if self.vector_store is None:
-                self.vector_store = self.document_processor.create_vector_store(documents)
-            else:
-                self.document_processor.add_documents_to_store(self.vector_store, documents)
-            
-            # Save vector store
-            self.save_vector_store()
+            # Stream chunks page by page; embedding starts while the rest is still being extracted
+            documents = self.document_processor.iter_chunks(file_path, metadata)
             
+            # Replace any previous version of the document; unchanged chunks reuse their embeddings
+            self.faiss_manager.upsert_document(document_id, documents)
+        
         except Exception as e:
             print(f"Error adding document: {e}")
     
+    def add_documents_bulk(self, files, progress=None) -> dict:
+        """Add many documents at once, given as (file_path, metadata) pairs.
+        Files are split in parallel and embedded in large batches; returns the throughput report."""
+        return BulkIngestor(self.faiss_manager).ingest(files, progress=progress)
+    
+    def delete_document(self, document_id) -> int:
+        """Remove a document's chunks from the RAG system.  Returns the number of chunks removed."""
+        return self.faiss_manager.delete_document(document_id)
+    
     def add_evaluation(self, evaluation) -> None:
         """Add an employee evaluation to the RAG system"""
         try:
             # Add to evaluation manager
             self.evaluation_manager.add_evaluation(evaluation)
             
-            # Convert only the new evaluation to document
-            eval_documents = self.evaluation_manager.to_documents()
-            # Get only the last added evaluation document
-            new_eval_document = [eval_documents[-1]] if eval_documents else []
-            
-            # Add to vector store
-            if self.vector_store is None:
-                self.vector_store = self.document_processor.create_vector_store(new_eval_document)
-            else:
-                self.document_processor.add_documents_to_store(self.vector_store, new_eval_document)
-            
-            # Save vector store
-            self.save_vector_store()
-            
+            # Add to vector store, replacing an earlier version of the same evaluation
+            self.faiss_manager.upsert_document(
+                self.evaluation_manager.document_id(evaluation),
+                [self.evaluation_manager.to_document(evaluation)]
+            )
+        
         except Exception as e:
             print(f"Error adding evaluation: {e}")
     
-    def query(self, question, max_tokens=500) -> dict:
-        """Query the RAG system for an answer to a question"""
+    def add_evaluations(self, evaluations) -> dict:
+        """Add many employee evaluations with a single vector store write.
+        Returns counts of deleted, added and embedded chunks."""
+        evaluations = list(evaluations)
+        self.evaluation_manager.add_evaluations(evaluations)
+        
+        # Later evaluations of the same employee, period and evaluator replace earlier ones
+        documents_by_id = {
+            self.evaluation_manager.document_id(evaluation): [self.evaluation_manager.to_document(evaluation)]
+            for evaluation in evaluations
+        }
+        return self.faiss_manager.upsert_documents(documents_by_id)
+    
+    def query(self, question, max_tokens=500, user=None, k=5, model=None) -> dict:
+        """Query the RAG system for an answer to a question.
+        With a user, only the chunks they may access are retrieved and sent to the model.
+        `model` overrides the agent's model for this question (the agent may be shared by sessions)."""
+        model = model or self.model
         try:
+            # Pick up documents written by other processes (e.g. the bulk_ingest CLI)
+            self.faiss_manager.refresh()
+            
             if self.vector_store is None:
                 return {
                     "answer": "Nenhum documento foi adicionado ao sistema ainda.",
                     "source_documents": []
                 }
             
-            # Create query processor
-            query_processor = QueryProcessor(self.vector_store, self.model)
+            # The access lists read the metadata postings, which writers change under the lock;
+            # the epoch is read with them so cached answers are keyed by the same snapshot
+            start = time.perf_counter()
+            with self.faiss_manager.lock.read():
+                ids = self.access_control.candidate_ids(user) if user is not None else None
+                epoch = self.faiss_manager.epoch
+                scope_key = self.access_control.scope_key(user)
+            if ids is not None and not len(ids):
+                return {
+                    "answer": "Nenhum documento acessível para seu nível de acesso.",
+                    "source_documents": []
+                }
             
-            # Process query
-            result = query_processor.query(question, max_tokens)
+            # Answers hold for one index epoch, access scope and pipeline configuration
+            scope = (model, max_tokens, k, self.hybrid_search, scope_key)
+            cached = self.answer_cache.get(question, scope, epoch)
+            embedding = None
+            if cached is None and self.answer_cache.similarity_threshold is not None:
+                embedding = self.faiss_manager.embeddings.embed_query(question)
+                cached = self.answer_cache.get_similar(embedding, scope, epoch)
+            if cached is not None:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                self.last_query_timings = {"embedding_ms": 0.0, "search_ms": 0.0, "llm_ms": 0.0, "total_ms": elapsed_ms}
+                return dict(cached, timings=self.last_query_timings, cached=True)
+            self.answer_cache.miss()
             
-            return result
+            query_processor = self.get_query_pipeline(max_tokens, k, model=model)
+            
+            # Process query, tracking token usage of the LLM call
+            start_time = time.time()
+            with get_openai_callback() as usage:
+                result = query_processor.query(question, ids=ids, embedding=embedding)
+            latency = time.time() - start_time
+            self.last_query_timings = result["timings"]
+            
+            self.record_usage(usage, latency, model=model)
             
+            # Not cached if the index changed while answering
+            if self.faiss_manager.epoch == epoch:
+                self.answer_cache.put(question, scope, epoch, result, embedding=embedding)
+            
+            return result
+        
         except Exception as e:
             print(f"Error processing query: {e}")
             return {
@@ -191,6 +277,112 @@ class RAGAgent:
                 "source_documents": []
             }
     
+    def query_batch(self, questions, max_tokens=500, user=None, k=5, model=None, max_concurrency=8) -> list:
+        """Answer a list of questions (e.g. an audit checklist), returning one result like `query` per
+        question, in order.  Repeated questions are answered once and cached answers are reused; the
+        rest are embedded in one request, searched with one matrix search and sent to the model with
+        at most `max_concurrency` calls in flight."""
+        questions = list(questions)
+        model = model or self.model
+        try:
+            self.faiss_manager.refresh()
+            
+            if self.vector_store is None:
+                return [
+                    {"answer": "Nenhum documento foi adicionado ao sistema ainda.", "source_documents": []}
+                    for _ in questions
+                ]
+            
+            start = time.perf_counter()
+            with self.faiss_manager.lock.read():
+                ids = self.access_control.candidate_ids(user) if user is not None else None
+                epoch = self.faiss_manager.epoch
+                scope_key = self.access_control.scope_key(user)
+            if ids is not None and not len(ids):
+                return [
+                    {"answer": "Nenhum documento acessível para seu nível de acesso.", "source_documents": []}
+                    for _ in questions
+                ]
+            
+            scope = (model, max_tokens, k, self.hybrid_search, scope_key)
+            
+            # One lookup and at most one answer per distinct question
+            results = {}
+            pending = []
+            seen = set()
+            for question in questions:
+                key = normalize_question(question)
+                if key in seen:
+                    continue
+                seen.add(key)
+                cached = self.answer_cache.get(question, scope, epoch)
+                if cached is not None:
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                    timings = {"embedding_ms": 0.0, "search_ms": 0.0, "llm_ms": 0.0, "total_ms": elapsed_ms}
+                    results[key] = dict(cached, timings=timings, cached=True)
+                else:
+                    pending.append(question)
+            
+            embeddings = None
+            if pending and self.answer_cache.similarity_threshold is not None:
+                embeddings = self.faiss_manager.embeddings.embed_documents(pending)
+                misses = []
+                for question, embedding in zip(pending, embeddings):
+                    cached = self.answer_cache.get_similar(embedding, scope, epoch)
+                    if cached is not None:
+                        elapsed_ms = (time.perf_counter() - start) * 1000
+                        timings = {"embedding_ms": 0.0, "search_ms": 0.0, "llm_ms": 0.0, "total_ms": elapsed_ms}
+                        results[normalize_question(question)] = dict(cached, timings=timings, cached=True)
+                    else:
+                        misses.append((question, embedding))
+                pending = [question for question, _ in misses]
+                embeddings = [embedding for _, embedding in misses]
+            
+            if pending:
+                query_processor = self.get_query_pipeline(max_tokens, k, model=model)
+                start_time = time.time()
+                with get_openai_callback() as usage:
+                    answers = query_processor.query_batch(
+                        pending, ids=ids, embeddings=embeddings, max_concurrency=max_concurrency
+                    )
+                latency = time.time() - start_time
+                self.record_usage(usage, latency, model=model)
+                
+                for position, (question, result) in enumerate(zip(pending, answers)):
+                    self.answer_cache.miss()
+                    if isinstance(result, Exception):
+                        print(f"Error processing query: {result}")
+                        result = {"answer": "Ocorreu um erro ao processar sua pergunta.", "source_documents": []}
+                    elif self.faiss_manager.epoch == epoch:
+                        embedding = embeddings[position] if embeddings is not None else None
+                        self.answer_cache.put(question, scope, epoch, result, embedding=embedding)
+                    results[normalize_question(question)] = result
+            
+            return [results[normalize_question(question)] for question in questions]
+        
+        except Exception as e:
+            print(f"Error processing queries: {e}")
+            return [
+                {"answer": "Ocorreu um erro ao processar sua pergunta.", "source_documents": []}
+                for _ in questions
+            ]
+    
+    def record_usage(self, usage, latency=None, feature="rag_query", model=None) -> None:
+        """Add a LangChain OpenAI callback's usage to the totals and the usage ledger"""
+        self.total_cost += usage.total_cost
+        self.total_tokens += usage.total_tokens
+        self.current_memory_tokens = usage.total_tokens
+        
+        get_usage_ledger().record(
+            model=model or self.model,
+            input_tokens=usage.prompt_tokens,
+            output_tokens=usage.completion_tokens,
+            cached_tokens=getattr(usage, "prompt_tokens_cached", 0),
+            cost=usage.total_cost,
+            latency=latency,
+            feature=feature,
+        )
+    
     def count_cost(self, result, model, summary=False) -> float:
         """Count the cost of the messages."""
         # cost is calculated as the number of tokens in the input and output times the cost per token
@@ -0,0 +1,209 @@
+import faiss
+import numpy as np
+
+
+def read_index(path, mmap=True):
+    """Read a FAISS index, memory-mapping it when the index type supports it.
+    Memory-mapped indexes are read-only and their pages are shared between processes."""
+    if mmap:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        try:
+            return faiss.read_index(path, flags), True
+        except RuntimeError:
+            # Older FAISS builds cannot mmap flat indexes; fall back to a regular read
+            pass
+    return faiss.read_index(path), False
+
+
+def search_parameters(index, selector):
+    """Search parameters restricting a search to the selected ids, keeping the index's own settings"""
+    if hasattr(index, "nprobe"):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def merge_results(n, k, results):
+    """Merge per-segment (distances, ids) into the overall top-k, padding with -1 like FAISS"""
+    distances = [np.full((n, k), np.inf, dtype=np.float32)]
+    ids = [np.full((n, k), -1, dtype=np.int64)]
+    for segment_distances, segment_ids in results:
+        distances.append(segment_distances)
+        ids.append(segment_ids)
+    
+    distances = np.hstack(distances)
+    ids = np.hstack(ids)
+    order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class SegmentedIndex:
+    """Present several FAISS indexes (a base and delta segments) as one index with successive ids.
+    
+    It implements the part of the faiss.Index interface LangChain's FAISS vector store uses
+    (`d`, `ntotal`, `search`, `reconstruct`, `add`), so a read-only memory-mapped base and small
+    in-memory deltas can be searched together without merging them into one copy.
+    
+    Deleted vectors are tombstoned rather than removed (ids stay stable and HNSW has no removal):
+    searches skip them, and `ntotal` still counts them until the index is rebuilt.
+    
+    A segment whose index only keeps quantized vectors (IVF-PQ) can carry the original float32
+    vectors (`raw`), which `original_n` returns instead of lossy reconstructions.
+    """
+    
+    def __init__(self, d, segments=None):
+        self.d = d
+        self.is_trained = True
+        self.segments = []
+        self.read_only = []
+        self.raw = []
+        self.tail = None
+        # Filtered searches over at most this many vectors skip the index and compare exactly
+        self.exact_subset_size = 2048
+        # Sorted global ids of tombstoned vectors
+        self.deleted = np.zeros(0, dtype=np.int64)
+        for segment in segments or []:
+            self.add_segment(segment)
+    
+    @property
+    def ntotal(self):
+        return sum(segment.ntotal for segment in self.segments)
+    
+    def add_segment(self, index, read_only=False, raw=None):
+        """Append an index as a new segment; its ids follow the existing ones.
+        `raw` holds the segment's original vectors if the index cannot give them back exactly."""
+        self.segments.append(index)
+        self.read_only.append(read_only)
+        self.raw.append(raw)
+        self.tail = None
+    
+    def add(self, x):
+        """Add vectors to an in-memory tail segment (segments loaded from disk are never modified)"""
+        if self.tail is None:
+            self.tail = faiss.IndexFlatL2(self.d)
+            self.segments.append(self.tail)
+            self.read_only.append(False)
+            self.raw.append(None)
+        self.tail.add(np.ascontiguousarray(x, dtype=np.float32))
+    
+    def delete(self, ids):
+        """Tombstone vectors by global id"""
+        self.deleted = np.union1d(self.deleted, np.asarray(ids, dtype=np.int64))
+    
+    def locate(self, i):
+        """Return (segment, local id) for a global id"""
+        offset = 0
+        for segment in self.segments:
+            if i < offset + segment.ntotal:
+                return segment, i - offset
+            offset += segment.ntotal
+        raise IndexError(f"Vector id {i} out of range")
+    
+    def ensure_direct_map(self, segment):
+        """IVF indexes need a direct map before vectors can be reconstructed by id"""
+        if hasattr(segment, "make_direct_map") and not segment.direct_map.type:
+            segment.make_direct_map()
+    
+    def reconstruct(self, i):
+        segment, local_id = self.locate(int(i))
+        self.ensure_direct_map(segment)
+        return segment.reconstruct(local_id)
+    
+    def reconstruct_n(self, i0, ni):
+        """Reconstruct a range of global ids, one bulk call per segment it spans"""
+        parts = []
+        for segment, offset in zip(self.segments, self.offsets()):
+            start = max(i0, offset)
+            end = min(i0 + ni, offset + segment.ntotal)
+            if start < end:
+                self.ensure_direct_map(segment)
+                parts.append(segment.reconstruct_n(start - offset, end - start))
+        return np.vstack(parts) if parts else np.zeros((0, self.d), dtype=np.float32)
+    
+    def original_n(self, i0, ni):
+        """Like reconstruct_n, but exact: segments with raw vectors are read from those"""
+        parts = []
+        for segment, raw, offset in zip(self.segments, self.raw, self.offsets()):
+            start = max(i0, offset)
+            end = min(i0 + ni, offset + segment.ntotal)
+            if start >= end:
+                continue
+            if raw is not None:
+                parts.append(np.asarray(raw[start - offset:end - offset], dtype=np.float32))
+            else:
+                self.ensure_direct_map(segment)
+                parts.append(segment.reconstruct_n(start - offset, end - start))
+        return np.vstack(parts) if parts else np.zeros((0, self.d), dtype=np.float32)
+    
+    def original(self, i):
+        return self.original_n(int(i), 1)[0]
+    
+    def search(self, x, k, ids=None):
+        """Search every segment and merge the per-segment top-k by distance.
+        With `ids` (sorted global ids), only those vectors are scored."""
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        if ids is not None:
+            if len(self.deleted):
+                ids = np.setdiff1d(ids, self.deleted, assume_unique=True)
+            return self.search_subset(x, k, ids)
+        
+        live = [(segment, offset) for segment, offset in zip(self.segments, self.offsets()) if segment.ntotal]
+        if len(live) == 1 and live[0][1] == 0 and not len(self.deleted):
+            return live[0][0].search(x, k)
+        
+        results = []
+        for segment, offset in live:
+            start, end = np.searchsorted(self.deleted, [offset, offset + segment.ntotal])
+            if start == end:
+                segment_distances, segment_ids = segment.search(x, min(k, segment.ntotal))
+            else:
+                # Skip the segment's tombstones; the inner selector must outlive the search
+                local_deleted = np.ascontiguousarray(self.deleted[start:end] - offset, dtype=np.int64)
+                deleted_selector = faiss.IDSelectorBatch(len(local_deleted), faiss.swig_ptr(local_deleted))
+                selector = faiss.IDSelectorNot(deleted_selector)
+                segment_distances, segment_ids = segment.search(
+                    x, min(k, segment.ntotal), params=search_parameters(segment, selector)
+                )
+            results.append((segment_distances, np.where(segment_ids >= 0, segment_ids + offset, -1)))
+        return merge_results(x.shape[0], k, results)
+    
+    def search_subset(self, x, k, ids):
+        """Search only the given global ids.  Small subsets are scored exactly from their
+        reconstructed vectors; larger ones are searched with a FAISS IDSelector."""
+        results = []
+        for segment, offset in zip(self.segments, self.offsets()):
+            start, end = np.searchsorted(ids, [offset, offset + segment.ntotal])
+            local_ids = np.ascontiguousarray(ids[start:end] - offset, dtype=np.int64)
+            if not len(local_ids):
+                continue
+            segment_k = min(k, len(local_ids))
+            
+            if len(local_ids) <= self.exact_subset_size:
+                self.ensure_direct_map(segment)
+                vectors = np.vstack([segment.reconstruct(int(i)) for i in local_ids])
+                distances = (
+                    (x ** 2).sum(axis=1)[:, None]
+                    - 2 * x @ vectors.T
+                    + (vectors ** 2).sum(axis=1)[None, :]
+                )
+                order = np.argsort(distances, axis=1, kind="stable")[:, :segment_k]
+                segment_distances = np.take_along_axis(distances, order, axis=1).astype(np.float32)
+                segment_ids = local_ids[order]
+            else:
+                selector = faiss.IDSelectorBatch(len(local_ids), faiss.swig_ptr(local_ids))
+                segment_distances, segment_ids = segment.search(
+                    x, segment_k, params=search_parameters(segment, selector)
+                )
+            
+            results.append((segment_distances, np.where(segment_ids >= 0, segment_ids + offset, -1)))
+        return merge_results(x.shape[0], k, results)
+    
+    def offsets(self):
+        """Global id of the first vector of each segment"""
+        offsets = []
+        total = 0
+        for segment in self.segments:
+            offsets.append(total)
+            total += segment.ntotal
+        return offsets
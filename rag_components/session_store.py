@@ -0,0 +1,344 @@
+import os
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+import numpy as np
+import requests
+
+
+class StaleSessionError(Exception):
+    """The stored session has moved on since the writer loaded it (another replica or tab wrote turns).
+    `next_seq` is the sequence number the store expects for the next message."""
+
+    def __init__(self, session_id, next_seq=None):
+        super().__init__(f"session {session_id} was changed elsewhere (next message is {next_seq})")
+        self.session_id = session_id
+        self.next_seq = next_seq
+
+
+class SessionStore(ABC):
+    """Persist AIAgent sessions incrementally so any app replica can resume any conversation.
+
+    A session is stored as three parts:
+    - one row of scalar state (character, memory tiers, usage counters), overwritten each turn
+    - chat messages, appended one row per message
+    - long-term memories with their embeddings, appended one row per memory, so the FAISS
+      index can be rebuilt on resume without calling the embeddings API again
+    """
+
+    @abstractmethod
+    def save_turn(self, session_id, state, new_messages, first_seq, new_memories):
+        """Write one turn: upsert the scalar state and append the new messages and memories.
+
+        new_messages is a list of {"role", "content"} dicts numbered from first_seq;
+        new_memories is a list of (memory_id, content, embedding) tuples.
+        Raises StaleSessionError if the stored messages do not end right before first_seq.
+        """
+
+    @abstractmethod
+    def load_session(self, session_id):
+        """Load a session.  Returns (state, messages, memories) or None if the session does not exist."""
+
+    @abstractmethod
+    def delete_session(self, session_id):
+        """Delete everything stored for a session"""
+
+
+class SQLSessionStore(SessionStore):
+    """Session store over a DB-API database, one transaction per turn"""
+
+    # DB-API parameter placeholder used by the subclass' driver
+    placeholder = "?"
+
+    @abstractmethod
+    def connect(self):
+        """Return a DB-API connection"""
+
+    @abstractmethod
+    def release(self, connection):
+        """Return a connection obtained from `connect`"""
+
+    def create_tables(self):
+        """Create the session tables if they do not exist"""
+        statements = [
+            """CREATE TABLE IF NOT EXISTS agent_session (
+                session_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )""",
+            """CREATE TABLE IF NOT EXISTS agent_session_message (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            )""",
+            """CREATE TABLE IF NOT EXISTS agent_session_memory (
+                session_id TEXT NOT NULL,
+                memory_id INTEGER NOT NULL,
+                content TEXT NOT NULL,
+                embedding BYTEA NOT NULL,
+                PRIMARY KEY (session_id, memory_id)
+            )""",
+        ]
+        with self.transaction() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def transaction(self):
+        """Context manager yielding a cursor inside a committed transaction"""
+        return _Transaction(self)
+
+    def _sql(self, statement):
+        """Adapt `?` placeholders to the driver's parameter style"""
+        return statement.replace("?", self.placeholder)
+
+    def save_turn(self, session_id, state, new_messages, first_seq, new_memories):
+        """Write one turn: upsert the scalar state and append the new messages and memories.
+
+        new_messages is a list of {"role", "content"} dicts numbered from first_seq;
+        new_memories is a list of (memory_id, content, embedding) tuples.
+        Raises StaleSessionError if the stored messages do not end right before first_seq.
+        """
+        try:
+            self._write_turn(session_id, state, new_messages, first_seq, new_memories)
+        except StaleSessionError:
+            raise
+        except Exception as e:
+            # A concurrent writer may have taken the same (session_id, seq) between our check and insert
+            next_seq = self.next_seq(session_id)
+            if next_seq != first_seq:
+                raise StaleSessionError(session_id, next_seq) from e
+            raise
+
+    def next_seq(self, session_id):
+        """Sequence number of the next message of a session (0 if it has none)"""
+        with self.transaction() as cursor:
+            return self._next_seq(cursor, session_id)
+
+    def _next_seq(self, cursor, session_id):
+        cursor.execute(
+            self._sql("SELECT MAX(seq) FROM agent_session_message WHERE session_id = ?"),
+            (session_id,),
+        )
+        row = cursor.fetchone()
+        return 0 if row is None or row[0] is None else row[0] + 1
+
+    def _write_turn(self, session_id, state, new_messages, first_seq, new_memories):
+        now = datetime.now().isoformat()
+        with self.transaction() as cursor:
+            next_seq = self._next_seq(cursor, session_id)
+            if next_seq != first_seq:
+                raise StaleSessionError(session_id, next_seq)
+            cursor.execute(
+                self._sql(
+                    """INSERT INTO agent_session (session_id, state, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT (session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at"""
+                ),
+                (session_id, json.dumps(state), now),
+            )
+            if new_messages:
+                cursor.executemany(
+                    self._sql(
+                        "INSERT INTO agent_session_message (session_id, seq, role, content) VALUES (?, ?, ?, ?)"
+                    ),
+                    [
+                        (session_id, first_seq + i, message["role"], message["content"])
+                        for i, message in enumerate(new_messages)
+                    ],
+                )
+            if new_memories:
+                cursor.executemany(
+                    self._sql(
+                        "INSERT INTO agent_session_memory (session_id, memory_id, content, embedding) VALUES (?, ?, ?, ?)"
+                    ),
+                    [
+                        (
+                            session_id,
+                            memory_id,
+                            content,
+                            np.asarray(embedding, dtype=np.float32).tobytes(),
+                        )
+                        for memory_id, content, embedding in new_memories
+                    ],
+                )
+
+    def load_session(self, session_id):
+        """Load a session.  Returns (state, messages, memories) or None if the session does not exist."""
+        with self.transaction() as cursor:
+            cursor.execute(
+                self._sql("SELECT state FROM agent_session WHERE session_id = ?"),
+                (session_id,),
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            state = json.loads(row[0])
+
+            cursor.execute(
+                self._sql(
+                    "SELECT role, content FROM agent_session_message WHERE session_id = ? ORDER BY seq"
+                ),
+                (session_id,),
+            )
+            messages = [{"role": role, "content": content} for role, content in cursor.fetchall()]
+
+            cursor.execute(
+                self._sql(
+                    "SELECT memory_id, content, embedding FROM agent_session_memory WHERE session_id = ? ORDER BY memory_id"
+                ),
+                (session_id,),
+            )
+            memories = [
+                (memory_id, content, np.frombuffer(bytes(embedding), dtype=np.float32).tolist())
+                for memory_id, content, embedding in cursor.fetchall()
+            ]
+        return state, messages, memories
+
+    def delete_session(self, session_id):
+        """Delete everything stored for a session"""
+        with self.transaction() as cursor:
+            for table in ["agent_session", "agent_session_message", "agent_session_memory"]:
+                cursor.execute(
+                    self._sql(f"DELETE FROM {table} WHERE session_id = ?"), (session_id,)
+                )
+
+
+class _Transaction:
+    """Open a connection, yield a cursor and commit (or roll back) on exit"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.connection = self.store.connect()
+        self.cursor = self.connection.cursor()
+        return self.cursor
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.store.release(self.connection)
+        return False
+
+
+class SQLiteSessionStore(SQLSessionStore):
+    """Session store in a local SQLite file (WAL mode), suitable for replicas sharing a volume"""
+
+    placeholder = "?"
+
+    def __init__(self, path="sessions.db"):
+        self.path = path
+        self.create_tables()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def release(self, connection):
+        connection.close()
+
+
+class PostgresSessionStore(SQLSessionStore):
+    """Session store in the backend's PostgreSQL database"""
+
+    placeholder = "%s"
+
+    def __init__(self, database_url):
+        import psycopg2.pool
+
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, 10, database_url)
+        self.create_tables()
+
+    def connect(self):
+        return self.pool.getconn()
+
+    def release(self, connection):
+        self.pool.putconn(connection)
+
+
+class BackendSessionStore(SessionStore):
+    """Session store backed by the backend's `/character-agents` API (PostgreSQL + pgvector)"""
+
+    def __init__(self, api_base_url, api_token, timeout=10):
+        self.api_base_url = api_base_url.rstrip("/")
+        self.api_token = api_token
+        self.timeout = timeout
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.api_token}"}
+
+    def save_turn(self, session_id, state, new_messages, first_seq, new_memories):
+        response = requests.put(
+            f"{self.api_base_url}/character-agents/{session_id}/turns",
+            json={
+                "state": state,
+                "first_seq": first_seq,
+                "messages": new_messages,
+                "memories": [
+                    {"memory_id": memory_id, "content": content, "embedding": list(embedding)}
+                    for memory_id, content, embedding in new_memories
+                ],
+            },
+            headers=self._headers(),
+            timeout=self.timeout,
+        )
+        if response.status_code == 409:
+            raise StaleSessionError(session_id)
+        response.raise_for_status()
+
+    def load_session(self, session_id):
+        response = requests.get(
+            f"{self.api_base_url}/character-agents/{session_id}",
+            headers=self._headers(),
+            timeout=self.timeout,
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        data = response.json()
+        memories = [
+            (memory["memory_id"], memory["content"], memory["embedding"])
+            for memory in data["memories"]
+        ]
+        return data["state"], data["messages"], memories
+
+    def delete_session(self, session_id):
+        response = requests.delete(
+            f"{self.api_base_url}/character-agents/{session_id}",
+            headers=self._headers(),
+            timeout=self.timeout,
+        )
+        if response.status_code != 404:
+            response.raise_for_status()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Return the process-wide session store selected by SESSION_STORE_URL.
+
+    Accepts `sqlite:///path/to/sessions.db` (default), a `postgresql://` URL, or the backend
+    API base URL (`http://.../api/v1`, authenticated with SESSION_STORE_API_TOKEN).
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            url = os.getenv("SESSION_STORE_URL", "sqlite:///sessions.db")
+            if url.startswith("http"):
+                _store = BackendSessionStore(url, os.getenv("SESSION_STORE_API_TOKEN"))
+            elif url.startswith("postgres"):
+                _store = PostgresSessionStore(url)
+            else:
+                _store = SQLiteSessionStore(url.replace("sqlite:///", "", 1))
+        return _store
@@ -0,0 +1,201 @@
+import re
+import json
+import math
+import time
+import argparse
+import unicodedata
+from array import array
+
+import numpy as np
+
+
+# Frequent Portuguese words (accents stripped) that carry no meaning for keyword search
+STOPWORDS = frozenset("""
+a ao aos as ate com como da das de dela delas dele deles do dos e ela elas ele eles em entre
+essa essas esse esses esta estas este estes eu foi ha isso isto ja mais mas me mesmo meu minha
+muito na nao nas nem no nos num numa o os ou para pela pelas pelo pelos por qual quando que
+quem se sem ser seu seus so sua suas tambem te tem um uma umas uns voce voces
+""".split())
+
+# Words, keeping codes such as "EMP-1042" or "POL.RH.07" together
+TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+
+
+def tokenize(text):
+    """Lowercase, accent-free terms of a text.  Compound codes are indexed whole and by part."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    terms = []
+    for token in TOKEN.findall(text):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r"[-./]", token) if part and part not in STOPWORDS)
+    return terms
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked lists of ids: each id scores the sum of 1 / (k + rank) over the lists it is in.
+    Returns (id, score) pairs, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """BM25 keyword index over chunk text, keyed by the same vector ids as the FAISS index.
+    
+    It is maintained like MetadataIndex: positions are appended in increasing order, deletions
+    are tombstones left out of results, and ids are remapped after the vector index is rebuilt.
+    As in Lucene, document frequencies and lengths still count tombstoned chunks until then.
+    """
+    
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> (array of positions, array of term frequencies)
+        self.lengths = array("i")  # terms per position
+        self.total_length = 0
+        self.deleted = np.zeros(0, dtype=np.int64)
+    
+    @property
+    def size(self):
+        return len(self.lengths)
+    
+    def add(self, position, text):
+        """Index the text of the vector stored at `position`.  Positions must be added in increasing order."""
+        terms = tokenize(text)
+        if position > len(self.lengths):
+            self.lengths.extend([0] * (position - len(self.lengths)))
+        self.lengths.append(len(terms))
+        self.total_length += len(terms)
+        
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            positions, counts = self.postings.setdefault(term, (array("q"), array("i")))
+            positions.append(position)
+            counts.append(frequency)
+    
+    def delete(self, ids):
+        self.deleted = np.union1d(self.deleted, np.asarray(ids, dtype=np.int64))
+    
+    def remap(self, old_to_new, size):
+        """Renumber ids after the vector index was rebuilt; ids mapped to -1 are dropped"""
+        lengths = np.zeros(size, dtype=np.int32)
+        old_lengths = np.frombuffer(self.lengths, dtype=np.int32)
+        new_ids = old_to_new[:len(old_lengths)]
+        lengths[new_ids[new_ids >= 0]] = old_lengths[new_ids >= 0]
+        self.lengths = array("i", lengths.tobytes())
+        self.total_length = int(lengths.sum())
+        
+        for term, (positions, counts) in list(self.postings.items()):
+            ids = old_to_new[np.frombuffer(positions, dtype=np.int64)]
+            keep = ids >= 0
+            if not keep.any():
+                del self.postings[term]
+                continue
+            order = np.argsort(ids[keep], kind="stable")
+            self.postings[term] = (
+                array("q", ids[keep][order].astype(np.int64).tobytes()),
+                array("i", np.frombuffer(counts, dtype=np.int32)[keep][order].tobytes())
+            )
+        deleted = old_to_new[self.deleted]
+        self.deleted = np.sort(deleted[deleted >= 0])
+    
+    def search(self, query, k, ids=None):
+        """Top-k (positions, scores) for a query, best first, optionally restricted to sorted `ids`"""
+        n = len(self.lengths)
+        terms = set(tokenize(query))
+        if not n or not terms:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        
+        average_length = self.total_length / n or 1.0
+        lengths = np.frombuffer(self.lengths, dtype=np.int32).astype(np.float32)
+        normalization = self.k1 * (1 - self.b + self.b * lengths / average_length)
+        scores = np.zeros(n, dtype=np.float32)
+        for term in terms:
+            if term not in self.postings:
+                continue
+            positions, counts = self.postings[term]
+            positions = np.frombuffer(positions, dtype=np.int64)
+            counts = np.frombuffer(counts, dtype=np.int32).astype(np.float32)
+            idf = math.log(1 + (n - len(positions) + 0.5) / (len(positions) + 0.5))
+            scores[positions] += idf * counts * (self.k1 + 1) / (counts + normalization[positions])
+        
+        if len(self.deleted):
+            scores[self.deleted[self.deleted < n]] = 0
+        if ids is not None:
+            ids = np.asarray(ids, dtype=np.int64)
+            allowed = np.zeros(n, dtype=bool)
+            allowed[ids[ids < n]] = True
+            scores[~allowed] = 0
+        
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        order = np.argsort(-scores[matched], kind="stable")
+        return matched[order], scores[matched][order]
+
+
+def benchmark_retrieval(manager, labeled_queries, k=5):
+    """Compare dense-only and hybrid retrieval of a FAISSManager.
+    
+    `labeled_queries` are (question, relevant document_ids) pairs.  Returns, per mode, the mean
+    recall@k (share of a question's relevant documents found in its top k) and the mean and p95
+    latency in ms.  Both modes embed the question themselves, so latencies are end to end.
+    """
+    report = {}
+    for mode in ["dense", "hybrid"]:
+        latencies = []
+        recalls = []
+        for question, relevant in labeled_queries:
+            relevant = set(relevant)
+            start = time.perf_counter()
+            if mode == "dense":
+                results = manager.similarity_search_with_score(question, k=k)
+            else:
+                results = manager.hybrid_search(question, k=k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found = {doc.metadata.get("document_id") for doc, _ in results}
+            recalls.append(len(found & relevant) / len(relevant) if relevant else 0.0)
+        report[mode] = {
+            f"recall@{k}": float(np.mean(recalls)) if recalls else 0.0,
+            "mean_ms": float(np.mean(latencies)) if latencies else 0.0,
+            "p95_ms": float(np.percentile(latencies, 95)) if latencies else 0.0,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hybrid (BM25 + FAISS) against dense-only retrieval")
+    parser.add_argument("queries", help='JSON-lines file of {"question": ..., "document_ids": [...]}')
+    parser.add_argument("--index-path", default="faiss_index")
+    parser.add_argument("--embedding-model", default=None, help="defaults to EMBEDDING_MODEL; local-hashing runs offline")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+    
+    from dotenv import load_dotenv
+    from rag_components.faiss_manager import FAISSManager
+    
+    load_dotenv()
+    with open(args.queries, "r", encoding="utf-8") as f:
+        labeled_queries = [
+            (item["question"], item["document_ids"]) for item in map(json.loads, f) if item.get("question")
+        ]
+    
+    manager = FAISSManager(args.embedding_model, index_path=args.index_path)
+    report = benchmark_retrieval(manager, labeled_queries, k=args.k)
+    for mode, stats in report.items():
+        print(
+            f"{mode:>6}: recall@{args.k} {stats[f'recall@{args.k}']:.3f}, "
+            f"mean {stats['mean_ms']:.1f} ms, p95 {stats['p95_ms']:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+
+# Sentence boundaries: end punctuation followed by whitespace, or line breaks
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…*])\s+|\n+")
+
+
+class ModeratedStream:
+    """Wrap a stream of text chunks and release it window by window as each window clears moderation.
+
+    The text is cut into sentence-sized windows while it is generated.  Each window is sent to the
+    moderation API as soon as it is complete, concurrently with generation, and windows are yielded
+    in order once their check comes back clean.  If a window is flagged the underlying stream is
+    closed, nothing more is yielded and `flagged` is set.
+    """
+
+    def __init__(
+        self,
+        chunks,
+        moderate=None,
+        min_window_chars=80,
+        max_window_chars=600,
+        max_workers=4,
+    ):
+        self.chunks = chunks
+        self.moderate = moderate or self.moderate_with_openai
+        self.min_window_chars = min_window_chars
+        self.max_window_chars = max_window_chars
+        self.max_workers = max_workers
+        self.flagged = False
+        self.text = ""
+        self.client = None
+
+    def moderate_with_openai(self, text) -> bool:
+        """Check text with the OpenAI moderation endpoint.  Returns True if it is flagged."""
+        if self.client is None:
+            self.client = openai.OpenAI()
+        moderation = self.client.moderations.create(input=text)
+        return moderation.results[0].flagged
+
+    def split_windows(self, buffer):
+        """Cut complete windows off the front of the buffer.  Returns (windows, remainder)."""
+        windows = []
+        start = 0
+        for match in SENTENCE_BOUNDARY.finditer(buffer):
+            if match.end() - start >= self.min_window_chars:
+                windows.append(buffer[start : match.end()])
+                start = match.end()
+
+        # very long runs without punctuation are cut at the last space
+        while len(buffer) - start > self.max_window_chars:
+            cut = buffer.rfind(" ", start, start + self.max_window_chars)
+            if cut <= start:
+                cut = start + self.max_window_chars
+            windows.append(buffer[start:cut])
+            start = cut
+
+        return windows, buffer[start:]
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = deque()
+        previous_window = ""
+        buffer = ""
+
+        def submit(window):
+            nonlocal previous_window
+            # include the previous window so content split across a boundary is still caught
+            pending.append((window, executor.submit(self.moderate, previous_window + window)))
+            previous_window = window
+
+        try:
+            for chunk in self.chunks:
+                if not chunk:
+                    continue
+                buffer += chunk
+                windows, buffer = self.split_windows(buffer)
+                for window in windows:
+                    submit(window)
+
+                # release every window whose check has already finished, in order
+                while pending and pending[0][1].done():
+                    window, check = pending.popleft()
+                    if check.result():
+                        self.abort(pending)
+                        return
+                    self.text += window
+                    yield window
+
+            if buffer:
+                submit(buffer)
+
+            # generation is done, wait for the remaining checks in order
+            while pending:
+                window, check = pending.popleft()
+                if check.result():
+                    self.abort(pending)
+                    return
+                self.text += window
+                yield window
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def abort(self, pending):
+        """Mark the stream as flagged and stop generation"""
+        self.flagged = True
+        for _, check in pending:
+            check.cancel()
+        pending.clear()
+        if hasattr(self.chunks, "close"):
+            self.chunks.close()
@@ -0,0 +1,139 @@
+import re
+from functools import lru_cache
+
+import tiktoken
+from langchain.text_splitter import TextSplitter
+
+
+# Sentence ends: ., !, ?, … (optionally followed by closing quotes/brackets) then whitespace
+SENTENCE_END = re.compile(r"(?<=[.!?…])[\"'”»)\]]*\s+")
+MARKDOWN_HEADING = re.compile(r"^#{1,6}\s+\S")
+NUMBERED_HEADING = re.compile(r"^(\d+(\.\d+)*\.?|[IVXLC]+\.)\s+\S")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model="text-embedding-3-small"):
+    """Tokenizer of an OpenAI model, loaded once per process"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def is_heading(line):
+    """Markdown headings, numbered section titles ("2.1 Férias") and short all-caps lines"""
+    line = line.strip()
+    if not line or len(line) > 80:
+        return False
+    if MARKDOWN_HEADING.match(line):
+        return True
+    if line.endswith((".", ":", ";", ",")):
+        return False
+    return bool(NUMBERED_HEADING.match(line)) or (line.isupper() and len(line.split()) <= 10)
+
+
+def split_units(text):
+    """Split text into (unit, is_heading) pairs: headings, then sentences within paragraphs"""
+    units = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        lines = []
+        for line in paragraph.splitlines():
+            if is_heading(line):
+                if lines:
+                    units.extend((sentence, False) for sentence in SENTENCE_END.split(" ".join(lines)) if sentence.strip())
+                    lines = []
+                units.append((line.strip(), True))
+            elif line.strip():
+                lines.append(line.strip())
+        if lines:
+            units.extend((sentence, False) for sentence in SENTENCE_END.split(" ".join(lines)) if sentence.strip())
+    return units
+
+
+class TokenAwareTextSplitter(TextSplitter):
+    """Split text into chunks of at most `chunk_size` tokens of the embedding model's tokenizer.
+    
+    Text is cut into headings and sentences, all of them tokenized in one batched call, and the
+    sentences are packed greedily up to the budget.  A heading always starts a new chunk, a chunk
+    never ends mid-sentence unless that sentence alone exceeds the budget, and the overlap is made
+    of whole trailing sentences of at most `chunk_overlap` tokens.
+    """
+    
+    def __init__(self, chunk_size=256, chunk_overlap=32, model="text-embedding-3-small", **kwargs):
+        self.encoding = get_encoding(model)
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=self.count_tokens, **kwargs)
+    
+    def count_tokens(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+    
+    def count_tokens_batch(self, texts):
+        """Token counts of many texts in one (multi-threaded) tokenizer call"""
+        if not texts:
+            return []
+        return [len(tokens) for tokens in self.encoding.encode_batch(list(texts), disallowed_special=())]
+    
+    def split_long_unit(self, unit):
+        """Cut a unit longer than the budget into windows of tokens"""
+        tokens = self.encoding.encode(unit, disallowed_special=())
+        step = self._chunk_size - self._chunk_overlap
+        return [
+            (self.encoding.decode(tokens[start:start + self._chunk_size]), min(self._chunk_size, len(tokens) - start))
+            for start in range(0, max(len(tokens) - self._chunk_overlap, 1), step)
+        ]
+    
+    def split_text(self, text):
+        units = split_units(text)
+        if not units:
+            return []
+        counts = self.count_tokens_batch([unit for unit, _ in units])
+        
+        chunks = []
+        current = []  # (text, tokens) of the chunk being built
+        current_tokens = 0
+        has_content = False
+        headings_only = False  # current holds just the headings of a new section
+        
+        def close_chunk():
+            nonlocal current, current_tokens, has_content
+            if has_content:
+                chunks.append(" ".join(part for part, _ in current))
+            # Carry whole trailing sentences as overlap
+            overlap = []
+            overlap_tokens = 0
+            for part, tokens in reversed(current if has_content else []):
+                if overlap_tokens + tokens > self._chunk_overlap:
+                    break
+                overlap.insert(0, (part, tokens))
+                overlap_tokens += tokens
+            current, current_tokens, has_content = overlap, overlap_tokens, False
+        
+        for (unit, heading), tokens in zip(units, counts):
+            if heading:
+                # A section starts a new chunk, without overlap from the previous section
+                if has_content:
+                    close_chunk()
+                if not headings_only:
+                    current, current_tokens = [], 0
+                current.append((unit, tokens))
+                current_tokens += tokens
+                headings_only = True
+                continue
+            
+            parts = self.split_long_unit(unit) if tokens > self._chunk_size else [(unit, tokens)]
+            for part, part_tokens in parts:
+                if current_tokens + part_tokens > self._chunk_size:
+                    if has_content:
+                        close_chunk()
+                    # Drop overlap (or headings) that no longer fits next to this part
+                    while current and current_tokens + part_tokens > self._chunk_size:
+                        current_tokens -= current.pop(0)[1]
+                current.append((part, part_tokens))
+                current_tokens += part_tokens
+                has_content = True
+                headings_only = False
+        
+        if has_content or (current and not chunks):
+            has_content = True
+            close_chunk()
+        
+        return chunks
@@ -0,0 +1,235 @@
+import os
+import atexit
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+
+class UsageLedger:
+    """Buffer per-call usage events and flush them in batches to the backend cost API or a local spool file.
+
+    Recording never blocks a chat turn: events go into a bounded in-memory queue and a
+    background thread writes them out.  When the backend is not configured or unreachable,
+    batches are appended to a JSON-lines spool file so no usage is lost; the spool is
+    replayed to the backend (and truncated) after the next successful send.
+    """
+
+    def __init__(
+        self,
+        api_base_url=None,
+        api_token=None,
+        user_id=None,
+        organization_id=None,
+        spool_path="usage_spool.jsonl",
+        batch_size=50,
+        flush_interval=5.0,
+        max_queue_size=10000,
+    ):
+        self.api_base_url = api_base_url
+        self.api_token = api_token
+        self.user_id = user_id
+        self.organization_id = organization_id
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.events = queue.Queue(maxsize=max_queue_size)
+        self.dropped_events = 0
+        self.flushed_events = 0
+        self.spooled_events = 0
+        self.replayed_events = 0
+
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(
+            target=self._run, name="usage-ledger", daemon=True
+        )
+        self._worker.start()
+
+    def record(
+        self,
+        model,
+        input_tokens,
+        output_tokens,
+        cost,
+        cached_tokens=0,
+        latency=None,
+        feature="chat",
+    ) -> None:
+        """Queue a usage event.  Returns immediately; the event is dropped if the buffer is full."""
+        event = {
+            "timestamp": datetime.now().isoformat(),
+            "model": model,
+            "feature": feature,
+            "input_tokens": int(input_tokens or 0),
+            "output_tokens": int(output_tokens or 0),
+            "cached_tokens": int(cached_tokens or 0),
+            "latency": latency,
+            "cost": float(cost or 0),
+        }
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.dropped_events += 1
+
+    def flush(self) -> int:
+        """Write out everything currently buffered.  Returns the number of events flushed."""
+        flushed = 0
+        with self._flush_lock:
+            while True:
+                batch = self._drain(self.batch_size)
+                if not batch:
+                    break
+                self._write_batch(batch)
+                flushed += len(batch)
+        return flushed
+
+    def close(self) -> None:
+        """Stop the background worker and flush remaining events."""
+        self._stop.set()
+        self._worker.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+    def get_stats(self) -> dict:
+        """Return ledger counters for monitoring"""
+        return {
+            "pending_events": self.events.qsize(),
+            "flushed_events": self.flushed_events,
+            "spooled_events": self.spooled_events,
+            "replayed_events": self.replayed_events,
+            "dropped_events": self.dropped_events,
+        }
+
+    def _run(self):
+        """Background loop: flush whenever a batch fills up or the flush interval elapses"""
+        last_flush = time.monotonic()
+        while not self._stop.is_set():
+            self._stop.wait(0.2)
+            if (
+                self.events.qsize() >= self.batch_size
+                or time.monotonic() - last_flush >= self.flush_interval
+            ):
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Error flushing usage ledger: {e}")
+                last_flush = time.monotonic()
+
+    def _drain(self, limit):
+        """Take up to `limit` events off the queue"""
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        """Send a batch to the backend, falling back to the spool file"""
+        if self.api_base_url and self.api_token and self.user_id is not None:
+            try:
+                self._post_batch(batch)
+                self.flushed_events += len(batch)
+            except Exception as e:
+                print(f"Could not send usage batch to backend, spooling locally: {e}")
+            else:
+                # The backend is reachable again: send what was spooled while it was not
+                self._replay_spool()
+                return
+        self._spool_batch(batch)
+
+    def _post_batch(self, batch):
+        """POST a batch to the backend `/costs/usage/batch/` endpoint"""
+        records = [
+            {
+                "userId": self.user_id,
+                "organizationId": self.organization_id,
+                "feature": event["feature"],
+                "model": event.get("model"),
+                "tokens_used": event["input_tokens"] + event["output_tokens"],
+                "input_tokens": event["input_tokens"],
+                "output_tokens": event["output_tokens"],
+                "cached_tokens": event.get("cached_tokens", 0),
+                "latency": event.get("latency"),
+                "cost": event["cost"],
+                "timestamp": event.get("timestamp"),
+            }
+            for event in batch
+        ]
+        response = requests.post(
+            f"{self.api_base_url}/costs/usage/batch/",
+            json={"records": records},
+            headers={"Authorization": f"Bearer {self.api_token}"},
+            timeout=10,
+        )
+        response.raise_for_status()
+
+    def _replay_spool(self):
+        """Send the spooled events to the backend in batches, keeping whatever could not be sent.
+        Called with the flush lock held, so no batch is spooled while the file is rewritten."""
+        if not os.path.exists(self.spool_path):
+            return
+
+        lines = []
+        with open(self.spool_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    json.loads(line)
+                except ValueError:
+                    # blank, or cut short by a crash mid-write: it can never be sent
+                    continue
+                lines.append(line)
+
+        sent = 0
+        try:
+            for start in range(0, len(lines), self.batch_size):
+                chunk = lines[start:start + self.batch_size]
+                self._post_batch([json.loads(line) for line in chunk])
+                sent += len(chunk)
+        except Exception as e:
+            print(f"Could not replay usage spool, keeping it for later: {e}")
+        self.replayed_events += sent
+        self.flushed_events += sent
+
+        remaining = lines[sent:]
+        if remaining:
+            tmp_path = self.spool_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(remaining)
+            os.replace(tmp_path, self.spool_path)
+        else:
+            os.remove(self.spool_path)
+
+    def _spool_batch(self, batch):
+        """Append a batch to the local JSON-lines spool file"""
+        with open(self.spool_path, "a", encoding="utf-8") as f:
+            for event in batch:
+                f.write(json.dumps(event) + "\n")
+        self.spooled_events += len(batch)
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger():
+    """Return the process-wide usage ledger, configured from environment variables"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            user_id = os.getenv("USAGE_LEDGER_USER_ID")
+            organization_id = os.getenv("USAGE_LEDGER_ORGANIZATION_ID")
+            _ledger = UsageLedger(
+                api_base_url=os.getenv("USAGE_LEDGER_API_URL", os.getenv("API_BASE_URL")),
+                api_token=os.getenv("USAGE_LEDGER_API_TOKEN"),
+                user_id=int(user_id) if user_id else None,
+                organization_id=int(organization_id) if organization_id else None,
+                spool_path=os.getenv("USAGE_LEDGER_SPOOL_PATH", "usage_spool.jsonl"),
+            )
+            atexit.register(_ledger.close)
+        return _ledger
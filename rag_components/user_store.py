@@ -0,0 +1,141 @@
+import atexit
+import sqlite3
+import threading
+
+
+USER_COLUMNS = ["username", "email", "role", "department", "password_hash", "created_at", "last_login"]
+
+
+class UserStore:
+    """sqlite table of users, keyed by username, replacing the users.json rewrites.
+    
+    Every change is a single-row statement in its own transaction, so concurrent sessions and
+    processes (WAL mode) never overwrite each other's writes and cost does not grow with the number
+    of users.  Logins only record `last_login`: these updates are coalesced per user in memory and
+    written in one batch every `flush_interval` seconds (and at exit) by a background thread.
+    """
+    
+    def __init__(self, path, flush_interval=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                email TEXT,
+                role TEXT NOT NULL,
+                department TEXT,
+                password_hash TEXT NOT NULL,
+                created_at TEXT,
+                last_login TEXT
+            )"""
+        )
+        self.connection.commit()
+        
+        self.pending_logins = {}  # username -> latest login time not yet written
+        self.pending_lock = threading.Lock()
+        self.stop = threading.Event()
+        self.worker = threading.Thread(target=self.run, name="user-store-logins", daemon=True)
+        self.worker.start()
+        atexit.register(self.close)
+    
+    def get(self, username):
+        """The user's row as a dict, or None"""
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE username = ?", (username,)
+            ).fetchone()
+        if row is None:
+            return None
+        data = dict(zip(USER_COLUMNS, row))
+        with self.pending_lock:
+            data["last_login"] = self.pending_logins.get(username, data["last_login"])
+        return data
+    
+    def all(self):
+        with self.lock:
+            rows = self.connection.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users ORDER BY username").fetchall()
+        return [dict(zip(USER_COLUMNS, row)) for row in rows]
+    
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    
+    def insert(self, data):
+        """Insert a user.  Returns False if the username is taken."""
+        with self.lock:
+            try:
+                self.connection.execute(
+                    f"INSERT INTO users ({', '.join(USER_COLUMNS)}) VALUES ({', '.join('?' for _ in USER_COLUMNS)})",
+                    [data.get(column) for column in USER_COLUMNS]
+                )
+                self.connection.commit()
+                return True
+            except sqlite3.IntegrityError:
+                self.connection.rollback()
+                return False
+    
+    def update(self, username, **fields):
+        """Set some columns of a user.  Returns False if there is no such user or no known column."""
+        assignments = ", ".join(f"{column} = ?" for column in fields if column in USER_COLUMNS)
+        if not assignments:
+            return False
+        with self.lock:
+            cursor = self.connection.execute(
+                f"UPDATE users SET {assignments} WHERE username = ?",
+                [value for column, value in fields.items() if column in USER_COLUMNS] + [username]
+            )
+            self.connection.commit()
+            return cursor.rowcount > 0
+    
+    def delete(self, username):
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM users WHERE username = ?", (username,))
+            self.connection.commit()
+        with self.pending_lock:
+            self.pending_logins.pop(username, None)
+        return cursor.rowcount > 0
+    
+    def record_login(self, username, timestamp):
+        """Queue a last_login update; only the latest per user is written"""
+        with self.pending_lock:
+            self.pending_logins[username] = timestamp
+    
+    def flush(self):
+        """Write the queued last_login updates in one transaction.  Returns how many were written."""
+        with self.pending_lock:
+            pending, self.pending_logins = self.pending_logins, {}
+        if not pending:
+            return 0
+        try:
+            with self.lock:
+                # Never move last_login backwards if another process wrote a later one
+                self.connection.executemany(
+                    "UPDATE users SET last_login = ? WHERE username = ? AND (last_login IS NULL OR last_login < ?)",
+                    [(timestamp, username, timestamp) for username, timestamp in pending.items()]
+                )
+                self.connection.commit()
+        except Exception:
+            # Keep the updates for the next flush, unless a newer login was queued meanwhile
+            with self.pending_lock:
+                for username, timestamp in pending.items():
+                    self.pending_logins.setdefault(username, timestamp)
+            raise
+        return len(pending)
+    
+    def run(self):
+        """Background loop flushing login updates every flush_interval seconds"""
+        while not self.stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing user logins: {e}")
+    
+    def close(self):
+        if self.stop.is_set():
+            return
+        self.stop.set()
+        self.worker.join(timeout=self.flush_interval + 1)
+        self.flush()
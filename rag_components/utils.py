@@ -1,8 +1,15 @@
 import os
 import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
 
+# Metadata that decides who may read a chunk; identical text with a different scope is not a duplicate
+ACCESS_SCOPE_FIELDS = ("type", "department", "access_role")
+
+
 def create_directories():
     """Create necessary directories for the RAG system"""
     directories = [
@@ -57,4 +64,86 @@ def format_citations(source_documents):
             citation += f"[{doc.metadata['source']}]"
         citations.append(citation)
     
-    return citations
\ No newline at end of file
+    return citations
+
+
+def content_hash(content):
+    """SHA-256 of text or bytes"""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_content_hash(file_path, block_size=1 << 20):
+    """SHA-256 of a file's contents, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scoped_hash(digest, metadata):
+    """Combine a content hash with the access scope of its metadata, used as a deduplication key"""
+    scope = "|".join(str(metadata.get(field, "")) for field in ACCESS_SCOPE_FIELDS)
+    return content_hash(f"{digest}|{scope}")
+
+
+class ReadWriteLock:
+    """Lock shared by many readers or held by one writer.
+    
+    `with lock:` takes the write side, reentrant for the writing thread (like an RLock), and
+    `with lock.read():` the read side; the writer may also read.  Waiting writers block new
+    readers, so a steady stream of searches cannot starve an upload.  Read sections must not nest.
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None
+        self.writer_depth = 0
+        self.waiting_writers = 0
+    
+    def acquire(self):
+        me = threading.get_ident()
+        with self.condition:
+            if self.writer == me:
+                self.writer_depth += 1
+                return True
+            self.waiting_writers += 1
+            while self.writer is not None or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = me
+            self.writer_depth = 1
+        return True
+    
+    def release(self):
+        with self.condition:
+            self.writer_depth -= 1
+            if not self.writer_depth:
+                self.writer = None
+                self.condition.notify_all()
+    
+    def __enter__(self):
+        return self.acquire()
+    
+    def __exit__(self, *exc_info):
+        self.release()
+    
+    @contextmanager
+    def read(self):
+        with self.condition:
+            owned = self.writer == threading.get_ident()
+            if not owned:
+                while self.writer is not None or self.waiting_writers:
+                    self.condition.wait()
+                self.readers += 1
+        try:
+            yield
+        finally:
+            if not owned:
+                with self.condition:
+                    self.readers -= 1
+                    if not self.readers:
+                        self.condition.notify_all()